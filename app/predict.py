@@ -2,20 +2,36 @@
 Prediction engine for the flask web application
 """
 
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.naive_bayes import MultinomialNB
+from src.batch_predict import rank_cities, format_ranking, format_explanation
 
-def prediction(model, input):
+def prediction(service, input):
     """
-    Take a model and string input and return a city prediction.
-    :param model: a fitted model object.
+    Take a prediction service and string input and return a city prediction.
+    :param service: PredictionService, wrapping a fitted model object.
     :param input: str, the input from the web app.
-    :return: str, the predicted city
+    :return: tuple of (list, list), the cities and their probabilities,
+             most likely first, and the terms that contributed most to the
+             top city (empty if the service does not explain predictions)
     """
-    classes = {0: "San Francisco, CA", 1: "New York, NY", 2: "Chicago, IL",
-               3: "Austin, TX"}
-    data = model.processing.transform(input)
-    probs = model.model.predict_proba(data)[0]
-    output = [(v, probs[k]) for k, v in classes.items() if k < len(probs)]
-    output = sorted(output, key=lambda x: x[1], reverse=True)
-    return [(tup[0], str.format("{0:.4f}", tup[1])) for tup in output]
+    probs, classes, _, explanations = service.predict([input])
+    output = rank_cities(probs, classes)[0]
+    terms = [term for term, _ in explanations[0]] if explanations else []
+    return [(tup[0], str.format("{0:.4f}", tup[1])) for tup in output], terms
+
+def batch_prediction(service, documents):
+    """
+    Take a prediction service and a list of string inputs and return the
+    city probabilities of each one.
+    :param service: PredictionService, wrapping a fitted model object.
+    :param documents: list of str, the job descriptions.
+    :return: tuple of (list of dicts, version), the ranked city
+             probabilities (and top terms, if applicable) of each document
+             and the model version
+    """
+    probs, classes, version, explanations = service.predict(documents)
+    output = [{"id": i, "predictions": format_ranking(ranked)}
+              for i, ranked in enumerate(rank_cities(probs, classes))]
+    if explanations is not None:
+        for result, terms in zip(output, explanations):
+            result["explanation"] = format_explanation(terms)
+    return output, version
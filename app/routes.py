@@ -3,15 +3,54 @@ File containing the flask routes.
 """
 
 from flask import Flask
-from flask import render_template, request
+from flask import render_template, request, jsonify
 from app import app
-import pickle
-from .predict import prediction
+import os
+from .predict import prediction, batch_prediction
+from src.token_cache import TokenCache, set_token_cache
+from src.prediction_service import PredictionService, ModelWatcher
 
-#Load in the model when the app initializes
-with open("model.pkl", "rb") as f:
-    model = pickle.load(f)
+#Load in the model when the app initializes. A model artifact directory is
+#memory mapped, so it loads quickly and its pages are shared by every worker.
+#A pickled model is used if there is no artifact
+model_path = os.environ.get("JHP_MODEL_PATH", "model")
+if not os.path.isdir(model_path) and os.path.exists("model.pkl"):
+    model_path = "model.pkl"
 
+#Cache the predictions of repeated postings. Set JHP_MICRO_BATCH=1 to score
+#concurrent requests together, when running with several threads
+service = PredictionService(cache_size=int(os.environ.get("JHP_CACHE_SIZE", 10000)),
+                            batching=os.environ.get("JHP_MICRO_BATCH") == "1",
+                            max_wait=float(os.environ.get("JHP_MAX_WAIT_MS", 5)) / 1000,
+                            explain=int(os.environ.get("JHP_EXPLAIN_TERMS", 5)))
+
+#Reload the model when a new one is saved to the model path
+watcher = ModelWatcher(model_path, service,
+                       interval=float(os.environ.get("JHP_RELOAD_SECONDS", 5)))
+watcher.check(force=True)
+
+#Reuse the stemmed/lemmatized words saved when the model was built
+if os.path.exists("token_cache.pkl"):
+    set_token_cache(TokenCache.load("token_cache.pkl"))
+
+
+def _documents(data):
+    """
+    Get the documents of a JSON request: a list of strings, an object with a
+    "documents" list, or an object with a single "text".
+    :param data: the parsed JSON body.
+    :return: list of str, or None if the body is not valid.
+    """
+    if isinstance(data, dict):
+        data = [data["text"]] if "text" in data else data.get("documents")
+    if not isinstance(data, list) or not all(isinstance(doc, str) for doc in data):
+        return None
+    return data
+
+
+@app.before_request
+def reload_model():
+    watcher.check()
 
 @app.route("/")
 @app.route("/index")
@@ -20,6 +59,41 @@ def index():
 
 @app.route("/predict", methods=["POST"])
 def analyze_text():
+    if not service.ready:
+        return "The model is not loaded yet", 503
     doc = request.form['text1']
-    pred = prediction(model, doc)
-    return render_template('index.html', title="City Prediction", data=pred)
\ No newline at end of file
+    pred, terms = prediction(service, doc)
+    return render_template('index.html', title="City Prediction", data=pred, terms=terms)
+
+@app.route("/predict_batch", methods=["POST"])
+@app.route("/api/v1/predict", methods=["POST"])
+def predict_batch():
+    """
+    Score a JSON list of job descriptions, an object with a "documents"
+    list, or an object with a single "text", and return the ranked city
+    probabilities of each one, the terms that contributed most to its top
+    city, and the version of the model used.
+    """
+    if not service.ready:
+        return jsonify(error="The model is not loaded yet"), 503
+    documents = _documents(request.get_json(force=True, silent=True))
+    if documents is None:
+        return jsonify(error="Expected a list of job description strings"), 400
+    predictions, version = batch_prediction(service, documents)
+    return jsonify(model_version=version, predictions=predictions)
+
+@app.route("/ready")
+def ready():
+    """
+    Readiness check: succeeds once a model has been loaded.
+    """
+    status = {"ready": service.ready, "model_version": service.version,
+              "model_path": model_path, "reload_error": watcher.error}
+    return jsonify(status), 200 if service.ready else 503
+
+@app.route("/stats")
+def stats():
+    """
+    Report the prediction cache hit rate and latency percentiles.
+    """
+    return jsonify(service.stats())
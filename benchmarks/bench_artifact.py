@@ -0,0 +1,111 @@
+"""
+Benchmark the cold start of a web worker: the time to load a model, the
+memory it takes, and the latency of the first prediction, comparing a
+pickled JHPModel with a memory mapped model artifact.
+Each model is loaded in a fresh Python process. Memory is read from
+/proc/self/status: anonymous memory (RssAnon) is private to each worker,
+while file backed memory (RssFile), eg the memory mapped arrays, is shared
+by every worker that maps the same files.
+Call: python -m benchmarks.bench_artifact [n_rows]
+"""
+
+from sys import argv
+from time import perf_counter
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.naive_bayes import MultinomialNB
+from src.build_model import JHPModel
+from src.model_artifact import save_artifact, load_artifact
+from .bench_loading import synthetic_listings
+
+DOCUMENT = "Python SQL machine learning statistics and data visualization"
+
+
+def memory_mb():
+    """
+    Get the resident memory of this process.
+    :return: dict mapping VmRSS, RssAnon and RssFile to MB.
+    """
+    memory = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "RssAnon", "RssFile"):
+                memory[name] = int(value.split()[0]) / 1024
+    return memory
+
+
+def cold_start(kind, path):
+    """
+    Load a model and make one prediction, as a web worker does on startup.
+    :param kind: str, "pickle" or "artifact".
+    :param path: str, the pkl file or artifact directory.
+    :return: dict of the timings and memory.
+    """
+    before = memory_mb()
+    start = perf_counter()
+    if kind == "pickle":
+        with open(path, "rb") as f:
+            model = pickle.load(f)
+    else:
+        model = load_artifact(path)
+    load_seconds = perf_counter() - start
+    start = perf_counter()
+    model.model.predict_proba(model.processing.transform(DOCUMENT))
+    predict_seconds = perf_counter() - start
+    after = memory_mb()
+    return {"load seconds": load_seconds, "first predict seconds": predict_seconds,
+            "RSS MB": after["VmRSS"] - before["VmRSS"],
+            "anon MB": after["RssAnon"] - before["RssAnon"],
+            "file MB": after["RssFile"] - before["RssFile"]}
+
+
+def size_mb(path):
+    """
+    Get the size of a file, or of every file in a directory.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 1024 ** 2
+    return sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path)) / 1024 ** 2
+
+
+if __name__ == "__main__":
+    if len(argv) > 1 and argv[1] == "--cold-start":
+        print(json.dumps(cold_start(argv[2], argv[3])))
+        sys.exit()
+
+    n_rows = int(argv[1]) if len(argv) > 1 else 20000
+    jhp = JHPModel(MultinomialNB(), n_grams=(1, 2))
+    jhp.fit(synthetic_listings(n_rows))
+    print("{} rows, {} terms".format(n_rows, len(jhp.processing.vectorize.vocabulary_)))
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {"pickle": os.path.join(tmp, "model.pkl"),
+                 "artifact": os.path.join(tmp, "model")}
+        with open(paths["pickle"], "wb") as f:
+            pickle.dump(jhp, f)
+        save_artifact(jhp, paths["artifact"])
+
+        rows = []
+        for kind, path in paths.items():
+            output = subprocess.run([sys.executable, "-m", "benchmarks.bench_artifact",
+                                     "--cold-start", kind, path],
+                                    stdout=subprocess.PIPE, check=True).stdout
+            rows.append(dict(format=kind, **{"size MB": size_mb(path)},
+                             **json.loads(output.decode().splitlines()[-1])))
+        print(pd.DataFrame(rows).to_string(index=False))
+
+        docs = pd.DataFrame({"job_description": synthetic_listings(1000, seed=1)
+                             ["job_description"].dropna()})
+        artifact = load_artifact(paths["artifact"])
+        expected = jhp.model.predict_proba(jhp.processing.transform(docs))
+        actual = artifact.model.predict_proba(artifact.processing.transform(docs))
+        print("Same predictions: {}, max probability difference: {:.2g}".format(
+            np.array_equal(expected.argmax(axis=1), actual.argmax(axis=1)),
+            np.abs(expected - actual).max()))
@@ -0,0 +1,87 @@
+"""
+Benchmark the time and peak memory of labelling listings and cleaning Indeed
+postings, comparing the previous implementation, which copies the data and
+re-appends the cleaned rows, with the in-place one, on a synthetic corpus.
+Both outputs are checked to be the same, up to row order.
+Call: python -m benchmarks.bench_cleaning [n_rows]
+"""
+
+from sys import argv
+import pandas as pd
+from src.dataframe_processing import (_process_chunk, city_labels,
+                                      clean_indeed_jobs)
+from .bench_loading import synthetic_listings, measure
+
+
+def legacy_create_labels(df):
+    """
+    The previous create_labels: city terms are replaced one string at a time.
+    """
+    replace_dict = {"San+Francisco": 0,
+                    "New+York": 1,
+                    "Chicago": 2,
+                    "Austin": 3}
+    df["label"] = df["city_term"].replace(replace_dict)
+    return df
+
+
+def legacy_clean_indeed_jobs(df):
+    """
+    The previous clean_indeed_jobs: the descriptions are searched twice, the
+    cleaned rows are copied, dropped and appended back to the end, and the
+    index is reset. DataFrame.append is replaced by the equivalent pd.concat.
+    """
+    field = "job_description"
+    df["cleaned"] = df[field].str.contains("Indeed - Cookies, Privacy and Terms")
+    df2 = df[df["cleaned"]].copy()
+    df2[field] = df2[field].apply(lambda x: max(x.split('\n'), key=len).split("Job Type:")[0])
+    df2["cleaned"] = ~df2["job_description"].str.contains("We know salary is a key component")
+    df2 = df2[df2["cleaned"]]
+    idx = df2.index.values
+    df = df.drop(idx)
+    return pd.concat([df, df2], ignore_index=True)
+
+
+def legacy_process(df, num_cities=2):
+    """
+    The previous create_model_data steps after importing the data.
+    """
+    df = df[df["job_description"].notnull()]
+    df = df.drop_duplicates("job_description")
+    df = df[~df["job_description"].str.contains("403")].copy()
+    df = legacy_create_labels(df)
+    df = df[df["label"] < num_cities].copy()
+    return legacy_clean_indeed_jobs(df)
+
+
+def by_url(df):
+    """
+    Sort processed listings by url, to compare outputs in different orders.
+    """
+    columns = ["url", "job_description", "label", "cleaned"]
+    return df[columns].sort_values("url").reset_index(drop=True).astype(
+        {"label": int})
+
+
+if __name__ == "__main__":
+    n_rows = int(argv[1]) if len(argv) > 1 else 50000
+    listings = synthetic_listings(n_rows)
+    print("{} rows, {:.1f} MB of descriptions".format(
+        n_rows, listings["job_description"].str.len().sum() / 1024 ** 2))
+    # The labelling and cleaning stage alone, on usable rows
+    usable = listings[listings["job_description"].notnull()]
+    rows, outputs = [], {}
+    for name, stage, func in [
+            ("legacy", "labels and cleaning",
+             lambda: legacy_clean_indeed_jobs(legacy_create_labels(usable.copy()))),
+            ("in place", "labels and cleaning",
+             lambda: clean_indeed_jobs(usable.assign(label=city_labels(usable["city_term"])))),
+            ("legacy", "create_model_data", lambda: legacy_process(listings)),
+            ("in place", "create_model_data", lambda: _process_chunk(listings, 2))]:
+        seconds, peak, outputs[name, stage] = measure(func)
+        rows.append({"implementation": name, "stage": stage, "seconds": seconds,
+                     "peak MB": peak, "rows": len(outputs[name, stage])})
+    print(pd.DataFrame(rows).to_string(index=False))
+    stage = "create_model_data"
+    print("Same output: {}".format(by_url(outputs["legacy", stage]).equals(
+        by_url(outputs["in place", stage]))))
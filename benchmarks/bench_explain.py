@@ -0,0 +1,70 @@
+"""
+Benchmark prediction explanations: the time to find the top terms of one
+document, as on every web request, and of a batch of documents, and the
+time to find a model's most and least informative features compared with
+the previous full sort of (importance, feature) pairs.
+Call: python -m benchmarks.bench_explain [n_rows] [k]
+"""
+
+from sys import argv
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.naive_bayes import MultinomialNB
+from src.build_model import JHPModel
+from src.explain import explain_rows, feature_names, informative_features
+from .bench_loading import synthetic_listings
+
+
+def legacy_informative_features(jhp_model, n):
+    """
+    The previous show_informative_features, without printing: every feature
+    name is listed and every (importance, feature) pair is sorted.
+    """
+    names = jhp_model.processing.vectorize.get_feature_names_out()
+    coefs_names = sorted(zip(jhp_model.model.feature_importances_, names))
+    return list(zip(coefs_names[:n], coefs_names[:-(n + 1):-1]))
+
+
+def best_of(func, repeat=5):
+    """
+    Time a function.
+    :param func: callable with no arguments.
+    :param repeat: int, the number of runs.
+    :return: float, the fastest run in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    n_rows = int(argv[1]) if len(argv) > 1 else 10000
+    k = int(argv[2]) if len(argv) > 2 else 5
+    listings = synthetic_listings(n_rows)
+    docs = listings["job_description"].dropna().iloc[:1000]
+    rows = []
+    for model in [MultinomialNB(), RandomForestClassifier(50, random_state=0)]:
+        jhp = JHPModel(model, n_grams=(1, 2))
+        jhp.fit(listings)
+        name = type(model).__name__
+        features = jhp.processing.transform(pd.DataFrame({"job_description": docs}))
+        predicted = jhp.model.predict_proba(features).argmax(axis=1)
+        # The first call builds the cached feature names and class weights
+        explain_rows(jhp, features[:1], predicted[:1], k)
+        rows.append({"model": name, "task": "explain 1 document",
+                     "ms": best_of(lambda: explain_rows(jhp, features[:1], predicted[:1], k)) * 1000})
+        rows.append({"model": name, "task": "explain {} documents".format(len(docs)),
+                     "ms": best_of(lambda: explain_rows(jhp, features, predicted, k)) * 1000})
+        if hasattr(model, "feature_importances_"):
+            names = feature_names(jhp.processing.vectorize)
+            rows.append({"model": name, "task": "informative features (legacy sort)",
+                         "ms": best_of(lambda: legacy_informative_features(jhp, 20)) * 1000})
+            rows.append({"model": name, "task": "informative features (argpartition)",
+                         "ms": best_of(lambda: informative_features(jhp.model, names, 20)) * 1000})
+        print("{}: {} features".format(name, features.shape[1]))
+    print(pd.DataFrame(rows).to_string(index=False))
@@ -0,0 +1,80 @@
+"""
+Benchmark feature reduction: cross-validated accuracy, model fitting time,
+peak memory, training matrix size and pickled model size of each classifier
+with every feature, and with the top k features by chi2 or mutual
+information or k hashed columns, for several values of k. Every matrix is float32.
+The synthetic listings get a few words that depend on the city, so that
+there is something to select.
+Call: python -m benchmarks.bench_feature_selection [n_rows] [models]
+"""
+
+from sys import argv
+import numpy as np
+from src.dataframe_processing import create_model_data
+from src.nlp_processing import NLPProcessing
+from src.model_search import ModelSearch
+from .bench_loading import synthetic_listings, CITIES
+
+
+def with_city_terms(listings, words=3, seed=0):
+    """
+    Add words drawn from a vocabulary of each city to the descriptions. The
+    words start the longest line, which is the part of Indeed postings that
+    cleaning keeps.
+    :param listings: Pandas DataFrame of synthetic listings.
+    :param words: int, the number of words added to each description.
+    :param seed: int, the random seed.
+    :return: Pandas DataFrame
+    """
+    rng = np.random.RandomState(seed)
+    vocabularies = {city: ["{}term{}".format(city.split("+")[0].lower(), i) for i in range(20)]
+                    for city in CITIES}
+    descriptions = []
+    for text, city in zip(listings["job_description"].values, listings["city_term"].values):
+        if isinstance(text, str):
+            lines = text.split("\n")
+            longest = lines.index(max(lines, key=len))
+            lines[longest] = " ".join(rng.choice(vocabularies[city], words)) + " " + lines[longest]
+            text = "\n".join(lines)
+        descriptions.append(text)
+    return listings.assign(job_description=descriptions)
+
+
+def check_training_features(listings, n_features=500):
+    """
+    Check that the reduced training matrix of each selection method is the
+    matrix that transform returns for the training documents, so models are
+    fitted on features scaled as the ones they predict on. Without stemming
+    or stop words, fit_transform vectorizes the training documents as
+    transform does.
+    :param listings: Pandas DataFrame of synthetic listings.
+    :param n_features: int, the number of features to keep.
+    """
+    df = create_model_data(listings, num_cities=4)
+    for selection in ["chi2", "mutual_info", "hash"]:
+        processing = NLPProcessing(num_cities=4, n_grams=(1, 2), use_stopwords=False,
+                                   n_features=n_features, selection=selection,
+                                   dtype="float32")
+        x = processing.select_features(processing.fit_transform(df), df["label"].values)
+        difference = abs(x - processing.transform(df))
+        assert difference.nnz == 0 or difference.max() < 1e-6, selection
+
+
+if __name__ == "__main__":
+    n_rows = int(argv[1]) if len(argv) > 1 else 4000
+    models = argv[2].split(",") if len(argv) > 2 else ["naive_bayes", "random_forest",
+                                                       "xgboost"]
+    listings = with_city_terms(synthetic_listings(n_rows))
+    check_training_features(listings)
+    common = {"model": models, "n_grams": [(1, 2)], "dtype": ["float32"]}
+    grid = [dict(common, n_features=[None]),
+            dict(common, n_features=[500, 2000, 10000],
+                 selection=["chi2", "mutual_info", "hash"])]
+    search = ModelSearch(grid, n_splits=3, num_cities=4, random_state=0)
+    results = search.fit(listings)
+    every = results["n_features"].isnull()
+    results["n_features"] = results["n_features"].fillna(0).astype(int).astype(str)
+    results.loc[every, ["n_features", "selection"]] = ["all", "-"]
+    print(results.sort_values(["model", "n_features", "selection"]).to_string(
+        index=False, columns=["model", "n_features", "selection", "accuracy", "fit_time",
+                              "featurize_time", "peak_mb", "feature_mb", "model_mb"]))
@@ -0,0 +1,50 @@
+"""
+Benchmark retraining with a feature store: the time to fit a JHPModel on a
+corpus without a store, with an empty store, and with a store that already
+holds every document but a new 1% daily scrape.
+Call: python -m benchmarks.bench_feature_store [n_rows] [stemlem]
+"""
+
+from sys import argv
+from time import perf_counter
+import os
+import tempfile
+import pandas as pd
+from sklearn.naive_bayes import MultinomialNB
+from src.build_model import JHPModel
+from src.feature_store import FeatureStore
+from .bench_loading import synthetic_listings
+
+
+def timed_fit(data, stemlem, store=None):
+    """
+    Fit a model and time it.
+    :param data: Pandas DataFrame of listings.
+    :param stemlem: str, the stemming/lemmatizing methods to use.
+    :param store: FeatureStore, if applicable.
+    :return: float, the time in seconds.
+    """
+    start = perf_counter()
+    JHPModel(MultinomialNB(), stemlem=stemlem, n_grams=(1, 2), min_df=2,
+             feature_store=store).fit(data)
+    return perf_counter() - start
+
+
+if __name__ == "__main__":
+    n_rows = int(argv[1]) if len(argv) > 1 else 20000
+    stemlem = argv[2] if len(argv) > 2 else "porter"
+    history = synthetic_listings(n_rows)
+    grown = pd.concat([history, synthetic_listings(n_rows // 100, seed=1)], ignore_index=True)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        store = FeatureStore(os.path.join(tmp, "features.db"))
+        rows.append({"fit": "no store", "seconds": timed_fit(grown, stemlem)})
+        rows.append({"fit": "empty store", "seconds": timed_fit(history, stemlem, store)})
+        misses = store.misses
+        rows.append({"fit": "store, 1% new", "seconds": timed_fit(grown, stemlem, store)})
+        rows.append({"fit": "store, no change", "seconds": timed_fit(grown, stemlem, store)})
+        print("{} listings, {} new; documents processed on the 1% rebuild: {}".format(
+            len(history), len(grown) - len(history), store.misses - misses))
+        print("store size: {:.1f} MB".format(os.path.getsize(store.path) / 2 ** 20))
+        store.close()
+    print(pd.DataFrame(rows).to_string(index=False))
@@ -0,0 +1,58 @@
+"""
+Benchmark the fetch engine against a local stub of indeed.com.
+Call: python -m benchmarks.bench_fetch [n_listings] [latency]
+"""
+
+from sys import argv
+from time import perf_counter
+from tempfile import TemporaryDirectory
+import pandas as pd
+from src.fetch_engine import FetchEngine
+from src.storage import ListingStore, LocalBackend
+from src.web_scraper import IndeedScraper
+from .stub_indeed import StubIndeedServer
+
+
+def time_fetch(urls, **kwargs):
+    """
+    Time fetching every URL with a fetch engine.
+    :param urls: list of str, the URLs to fetch.
+    :param kwargs: keyword arguments for the FetchEngine.
+    :return: float, elapsed seconds.
+    """
+    engine = FetchEngine(**kwargs)
+    start = perf_counter()
+    pages = engine.fetch_all(urls)
+    elapsed = perf_counter() - start
+    engine.close()
+    assert all(page is not None for page in pages)
+    return elapsed
+
+
+if __name__ == "__main__":
+    n_listings = int(argv[1]) if len(argv) > 1 else 100
+    latency = float(argv[2]) if len(argv) > 2 else 0.05
+    server = StubIndeedServer(n_pages=2, per_page=n_listings // 2, latency=latency)
+    urls = ["{}/viewjob?jk={}".format(server.url, i) for i in range(n_listings)]
+
+    rows = []
+    for workers, rate in [(1, None), (4, None), (8, None), (8, 50.0)]:
+        elapsed = time_fetch(urls, max_workers=workers, rate=rate)
+        rows.append({"workers": workers, "rate": rate, "seconds": elapsed,
+                     "pages/sec": n_listings / elapsed})
+    print(pd.DataFrame(rows).to_string(index=False))
+
+    # End to end run of the scraper in concurrent mode
+    with TemporaryDirectory() as tmp:
+        scraper = IndeedScraper(None, None, "Data+Scientist", "Austin",
+                                concurrency=8, base_url=server.url,
+                                fetcher=FetchEngine(max_workers=8, rate=None),
+                                store=ListingStore(LocalBackend(tmp)))
+        start = perf_counter()
+        scraper.run_scraper()
+        elapsed = perf_counter() - start
+    print("Concurrent scraper: {} listings in {:.2f}s ({} requests)"
+          .format(scraper.n_saved, elapsed, server.requests))
+    print("Serial scraper would sleep for at least {}s"
+          .format(2 * (n_listings + 2)))
+    server.close()
@@ -0,0 +1,80 @@
+"""
+Benchmark per-request scoring latency of each classifier's predict_proba
+against the scoring kernel compiled from it, as the web application serves
+single postings: the latency of scoring one vectorized posting, of a whole
+request through a PredictionService loaded from a model artifact with and
+without the kernel, and the time to score a batch of postings. Also reports
+the largest difference between the kernel's probabilities and the model's.
+Call: python -m benchmarks.bench_inference [n_rows] [n_requests] [models]
+"""
+
+from sys import argv
+from time import perf_counter
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from src.build_model import JHPModel
+from src.inference_kernels import compile_model
+from src.model_artifact import save_artifact, load_artifact
+from src.model_search import MODELS
+from src.prediction_service import LatencyStats, PredictionService
+from .bench_loading import synthetic_listings
+from .bench_feature_selection import with_city_terms
+
+
+def latency(func, requests):
+    """
+    Time a function on each request, after one warm-up call.
+    :param func: function of one request.
+    :param requests: list of requests.
+    :return: dict mapping "p50" and "p95" to milliseconds.
+    """
+    func(requests[0])
+    stats = LatencyStats()
+    for request in requests:
+        start = perf_counter()
+        func(request)
+        stats.record(perf_counter() - start)
+    return stats.percentiles((50, 95))
+
+
+if __name__ == "__main__":
+    n_rows = int(argv[1]) if len(argv) > 1 else 4000
+    n_requests = int(argv[2]) if len(argv) > 2 else 300
+    models = argv[3].split(",") if len(argv) > 3 else ["naive_bayes", "random_forest",
+                                                       "gradient_boosting", "xgboost"]
+    listings = with_city_terms(synthetic_listings(n_rows))
+    postings = listings["job_description"].dropna().drop_duplicates().values
+    rng = np.random.RandomState(0)
+    requests = list(rng.choice(postings, n_requests))
+    rows = []
+    for name in models:
+        jhp = JHPModel(MODELS[name](), min_df=2, num_cities=4, n_features=2000)
+        jhp.fit(listings)
+        kernel = compile_model(jhp.model)
+        features = jhp.processing.transform(postings)
+        single = [features[i] for i in rng.randint(0, features.shape[0], n_requests)]
+        batch = features[:256]
+        difference = np.abs(jhp.model.predict_proba(features)
+                            - kernel.predict_proba(features)).max()
+        with tempfile.TemporaryDirectory() as tmp:
+            services = {}
+            for scorer in ["model", "kernel"]:
+                save_artifact(jhp, os.path.join(tmp, scorer), kernel=scorer == "kernel")
+                services[scorer] = PredictionService(load_artifact(os.path.join(tmp, scorer)),
+                                                     cache_size=0)
+            for scorer, model in [("model", jhp.model), ("kernel", kernel)]:
+                score = latency(model.predict_proba, single)
+                request = latency(lambda text: services[scorer].predict_proba([text]),
+                                  requests)
+                start = perf_counter()
+                model.predict_proba(batch)
+                rows.append({"model": name, "scorer": scorer,
+                             "score_p50_ms": score["p50"], "score_p95_ms": score["p95"],
+                             "request_p50_ms": request["p50"],
+                             "request_p95_ms": request["p95"],
+                             "batch_256_ms": (perf_counter() - start) * 1000,
+                             "max_difference": difference})
+    print("{} postings, {} requests".format(len(postings), n_requests))
+    print(pd.DataFrame(rows).to_string(index=False, float_format="{:.3g}".format))
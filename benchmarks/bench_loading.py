@@ -0,0 +1,120 @@
+"""
+Benchmark the peak memory and time of loading scraped data and processing it
+for model building, comparing the previous in-memory loader with streaming,
+compact and chunked loading, on a synthetic csv file.
+Peak memory is the peak traced by tracemalloc while the stage runs.
+Call: python -m benchmarks.bench_loading [n_rows] [chunksize]
+"""
+
+from sys import argv
+from io import BytesIO
+from time import perf_counter
+import os
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from src.dataframe_processing import create_model_data, iter_model_data
+from src.utils import _read_csv, MODEL_COLUMNS
+from .bench_normalization import synthetic_corpus
+
+CITIES = ["San+Francisco", "New+York", "Chicago", "Austin"]
+QUERIES = ["Data+Scientist", "Data+Analyst", "Business+Intelligence"]
+INDEED_FOOTER = "\nIndeed - Cookies, Privacy and Terms"
+
+
+def synthetic_listings(n_rows, seed=0):
+    """
+    Create a DataFrame of scraped listings, with Indeed postings, 403 errors,
+    missing and duplicate descriptions.
+    :param n_rows: int, the number of listings.
+    :param seed: int, the random seed.
+    :return: Pandas DataFrame
+    """
+    rng = np.random.RandomState(seed)
+    descriptions = synthetic_corpus(n_rows, words_per_doc=400, seed=seed).values
+    kind = rng.rand(n_rows)
+    indeed = kind < 0.4
+    descriptions[indeed] = ["Header\n" + d + "\nJob Type: Full-time" + INDEED_FOOTER
+                            for d in descriptions[indeed]]
+    descriptions[(kind >= 0.4) & (kind < 0.43)] = "403 Forbidden"
+    descriptions[(kind >= 0.43) & (kind < 0.45)] = None
+    duplicates = rng.choice(n_rows, n_rows // 20)
+    descriptions[duplicates] = descriptions[rng.choice(n_rows, len(duplicates))]
+    return pd.DataFrame({"job_title": "Data Scientist",
+                         "company": "Company",
+                         "location": "Somewhere",
+                         "date": "2 days ago",
+                         "url": ["/rc/clk?jk={}".format(i) for i in range(n_rows)],
+                         "job_description": descriptions,
+                         "city_term": rng.choice(CITIES, n_rows),
+                         "search_term": rng.choice(QUERIES, n_rows)})
+
+
+def legacy_load(path):
+    """
+    The previous import_data and create_model_data: the whole object is read
+    into memory before parsing, and every processing step copies the data.
+    """
+    # Imported here, as bench_cleaning uses this module's synthetic listings
+    from .bench_cleaning import legacy_process
+    with open(path, "rb") as f:
+        df = pd.read_csv(BytesIO(f.read()))
+    return len(legacy_process(df))
+
+
+def streaming_load(path):
+    """
+    Parse the object as it is read, then process it.
+    """
+    with open(path, "rb") as f:
+        return len(create_model_data(_read_csv(f)))
+
+
+def compact_load(path):
+    """
+    Parse only the model columns, with categorical city and search terms.
+    """
+    with open(path, "rb") as f:
+        return len(create_model_data(_read_csv(f, MODEL_COLUMNS, compact=True)))
+
+
+def chunked_load(path, chunksize):
+    """
+    Process the data one chunk at a time, keeping only the row count.
+    """
+    return sum(len(df) for df in iter_model_data(filename=path, chunksize=chunksize))
+
+
+def measure(func):
+    """
+    Measure the time and peak traced memory of a function.
+    :param func: callable with no arguments.
+    :return: tuple of (float, float, output), seconds, peak MB and the output.
+    """
+    tracemalloc.start()
+    start = perf_counter()
+    output = func()
+    seconds = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 1024 ** 2, output
+
+
+if __name__ == "__main__":
+    n_rows = int(argv[1]) if len(argv) > 1 else 50000
+    chunksize = int(argv[2]) if len(argv) > 2 else 5000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "listings.csv")
+        synthetic_listings(n_rows).to_csv(path, index=False)
+        print("{} rows, {:.1f} MB csv".format(n_rows, os.path.getsize(path) / 1024 ** 2))
+        rows = []
+        for name, func in [("legacy", lambda: legacy_load(path)),
+                           ("streaming", lambda: streaming_load(path)),
+                           ("compact columns", lambda: compact_load(path)),
+                           ("chunked ({})".format(chunksize),
+                            lambda: chunked_load(path, chunksize))]:
+            seconds, peak, n_model_rows = measure(func)
+            rows.append({"loader": name, "seconds": seconds, "peak MB": peak,
+                         "model rows": n_model_rows})
+        print(pd.DataFrame(rows).to_string(index=False))
@@ -0,0 +1,54 @@
+"""
+Benchmark near-duplicate detection: the time to compute MinHash signatures
+and cluster them with LSH as the number of listings doubles, and the number
+of near duplicates found when some postings are scraped again with a
+different city and a line of extra boilerplate.
+Call: python -m benchmarks.bench_near_duplicates [n_rows] [threshold]
+"""
+
+from sys import argv
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from src.near_duplicates import minhash_signatures, cluster_signatures
+from .bench_loading import synthetic_listings, CITIES
+
+
+def with_near_duplicates(n_rows, share=0.05, seed=0):
+    """
+    Create synthetic listings where a share of the postings appear twice,
+    the second time under another city with a sentence appended.
+    :param n_rows: int, the number of listings before duplication.
+    :param share: float, the share of postings that are duplicated.
+    :param seed: int, the random seed.
+    :return: Pandas DataFrame
+    """
+    listings = synthetic_listings(n_rows, seed)
+    rng = np.random.RandomState(seed)
+    copies = listings[listings["job_description"].notnull()].sample(
+        int(n_rows * share), random_state=seed)
+    copies = copies.assign(job_description=copies["job_description"] + " Apply today on our site",
+                           city_term=rng.choice(CITIES, len(copies)))
+    return pd.concat([listings, copies], ignore_index=True)
+
+
+if __name__ == "__main__":
+    n_rows = int(argv[1]) if len(argv) > 1 else 40000
+    threshold = float(argv[2]) if len(argv) > 2 else 0.8
+    rows = []
+    for size in [n_rows // 4, n_rows // 2, n_rows]:
+        listings = with_near_duplicates(size)
+        descriptions = listings["job_description"].dropna().values
+        start = perf_counter()
+        signatures, has_words = minhash_signatures(descriptions)
+        signed = perf_counter()
+        clusters = cluster_signatures(signatures, threshold, has_words)
+        done = perf_counter()
+        exact = len(descriptions) - len(pd.unique(descriptions))
+        rows.append({"descriptions": len(descriptions),
+                     "signatures_s": signed - start,
+                     "lsh_s": done - signed,
+                     "us_per_description": (done - start) / len(descriptions) * 1e6,
+                     "exact_duplicates": exact,
+                     "near_duplicates": int((clusters != np.arange(len(clusters))).sum()) - exact})
+    print(pd.DataFrame(rows).to_string(index=False))
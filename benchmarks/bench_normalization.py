@@ -0,0 +1,100 @@
+"""
+Benchmark text normalization throughput (documents per second) against the
+previous implementation, on a synthetic corpus of job descriptions.
+Call: python -m benchmarks.bench_normalization [n_docs] [stemlem]
+"""
+
+from sys import argv
+from time import perf_counter
+import re
+import numpy as np
+import pandas as pd
+from nltk.stem.porter import PorterStemmer
+from nltk.stem.snowball import SnowballStemmer
+from src.nlp_processing import NLPProcessing
+from src.token_cache import get_token_cache
+from src.utils import get_stopwords
+
+WORDS = ["data", "scientist", "Python", "SQL", "machine", "learning", "the",
+         "and", "with", "experience", "team", "analytics", "modeling",
+         "statistics", "business", "intelligence", "Tableau", "Spark",
+         "Hadoop", "AWS", "New", "York", "San", "Francisco", "years",
+         "skills", "requirements", "responsibilities", "communication",
+         "Equal", "Opportunity", "Employer", "benefits", "401k", "â"]
+JOINERS = [" ", " ", " ", " ", "\n", ", ", ". ", "", "  ", "/", " - "]
+
+
+def synthetic_corpus(n_docs, words_per_doc=300, seed=0):
+    """
+    Create a corpus of random job description like documents, with joined
+    camel case words, punctuation and newlines.
+    :param n_docs: int, the number of documents.
+    :param words_per_doc: int, the number of words in each document.
+    :param seed: int, the random seed.
+    :return: Pandas Series of str
+    """
+    rng = np.random.RandomState(seed)
+    words = rng.choice(WORDS, size=(n_docs, words_per_doc))
+    joiners = rng.choice(JOINERS, size=(n_docs, words_per_doc))
+    docs = ["".join(w + j for w, j in zip(row, joins))
+            for row, joins in zip(words, joiners)]
+    return pd.Series(docs)
+
+
+def legacy_create_text_matrix(series):
+    """
+    The previous implementation of NLPProcessing._create_text_matrix.
+    """
+    series = series.apply(lambda x: re.sub(r"((?<=[a-z])[A-Z]|(?<!\A)[A-Z](?=[a-z]))", r" \1", x))
+    sm = series.values.copy()
+    for index, document in enumerate(series):
+        document = document.replace("\n", " ")
+        sm[index] = re.sub("[^\w\s]|â", "", document, flags=re.UNICODE)
+    return sm
+
+
+def legacy_stemlem(stemlem, text_array):
+    """
+    The previous implementation of NLPProcessing._stemlem, for stemmers and
+    stopword removal, with use_stopwords=True.
+    """
+    stop_words = get_stopwords()
+    if stemlem == "":
+        return [" ".join([word for word in text.split(" ")
+                          if word.lower() not in stop_words]) for text in text_array]
+    model = SnowballStemmer("english") if "snowball" in stemlem else PorterStemmer()
+    return [" ".join([model.stem(word) for word in text.split(" ")
+                      if word.lower() not in stop_words])
+            for text in text_array]
+
+
+def throughput(func, n_docs):
+    """
+    Time a function and get its throughput.
+    :param func: callable with no arguments.
+    :param n_docs: int, the number of documents processed by the function.
+    :return: tuple of (float, output), docs/sec and the function output.
+    """
+    start = perf_counter()
+    output = func()
+    return n_docs / (perf_counter() - start), output
+
+
+if __name__ == "__main__":
+    n_docs = int(argv[1]) if len(argv) > 1 else 100000
+    stemlem = argv[2] if len(argv) > 2 else ""
+    series = synthetic_corpus(n_docs)
+    p = NLPProcessing(stemlem=stemlem)
+
+    old_clean, old_text = throughput(lambda: legacy_create_text_matrix(series), n_docs)
+    new_clean, new_text = throughput(lambda: p._create_text_matrix(series), n_docs)
+    old_stem, old_docs = throughput(lambda: legacy_stemlem(stemlem, old_text), n_docs)
+    new_stem, new_docs = throughput(lambda: p._stemlem(new_text), n_docs)
+
+    print(pd.DataFrame(
+        [{"stage": "_create_text_matrix", "before docs/sec": old_clean,
+          "after docs/sec": new_clean, "identical": list(old_text) == list(new_text)},
+         {"stage": "_stemlem ({})".format(stemlem or "stopwords"),
+          "before docs/sec": old_stem, "after docs/sec": new_stem,
+          "identical": old_docs == new_docs}]).to_string(index=False))
+    print(get_token_cache().stats().to_string(index=False))
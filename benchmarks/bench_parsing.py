@@ -0,0 +1,82 @@
+"""
+Benchmark the parse time per page of each installed HTML parser.
+Pages are read from a response cache directory (see src/response_cache.py),
+or generated from the canned stub pages if no directory is given.
+Call: python -m benchmarks.bench_parsing [cache_dir]
+"""
+
+from sys import argv
+from time import perf_counter
+import glob
+import gzip
+import os
+import pandas as pd
+from src.html_parsing import PARSERS, available_parsers, get_parser
+from .stub_indeed import results_page, description_page
+
+
+def load_saved_pages(cache_dir):
+    """
+    Load every page body stored in a response cache.
+    Pages with result rows are treated as results pages.
+    :param cache_dir: str, the response cache directory.
+    :return: tuple of lists of str, the results and description pages.
+    """
+    results, descriptions = [], []
+    for path in glob.glob(os.path.join(cache_dir, "objects", "*", "*")):
+        with open(path, "rb") as f:
+            html = gzip.decompress(f.read()).decode("utf-8")
+        (results if 'data-tn-element="jobTitle"' in html else descriptions).append(html)
+    return results, descriptions
+
+
+def canned_pages(n_pages=20):
+    """
+    Create canned results and description pages.
+    :param n_pages: int, the number of pages of each type.
+    :return: tuple of lists of str, the results and description pages.
+    """
+    filler = "<p>Responsibilities &amp; requirements <!-- comment --> " \
+             "<b>Python</b>, SQL  and Spark.</p>\n" * 200
+    results = [results_page(i, n_pages) for i in range(n_pages)]
+    descriptions = [description_page(i).replace("</body>", filler + "</body>")
+                    for i in range(n_pages)]
+    return results, descriptions
+
+
+def time_parser(parser, pages, method):
+    """
+    Time a parser over a list of pages.
+    :param parser: an html_parsing parser.
+    :param pages: list of str, the pages to parse.
+    :param method: str, "parse_results" or "parse_description".
+    :return: tuple of (float, list), milliseconds per page and the outputs.
+    """
+    parse = getattr(parser, method)
+    start = perf_counter()
+    outputs = [parse(html) for html in pages]
+    return 1000 * (perf_counter() - start) / max(1, len(pages)), outputs
+
+
+if __name__ == "__main__":
+    if len(argv) > 1:
+        results, descriptions = load_saved_pages(argv[1])
+    else:
+        results, descriptions = canned_pages()
+    print("{} results pages, {} description pages, parsers installed: {}"
+          .format(len(results), len(descriptions), available_parsers()))
+
+    baseline = get_parser("html.parser")
+    _, expected_results = time_parser(baseline, results, "parse_results")
+    _, expected_descriptions = time_parser(baseline, descriptions, "parse_description")
+    rows = []
+    for name in available_parsers():
+        parser = get_parser(name)
+        results_ms, parsed = time_parser(parser, results, "parse_results")
+        description_ms, text = time_parser(parser, descriptions, "parse_description")
+        rows.append({"parser": name,
+                     "results ms/page": results_ms,
+                     "description ms/page": description_ms,
+                     "results match": parsed == expected_results,
+                     "descriptions match": text == expected_descriptions})
+    print(pd.DataFrame(rows).to_string(index=False))
@@ -0,0 +1,57 @@
+"""
+Benchmark the prediction service under concurrent load, with and without
+the result cache and micro-batching. Requests are single postings drawn
+from a Zipf distribution, so popular postings are submitted many times,
+as when users paste the same listings.
+Call: python -m benchmarks.bench_serving [n_requests] [n_threads]
+"""
+
+from sys import argv
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from sklearn.naive_bayes import MultinomialNB
+from src.build_model import JHPModel
+from src.prediction_service import PredictionService
+from .bench_loading import synthetic_listings
+
+
+def run(service, requests, n_threads):
+    """
+    Send every request to the service from a pool of client threads.
+    :param service: PredictionService
+    :param requests: list of str, the posting of each request.
+    :param n_threads: int, the number of concurrent clients.
+    :return: dict of the throughput, cache and latency statistics.
+    """
+    start = perf_counter()
+    with ThreadPoolExecutor(n_threads) as pool:
+        list(pool.map(lambda text: service.predict_proba([text]), requests))
+    seconds = perf_counter() - start
+    return dict({"requests/s": len(requests) / seconds}, **service.stats())
+
+
+if __name__ == "__main__":
+    n_requests = int(argv[1]) if len(argv) > 1 else 2000
+    n_threads = int(argv[2]) if len(argv) > 2 else 8
+    listings = synthetic_listings(5000)
+    jhp = JHPModel(MultinomialNB())
+    jhp.fit(listings)
+    postings = listings["job_description"].dropna().drop_duplicates().values
+    rng = np.random.RandomState(0)
+    popularity = np.minimum(rng.zipf(1.3, n_requests), len(postings)) - 1
+    requests = list(postings[popularity])
+    print("{} requests for {} distinct postings, {} client threads".format(
+        n_requests, len(set(requests)), n_threads))
+
+    rows = []
+    for name, options in [("no cache", {"cache_size": 0}),
+                          ("cache", {}),
+                          ("micro-batching", {"cache_size": 0, "batching": True}),
+                          ("cache and micro-batching", {"batching": True})]:
+        stats = run(PredictionService(jhp, **options), requests, n_threads)
+        rows.append(dict({"service": name}, **stats))
+    columns = ["service", "requests/s", "cache_hit_rate", "p50_ms", "p95_ms",
+               "p99_ms", "mean_batch_size"]
+    print(pd.DataFrame(rows).reindex(columns=columns).to_string(index=False))
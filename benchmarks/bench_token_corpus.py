@@ -0,0 +1,76 @@
+"""
+Benchmark fitting the vectorizer and vectorizing the corpus: the previous
+fit_transform, which joins the stemmed/lemmatized documents back into
+strings and tokenizes the corpus twice with SK-Learn, against the token id
+corpus, which tokenizes each document once and counts n-grams with NumPy.
+Transform is compared in the same way, with the fitted vectorizer.
+Also times saving the token corpus and memory-mapping it back.
+Call: python -m benchmarks.bench_token_corpus [n_rows] [stemlem]
+"""
+
+from sys import argv
+import os
+import tempfile
+import pandas as pd
+from src.dataframe_processing import create_model_data
+from src.nlp_processing import NLPProcessing
+from src.token_corpus import TokenCorpus
+from .bench_loading import synthetic_listings, measure
+
+
+def legacy_fit_transform(processing, df):
+    """
+    The previous fit_transform: SK-Learn's vectorizer is fitted on the
+    stemmed training documents and transforms the cleaned text of every
+    document.
+    """
+    fit_array = processing._preprocess(df[df["cleaned"]]["job_description"])
+    processing.vectorize = processing._new_vectorizer().fit(fit_array)
+    return processing.vectorize.transform(processing._preprocess(df["job_description"],
+                                                                 stem=False))
+
+
+def legacy_transform(processing, df):
+    """
+    The previous transform: the fitted vectorizer tokenizes the stemmed
+    documents.
+    """
+    return processing.vectorize.transform(processing._preprocess(df["job_description"]))
+
+
+if __name__ == "__main__":
+    n_rows = int(argv[1]) if len(argv) > 1 else 20000
+    stemlem = argv[2] if len(argv) > 2 else "porter"
+    df = create_model_data(synthetic_listings(n_rows), num_cities=4)
+    rows = []
+    outputs = {}
+    for n_grams in [(1, 1), (1, 2), (1, 3)]:
+        for name, func in [("strings", legacy_fit_transform),
+                           ("token ids", lambda p, data: p.fit_transform(data))]:
+            processing = NLPProcessing(stemlem=stemlem, n_grams=n_grams, min_df=2)
+            # Warm the token cache, so both runs stem the same way
+            processing._preprocess(df[df["cleaned"]]["job_description"].iloc[:10])
+            seconds, peak, x = measure(lambda: func(processing, df))
+            outputs[name] = x
+            rows.append({"n_grams": str(n_grams), "step": "fit_transform", "input": name,
+                         "seconds": seconds, "peak_mb": peak})
+        assert (outputs["strings"] != outputs["token ids"]).nnz == 0
+        for name, func in [("strings", legacy_transform),
+                           ("token ids", lambda p, data: p.transform(data))]:
+            seconds, peak, x = measure(lambda: func(processing, df))
+            outputs[name] = x
+            rows.append({"n_grams": str(n_grams), "step": "transform", "input": name,
+                         "seconds": seconds, "peak_mb": peak})
+        assert (outputs["strings"] != outputs["token ids"]).nnz == 0
+    print("{} documents, stemlem={!r}".format(len(df), stemlem))
+    print(pd.DataFrame(rows).to_string(index=False))
+
+    corpus = TokenCorpus.from_texts(NLPProcessing()._preprocess(df["job_description"],
+                                                               stem=False))
+    with tempfile.TemporaryDirectory() as tmp:
+        seconds, _, _ = measure(lambda: corpus.save(tmp))
+        size = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+        load_seconds, peak, _ = measure(lambda: TokenCorpus.load(tmp))
+    print("token corpus: {} tokens, {} distinct, {:.1f} MB on disk, saved in {:.2f}s, "
+          "memory-mapped in {:.2f}s ({:.1f} MB peak)".format(
+              len(corpus.ids), len(corpus.tokens), size / 2 ** 20, seconds, load_seconds, peak))
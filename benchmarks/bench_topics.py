@@ -0,0 +1,66 @@
+"""
+Benchmark topic modelling of every city: the previous topic_modelling run
+once per city, which processes and vectorizes each city's postings
+separately, against one TopicEngine run that preprocesses the corpus once,
+and an online update with a day of new postings against refitting.
+Call: python -m benchmarks.bench_topics [n_rows] [n_jobs]
+"""
+
+from sys import argv
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import NMF
+from src.dataframe_processing import create_model_data
+from src.nlp_processing import NLPProcessing
+from src.topic_modelling import TopicEngine
+from .bench_loading import synthetic_listings, CITIES
+
+
+def legacy_topic_modelling(df, city, n_words=10, n_topics=10):
+    """
+    The previous topic_modelling, without printing: each city's postings are
+    processed and vectorized on their own, and every topic's weights are
+    fully sorted.
+    """
+    p = NLPProcessing(stemlem="", min_df=0.01, max_df=0.95, num_cities=4, n_grams=(1, 2),
+                      use_stopwords=True)
+    model = NMF(n_components=n_topics, random_state=0)
+    df = create_model_data(df[df["city_term"] == city], num_cities=4)
+    features = p.fit_transform(df)
+    column_names = np.array(p.vectorize.get_feature_names_out())
+    model.fit(features).transform(features)
+    return column_names[np.flip(model.components_.argsort(axis=1), axis=1)[:, :n_words]]
+
+
+def timed(func):
+    """
+    Time a function.
+    :param func: callable with no arguments.
+    :return: tuple of (result, float), the result and the time in seconds.
+    """
+    start = perf_counter()
+    result = func()
+    return result, perf_counter() - start
+
+
+if __name__ == "__main__":
+    n_rows = int(argv[1]) if len(argv) > 1 else 10000
+    n_jobs = int(argv[2]) if len(argv) > 2 else 1
+    listings = synthetic_listings(n_rows)
+    daily = synthetic_listings(n_rows // 10, seed=1)
+    rows = []
+    _, seconds = timed(lambda: [legacy_topic_modelling(listings, city) for city in CITIES])
+    rows.append({"run": "legacy, one run per city", "seconds": seconds})
+    for method in ["nmf", "minibatch_nmf", "lda"]:
+        engine = TopicEngine(method=method, n_jobs=n_jobs, random_state=0)
+        _, seconds = timed(lambda: engine.fit(listings))
+        rows.append({"run": "engine fit ({})".format(method), "seconds": seconds})
+        if method != "nmf":
+            _, seconds = timed(lambda: engine.update(daily))
+            rows.append({"run": "engine update ({})".format(method), "seconds": seconds})
+            _, seconds = timed(lambda: TopicEngine(method=method, n_jobs=n_jobs, random_state=0)
+                               .fit(pd.concat([listings, daily], ignore_index=True)))
+            rows.append({"run": "engine refit ({})".format(method), "seconds": seconds})
+    print("{} postings, {} new postings, {} jobs".format(n_rows, len(daily), n_jobs))
+    print(pd.DataFrame(rows).to_string(index=False))
@@ -0,0 +1,123 @@
+"""
+A local stub HTTP server that serves canned Indeed HTML.
+Used to exercise and benchmark the web scraper without touching indeed.com.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import urlparse, parse_qs
+from time import sleep
+
+ROW = """
+<div class="row result">
+  <a data-tn-element="jobTitle" href="/viewjob?jk={key}" title="Data Scientist {key}">Data Scientist</a>
+  <span class="company"><a data-tn-element="companyName">Company {key}</a></span>
+  <span class="location">Austin, TX</span>
+  <span class="date">Today</span>
+</div>
+"""
+
+RESULTS = """
+<html><body>
+<div id="searchCount">Page {page} of {total} jobs</div>
+{rows}
+<div class="pagination"><a href="/jobs?page={page}">{page}</a><a href="/jobs?page={next}">Next</a></div>
+{next_label}
+</body></html>
+"""
+
+DESCRIPTION = """
+<html><head><style>body {{color: black;}}</style><script>var x = 1;</script></head>
+<body>
+<h1>Data Scientist {key}</h1>
+<div class="summary">
+  <p>We are looking for a data scientist with Python, SQL and machine learning skills.</p>
+  <p>Job Type: Full-time</p>
+</div>
+Indeed - Cookies, Privacy and Terms
+</body></html>
+"""
+
+
+def results_page(page, n_pages, per_page=50):
+    """
+    Create the HTML of a canned search results page.
+    :param page: int, the number of the page (from 0).
+    :param n_pages: int, the total number of results pages.
+    :param per_page: int, the number of listings on each page.
+    :return: str, the page HTML.
+    """
+    rows = "".join(ROW.format(key=page * per_page + i) for i in range(per_page))
+    next_label = '<span class="np">Next&nbsp;&raquo;</span>' \
+        if page < n_pages - 1 else ""
+    return RESULTS.format(page=page, total=n_pages * per_page, rows=rows,
+                          next=page + 1, next_label=next_label)
+
+
+def description_page(key):
+    """
+    Create the HTML of a canned job description page.
+    :param key: str, the job key.
+    :return: str, the page HTML.
+    """
+    return DESCRIPTION.format(key=key)
+
+
+class StubIndeedServer:
+    """
+    Serve canned results and description pages from a background thread.
+    """
+    def __init__(self, n_pages=2, per_page=50, latency=0.05, port=0):
+        """
+        Instantiate and start the server.
+        :param n_pages: int, the number of results pages to serve.
+        :param per_page: int, the number of listings on each results page.
+        :param latency: float, seconds to wait before answering each request.
+        :param port: int, the port to listen on. 0 picks a free port.
+        """
+        self.n_pages = n_pages
+        self.per_page = per_page
+        self.latency = latency
+        self.requests = 0
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def _handler(self):
+        """
+        Create the request handler class bound to this server.
+        :return: BaseHTTPRequestHandler subclass
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                sleep(stub.latency)
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == "/jobs":
+                    page = int(query.get("page", ["0"])[0])
+                    body = results_page(page, stub.n_pages, stub.per_page)
+                elif url.path == "/viewjob":
+                    body = description_page(query["jk"][0])
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.end_headers()
+                self.wfile.write(body.encode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        """
+        Stop the server.
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
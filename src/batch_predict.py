@@ -0,0 +1,150 @@
+"""
+Batch scoring of job descriptions.
+Documents are read and featurized in batches, and each batch is scored with
+a single predict_proba call, so cleaning, vectorizing and predicting run
+once per batch rather than once per document. Results are generated one
+document at a time, so a file of any size is scored in constant memory.
+"""
+
+from .dataframe_processing import CITY_NAMES
+from .model_artifact import load_model
+from .explain import explain_rows
+import argparse
+import json
+import sys
+import numpy as np
+import pandas as pd
+
+
+def read_documents(source, batch_size=1000, id_column=None):
+    """
+    Read documents in batches.
+    :param source: list, ndarray or Pandas Series of str, a Pandas DataFrame
+                   with a job_description column, or the name of a .jsonl
+                   or .csv file with a job_description field.
+    :param batch_size: int, the number of documents in each batch.
+    :param id_column: str, the field that identifies each document, if
+                      applicable. Otherwise documents are numbered from 0.
+    :return: generator of Pandas DataFrames with id and job_description
+             columns.
+    """
+    if isinstance(source, str):
+        if source.endswith(".jsonl") or source.endswith(".json"):
+            batches = pd.read_json(source, lines=True, chunksize=batch_size)
+        else:
+            batches = pd.read_csv(source, chunksize=batch_size)
+    else:
+        if not isinstance(source, pd.DataFrame):
+            source = pd.DataFrame({"job_description": list(source)})
+        batches = (source.iloc[i:i + batch_size]
+                   for i in range(0, len(source), batch_size))
+    start = 0
+    for batch in batches:
+        ids = (batch[id_column].values if id_column is not None
+               else np.arange(start, start + len(batch)))
+        start += len(batch)
+        yield pd.DataFrame({"id": ids,
+                            "job_description": batch["job_description"].fillna("")
+                                                    .astype(str).values})
+
+
+def model_classes(jhp_model):
+    """
+    Get the label of each column of the model's probabilities.
+    :param jhp_model: a fitted model object with processing and model
+                      attributes.
+    :return: ndarray of int
+    """
+    classes = getattr(jhp_model.model, "classes_", None)
+    return np.arange(jhp_model.classes) if classes is None else np.asarray(classes)
+
+
+def rank_cities(probabilities, classes):
+    """
+    Rank the cities of each document by probability.
+    :param probabilities: ndarray, the probability of each class for each
+                          document.
+    :param classes: ndarray of int, the label of each column.
+    :return: list of lists of (str, float) tuples, the city names and
+             probabilities of each document, most likely first.
+    """
+    names = [CITY_NAMES.get(label, str(label)) for label in classes.tolist()]
+    order = np.argsort(-probabilities, axis=1, kind="stable")
+    return [[(names[column], row[column]) for column in columns]
+            for row, columns in zip(probabilities.tolist(), order.tolist())]
+
+
+def format_ranking(ranked):
+    """
+    Convert a document's ranked cities to JSON objects.
+    :param ranked: list of (str, float) tuples, as rank_cities.
+    :return: list of dicts with city and probability keys.
+    """
+    return [{"city": city, "probability": probability} for city, probability in ranked]
+
+
+def format_explanation(terms):
+    """
+    Convert a document's top contributing terms to JSON objects.
+    :param terms: list of (str, float) tuples, as explain.explain_rows.
+    :return: list of dicts with term and contribution keys.
+    """
+    return [{"term": term, "contribution": contribution} for term, contribution in terms]
+
+
+def predict_batches(jhp_model, source, batch_size=1000, id_column=None, explain=0):
+    """
+    Score documents in batches.
+    :param jhp_model: a fitted model object with processing and model
+                      attributes.
+    :param source: the documents, as read_documents.
+    :param batch_size: int, the number of documents scored at a time.
+    :param id_column: str, the field that identifies each document, if
+                      applicable.
+    :param explain: int, the number of top contributing terms of the
+                    predicted city to return for each document, 0 for none.
+    :return: generator of dicts, the id and ranked city probabilities of
+             each document, and its top terms if applicable.
+    """
+    classes = model_classes(jhp_model)
+    for batch in read_documents(source, batch_size, id_column):
+        features = jhp_model.processing.transform(batch)
+        probabilities = jhp_model.model.predict_proba(features)
+        explanations = (explain_rows(jhp_model, features, probabilities.argmax(axis=1), explain)
+                        if explain else [None] * len(batch))
+        for doc_id, ranked, terms in zip(batch["id"].tolist(),
+                                         rank_cities(probabilities, classes), explanations):
+            result = {"id": doc_id, "predictions": format_ranking(ranked)}
+            if terms is not None:
+                result["explanation"] = format_explanation(terms)
+            yield result
+
+
+if __name__ == "__main__":
+    """
+    Code that runs if called from the command line
+    Call: python -m src.batch_predict <model> <input.jsonl or input.csv> [options]
+    The model is a model artifact directory or a pkl file. The input has a
+    job_description field, and the ranked city probabilities of each
+    document are written as JSON lines.
+    """
+    parser = argparse.ArgumentParser(description="Batch city prediction.")
+    parser.add_argument("model")
+    parser.add_argument("input")
+    parser.add_argument("--output", default=None,
+                        help="JSON lines file to write (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--id-column", default=None)
+    parser.add_argument("--explain", type=int, default=0,
+                        help="number of top contributing terms to include")
+    args = parser.parse_args()
+
+    jhp = load_model(args.model)
+    output = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        for result in predict_batches(jhp, args.input, args.batch_size, args.id_column,
+                                      args.explain):
+            output.write(json.dumps(result) + "\n")
+    finally:
+        if args.output is not None:
+            output.close()
@@ -13,7 +13,53 @@ from sklearn.ensemble import GradientBoostingClassifier
 from sklearn.model_selection import KFold
 from sklearn.metrics import confusion_matrix
 from .dataframe_processing import create_model_data
+from .corpus_cache import PreprocessedCorpus
+from .explain import feature_names, informative_features
 from xgboost import XGBClassifier
+from sklearn.base import clone
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import os
+
+# The preprocessed corpus used by a cross-validation worker process
+_fold_corpus = None
+
+
+def _init_fold_worker(corpus):
+    """
+    Set up a cross-validation worker process.
+    :param corpus: PreprocessedCorpus, the corpus being cross-validated.
+    """
+    global _fold_corpus
+    _fold_corpus = corpus
+
+
+def _score_fold(jhp_model, train_rows, test_rows):
+    """
+    Fit the vectorizer and a fresh copy of the model on the training rows of
+    one fold and score them on the test rows.
+    :param jhp_model: JHPModel, the unfitted model settings.
+    :param train_rows: ndarray of int, the corpus rows to train on.
+    :param test_rows: ndarray of int, the corpus rows to test on.
+    :return: tuple of (float, ndarray), the accuracy and confusion matrix.
+    """
+    features = _fold_corpus.fold_features(jhp_model.processing, train_rows, test_rows)
+    return score_model(clone(jhp_model.model), features, jhp_model.classes)
+
+
+def score_model(model, features, n_classes):
+    """
+    Fit a model on one fold's training matrix and score it on the test matrix.
+    :param model: an unfitted SK-Learn model object.
+    :param features: tuple of (X_train, y_train, X_test, y_test).
+    :param n_classes: int, the number of classes.
+    :return: tuple of (float, ndarray), the accuracy and confusion matrix.
+    """
+    X_train, y_train, X_test, y_test = features
+    model.fit(X_train, y_train)
+    y_pred = model.predict(X_test)
+    return (np.mean(y_pred == y_test),
+            confusion_matrix(y_test, y_pred, labels=np.arange(n_classes)))
 
 
 class JHPModel:
@@ -24,7 +70,9 @@ class JHPModel:
     """
 
     def __init__(self, model, stemlem="", min_df=1, max_df=1.0, num_cities=2,
-                 n_grams=1, use_stopwords=True):
+                 n_grams=(1, 1), use_stopwords=True, n_jobs=1, tokenize="tfidf",
+                 feature_store=None, near_threshold=None, n_features=None,
+                 selection="chi2", dtype=None):
         """
         Instantiate the model building object.
         :param model: an instantiated SK-Learn model object
@@ -32,14 +80,31 @@ class JHPModel:
         :param min_df: float, minimum document frequency of vocabulary term.
         :param max_df: float, maximum document frequency of vocabulary term.
         :param num_cities: int, number of classes to use.
-        :param n_grams: int, the N-gram size to use.
+        :param n_grams: tuple, the minimum and maximum n-gram sizes.
         :param use_stopwords: bool, remove stop words or not.
+        :param n_jobs: int, the number of processes used for preprocessing.
+        :param tokenize: str, the vectorizer to use, "tfidf" or "count".
+        :param feature_store: FeatureStore, reuse the processed documents of
+                              previous fits, if applicable.
+        :param near_threshold: float, the Jaccard similarity above which a
+                               description is a near duplicate of an earlier
+                               one and removed. None only removes exact
+                               duplicates.
+        :param n_features: int, the number of features to keep after
+                           vectorizing, or None to keep every feature.
+        :param selection: str, "chi2", "mutual_info" or "hash", how the
+                          features are reduced to n_features.
+        :param dtype: the dtype of the feature matrices, eg np.float32.
         """
         self.processing = NLPProcessing(stemlem, min_df, max_df,
                                         num_cities, n_grams,
-                                        use_stopwords)
+                                        use_stopwords, tokenize,
+                                        n_jobs=n_jobs, feature_store=feature_store,
+                                        n_features=n_features, selection=selection,
+                                        dtype=dtype)
         self.model = model
         self.classes = num_cities
+        self.near_threshold = near_threshold
 
     def fit(self, training=None, bucket=None, filename=None):
         """
@@ -50,44 +115,83 @@ class JHPModel:
         :param filename: str, name of the data file, if applicable.
         """
         df = import_data(bucket, filename) if training is None else training
-        df = create_model_data(df, num_cities=self.classes)
+        df = create_model_data(df, num_cities=self.classes,
+                               near_threshold=getattr(self, "near_threshold", None))
         features = self.processing.fit_transform(df)
         labels = self._get_labels(df)
+        features = self.processing.select_features(features, labels)
         self.model.fit(features, labels)
 
     def predict(self, testing):
         """
         Make a prediction about testing data.
-        :param testing: str, list or ndarray the documents to predict
-        :return: list, a set of predictions
+        :param testing: str, list, ndarray or Pandas DataFrame, the documents
+                        to predict
+        :return: ndarray, the predicted labels
+        """
+        return self.model.predict(self.processing.transform(testing))
+
+    def predict_proba(self, testing):
+        """
+        Get the probability of each city for the testing data.
+        :param testing: str, list, ndarray or Pandas DataFrame, the documents
+                        to predict
+        :return: ndarray, the probability of each class for each document
         """
-        if isinstance(testing, str):
-            testing = [testing]
-        testing = self.processing.transform(testing)
-        print(testing)
-        return self.model.predict(testing)
+        return self.model.predict_proba(self.processing.transform(testing))
 
     def cross_validate(self, data=None, bucket=None, filename=None,
-                       n_splits=5):
+                       n_splits=5, n_jobs=1, random_state=None):
         """
         Quantify performance using K-fold cross-validation.
-        Prints the mean model accuracy when completed
+        Prints the mean model accuracy when completed.
+        The corpus is cleaned and stemmed/lemmatized once, and only the
+        vectorizer and model are refit on each fold. With a near_threshold,
+        the folds are split by cluster of near duplicates.
         :param n_splits: int, the number of folds to make.
         :param data: Pandas DataFrame containing data.
         :param bucket: str S3 bucket of data if applicable.
         :param filename: str, name of the data file, if applicable.
+        :param n_jobs: int, the number of folds to run in parallel.
+                       -1 uses every CPU.
+        :param random_state: int, seed for shuffling the folds, if applicable.
         """
-        kf = KFold(n_splits, shuffle=True)
+        kf = KFold(n_splits, shuffle=True, random_state=random_state)
         df = import_data(bucket, filename) if data is None else data
+        near_threshold = getattr(self, "near_threshold", None)
+        corpus = PreprocessedCorpus(df, self.processing, num_cities=self.classes,
+                                    near_threshold=near_threshold)
+        if near_threshold is None:
+            splits = kf.split(df)
+        else:
+            # Each cluster of near duplicates is kept in one fold, so that
+            # postings cannot leak from the training rows into the test rows
+            groups = np.unique(corpus.group[corpus.group >= 0])
+            splits = ((np.flatnonzero(np.isin(corpus.group, groups[train])),
+                       np.flatnonzero(np.isin(corpus.group, groups[test])))
+                      for train, test in kf.split(groups))
+        # Each fold gets the unfitted settings, not any fitted vectorizer
+        settings = copy.copy(self)
+        settings.processing = copy.copy(self.processing)
+        settings.processing.vectorize = None
+        settings.model = clone(self.model)
+        folds = [(settings, corpus.rows(train_index), corpus.rows(test_index))
+                 for train_index, test_index in splits]
+        n_jobs = (os.cpu_count() or 1) if n_jobs == -1 else max(1, n_jobs)
+        if n_jobs == 1:
+            _init_fold_worker(corpus)
+            results = [_score_fold(*fold) for fold in folds]
+            _init_fold_worker(None)
+        else:
+            with ProcessPoolExecutor(min(n_jobs, len(folds)),
+                                     initializer=_init_fold_worker,
+                                     initargs=(corpus,)) as pool:
+                results = list(pool.map(_score_fold, *zip(*folds)))
         scores = []
         confusion = np.zeros((self.classes, self.classes))
-        for train_index, test_index in kf.split(df):
-            self.fit(training=df.iloc[train_index])
-            df_test = create_model_data(df.iloc[test_index], num_cities=self.classes)
-            X_test = self.processing.transform(df_test)
-            y_test = self._get_labels(df_test)
-            scores.append(self.model.score(X_test, y_test))
-            confusion += confusion_matrix(y_test, self.model.predict(X_test))
+        for score, fold_confusion in results:
+            scores.append(score)
+            confusion += fold_confusion
         print("Model Accuracy = {}".format(np.array(scores).mean()))
         np.set_printoptions(suppress=True)
         print("Confusion_Matrix:")
@@ -95,19 +199,22 @@ class JHPModel:
         self._get_scores(confusion)
 
     @staticmethod
-    def _get_scores(confusion_matrix):
+    def _get_scores(confusion_matrix, verbose=True):
         """
         Use the confusion matrix to get precision, recall, F1 score.
         :param confusion_matrix: ndarray
-        :return: None, prints scores to the console
+        :param verbose: bool, whether to print the scores to the console.
+        :return: tuple of ndarrays, the precision, recall and F1 of each class
         """
         d = np.diag(confusion_matrix) #Diagonals, TP
         precision = d / confusion_matrix.sum(axis=1)
         recall = d / confusion_matrix.sum(axis=0)
         F1 = 2 / ((1/precision) + (1/recall))
-        for i in range(confusion_matrix.shape[0]):
-            print("Class {} | Precision = {:.3f} | Recall = {:.3f} | F1 = {:.3f}"
-                  .format(i, precision[i], recall[i], F1[i]))
+        if verbose:
+            for i in range(confusion_matrix.shape[0]):
+                print("Class {} | Precision = {:.3f} | Recall = {:.3f} | F1 = {:.3f}"
+                      .format(i, precision[i], recall[i], F1[i]))
+        return precision, recall, F1
 
     def show_informative_features(self, n=20):
         """
@@ -116,11 +223,9 @@ class JHPModel:
         Note: must be called on a fitted model.
         :param n: int, the number of most discriminatory features to show.
         """
-        feature_names = self.processing.vectorize.get_feature_names()
-        coefs_names = sorted(zip(self.model.feature_importances_,
-                                 feature_names))
-        top = zip(coefs_names[:n], coefs_names[:-(n + 1):-1])
-        for (coef_1, fn_1), (coef_2, fn_2) in top:
+        most, least = informative_features(self.model,
+                                           feature_names(self.processing.vectorize), n)
+        for (coef_1, fn_1), (coef_2, fn_2) in zip(least, most):
             print("\t%.4f\t%-15s\t\t%.4f\t%-15s" % (coef_1, fn_1, coef_2, fn_2))
 
     @staticmethod
@@ -130,4 +235,4 @@ class JHPModel:
         :param df: Pandas Dataframe from which to extract labels
         :return: ndarray of the labels
         """
-        return df["label"].as_matrix()
\ No newline at end of file
+        return df["label"].values
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Preprocessed corpus that is shared by model evaluations on subsets of the
+same data, eg cross-validation folds.
+Every document is cleaned and stemmed/lemmatized once, and any subset of
+rows can then be selected exactly as create_model_data would process it.
+"""
+
+from .dataframe_processing import city_labels, clean_indeed_jobs
+from .feature_store import document_keys
+from .near_duplicates import find_near_duplicates
+import copy
+import numpy as np
+import pandas as pd
+
+
+class PreprocessedCorpus:
+    """
+    The cleaned and stemmed/lemmatized text and labels of every row of a
+    DataFrame of scraped jobs.
+    """
+    def __init__(self, data, processing, num_cities=2, near_threshold=None,
+                 shingle_size=5):
+        """
+        Preprocess the corpus.
+        :param data: Pandas DataFrame containing data.
+        :param processing: NLPProcessing, the settings used to clean and
+                           stem/lemmatize the documents.
+        :param num_cities: int, the number of cities to retain.
+        :param near_threshold: float, the Jaccard similarity of near
+                               duplicate descriptions, as create_model_data.
+        :param shingle_size: int, the number of words in a shingle.
+        """
+        df = data.reset_index(drop=True)
+        self.n_rows = len(df)
+        # Rows with the same description are duplicates, dropped within
+        # each subset by create_model_data
+        notnull = df["job_description"].notnull().values
+        self.group = np.full(self.n_rows, -1)
+        if near_threshold is None:
+            self.group[notnull] = pd.factorize(df["job_description"][notnull])[0]
+        else:
+            # Near duplicates share the group of the first description of
+            # their cluster
+            self.group[notnull] = find_near_duplicates(
+                df["job_description"][notnull].values, near_threshold, shingle_size)[0]
+
+        self.labels = city_labels(df["city_term"])
+        self.valid = notnull & (self.labels >= 0) & (self.labels < num_cities)
+        self.valid[notnull] &= ~df["job_description"][notnull].str.contains(
+            "403", regex=False).values
+        rows = np.flatnonzero(self.valid)
+        df = clean_indeed_jobs(pd.DataFrame(
+            {"job_description": df["job_description"].values[rows]}))
+
+        self.cleaned = np.zeros(self.n_rows, dtype=bool)
+        self.cleaned[rows] = df["cleaned"].values
+        self.text = np.empty(self.n_rows, dtype=object)
+        self.stemmed = np.empty(self.n_rows, dtype=object)
+        self.text[rows], self.stemmed[rows] = processing._text_and_stemmed(df["job_description"])
+        # The feature store keys of each document, if applicable
+        self.keys = None
+        if getattr(processing, "feature_store", None) is not None:
+            self.keys = np.empty(self.n_rows, dtype=object)
+            self.keys[rows] = document_keys(df["job_description"])
+
+    def rows(self, index):
+        """
+        Select a subset of rows as create_model_data would process it:
+        duplicates within the subset are dropped and unusable rows are removed.
+        :param index: ndarray of int, the positions of the subset's rows.
+        :return: ndarray of int, the positions of the model data rows.
+        """
+        index = np.asarray(index)
+        index = index[self.group[index] >= 0]
+        index = index[~pd.Series(self.group[index]).duplicated().values]
+        return index[self.valid[index]]
+
+    def fold_features(self, processing, train_rows, test_rows):
+        """
+        Fit a vectorizer on the training rows and build the feature matrices
+        of one fold.
+        Matches JHPModel.fit and predict: the vocabulary is fit on the
+        stemmed/lemmatized cleaned postings, the training matrix is built
+        from the text before stemming, and the test matrix from the
+        stemmed/lemmatized text. The features are then reduced as set by the
+        processing's n_features, using only the training rows.
+        :param processing: NLPProcessing, the vectorizer settings. It is
+                           copied, not modified.
+        :param train_rows: ndarray of int, the rows to train on.
+        :param test_rows: ndarray of int, the rows to test on.
+        :return: tuple of (X_train, y_train, X_test, y_test)
+        """
+        processing = copy.copy(processing)
+        processing._do_vectorize(self.stemmed[train_rows[self.cleaned[train_rows]]])
+        X_train = processing.select_features(
+            processing.vectorize.transform(self.text[train_rows]), self.labels[train_rows])
+        return (X_train,
+                self.labels[train_rows],
+                processing.vectorize.transform(self.stemmed[test_rows]).astype(
+                    X_train.dtype, copy=False),
+                self.labels[test_rows])
@@ -3,28 +3,134 @@ Functions that perform basic processing on the dataframe to eventually output
 a transformed set of feature and label arrays for model training and testing.
 """
 
-from .utils import import_data
+from .utils import import_data, iter_data, MODEL_COLUMNS
+from .near_duplicates import find_near_duplicates
+import gc
 import re
 import pandas as pd
 import numpy as np
 
+CITY_LABELS = {"San+Francisco": 0,
+               "New+York": 1,
+               "Chicago": 2,
+               "Austin": 3}
+# The display name of each label
+CITY_NAMES = {0: "San Francisco, CA",
+              1: "New York, NY",
+              2: "Chicago, IL",
+              3: "Austin, TX"}
+# Text that marks a posting made directly on Indeed
+INDEED_FOOTER = "Indeed - Cookies, Privacy and Terms"
+# Text of the salary survey that replaces some Indeed descriptions
+SALARY_SURVEY = "We know salary is a key component"
 
-def create_model_data(data, bucket=None, filename=None, num_cities=2):
+
+def create_model_data(data, bucket=None, filename=None, num_cities=2,
+                      near_threshold=None, shingle_size=5, seen=None):
     """
     Import and process DataFrame data from the Indeed scraper for model building.
     :param data: DataFrame to process and extract information from
     :param bucket: str S3 bucket of data if applicable.
     :param filename: str, name of the data file, if applicable.
     :param num_cities: int, the number of cities to retain.
+    :param near_threshold: float, also remove descriptions whose word
+                           shingles have at least this Jaccard similarity
+                           to an earlier description, if applicable.
+    :param shingle_size: int, the number of words in a shingle.
+    :param seen: set of the description hashes of earlier data, if
+                 applicable. Descriptions in it are removed, and it is
+                 updated with the new descriptions.
     :return: ndarrays for the feature matrix and class matrix
     """
     df = import_data(bucket, filename) if data is None else data
-    df = remove_null(df, ["job_description"])
-    df = dedupe_and_403(df)
-    df = create_labels(df)
-    df = df[df["label"] < num_cities]
-    df = clean_indeed_jobs(df)
-    return df
+    return _process_chunk(df, num_cities, seen, near_threshold=near_threshold,
+                          shingle_size=shingle_size)
+
+
+def iter_model_data(bucket=None, filename=None, store=None, num_cities=2,
+                    chunksize=10000, since=None, seen=None):
+    """
+    Lazily import and process data for model building one chunk at a time.
+    Only the columns needed for model building are read, with the city and
+    search terms as categories. Duplicate descriptions are removed across
+    chunks by keeping a 64-bit hash of every description seen so far.
+    :param bucket: str S3 bucket of data, or None to read a local file.
+    :param filename: str, name of the data file, if applicable.
+    :param store: ListingStore to read listings from, if applicable.
+    :param num_cities: int, the number of cities to retain.
+    :param chunksize: int, the number of rows read at a time.
+    :param since: datetime.date, only read store partitions from this date on.
+    :param seen: set of the description hashes of earlier data, if
+                 applicable, eg to skip the listings a model was already
+                 trained on. It is updated with the new descriptions.
+    :return: generator of processed Pandas DataFrames, as create_model_data.
+    """
+    seen = set() if seen is None else seen
+    for chunk in iter_data(bucket, filename, store, chunksize, since,
+                           columns=MODEL_COLUMNS, compact=True):
+        df = _process_chunk(chunk, num_cities, seen)
+        # Intermediate DataFrames can be kept alive by reference cycles until
+        # the next full garbage collection, which would let memory grow with
+        # every chunk
+        del chunk
+        gc.collect()
+        if len(df) > 0:
+            yield df
+
+
+def _process_chunk(df, num_cities, seen=None, near_threshold=None, shingle_size=5):
+    """
+    Process a DataFrame of scraped data for model building.
+    Null, duplicate and 403 descriptions and other cities are removed with a
+    single mask, and the selected rows are then cleaned in place.
+    :param df: Pandas DataFrame containing data.
+    :param num_cities: int, the number of cities to retain.
+    :param seen: set of the description hashes of earlier chunks, if
+                 applicable. It is updated with this chunk's descriptions.
+    :param near_threshold: float, the Jaccard similarity of near duplicate
+                           descriptions, or None to only remove exact
+                           duplicates.
+    :param shingle_size: int, the number of words in a shingle.
+    :return: Pandas DataFrame, as create_model_data.
+    """
+    labels = city_labels(df["city_term"])
+    keep = (_usable_rows(df["job_description"], seen, near_threshold, shingle_size)
+            & (labels >= 0) & (labels < num_cities))
+    # assign returns a new DataFrame, so it can be cleaned in place without
+    # modifying the caller's data
+    df = df[keep].assign(label=labels[keep])
+    return clean_indeed_jobs(df)
+
+
+def _usable_rows(descriptions, seen=None, near_threshold=None, shingle_size=5):
+    """
+    Find the rows that have a description that is not null, not a 403
+    error and not a duplicate of an earlier row.
+    :param descriptions: Pandas Series, the job descriptions.
+    :param seen: set of the description hashes of earlier chunks, if
+                 applicable. It is updated with these descriptions.
+    :param near_threshold: float, the Jaccard similarity above which a
+                           description is a near duplicate of an earlier
+                           one, or None to only remove exact duplicates.
+    :param shingle_size: int, the number of words in a shingle.
+    :return: ndarray of bool
+    """
+    keep = descriptions.notnull().values
+    present = descriptions[keep]
+    if seen is None:
+        first = ~present.duplicated().values
+    else:
+        hashes = pd.util.hash_pandas_object(present, index=False,
+                                          categorize=False).values
+        first = np.empty(len(hashes), dtype=bool)
+        for i, digest in enumerate(hashes.tolist()):
+            first[i] = digest not in seen
+            seen.add(digest)
+    if near_threshold is not None:
+        clusters, _ = find_near_duplicates(present.values, near_threshold, shingle_size)
+        first &= clusters == np.arange(len(clusters))
+    keep[keep] = first & ~present.str.contains("403", regex=False).values
+    return keep
 
 
 def remove_null(df, fields):
@@ -53,31 +159,50 @@ def create_labels(df):
     """
     Creates integer numeric label based on city_term
     0 = San+Francisco, 1 = New+York, 2 = Chicago, 3 = Austin
+    Any other city is labelled -1.
     :param df: Pandas DataFrame containing data
     :return: Pandas DataFrame with extra label fields converted to int
     """
-    replace_dict = {"San+Francisco": 0,
-                    "New+York": 1,
-                    "Chicago": 2,
-                    "Austin": 3}
-    df["label"] = df["city_term"].replace(replace_dict)
+    df["label"] = city_labels(df["city_term"])
     return df
 
 
+def city_labels(city_term):
+    """
+    Map city terms to integer labels. The terms are converted to categories,
+    so each distinct city is only looked up once.
+    :param city_term: Pandas Series of str or categories.
+    :return: ndarray of int, the labels, -1 for unknown or missing cities.
+    """
+    if not hasattr(city_term, "cat"):
+        city_term = city_term.astype("category")
+    # Missing values have the code -1, which maps to the last element
+    lookup = np.array([CITY_LABELS.get(city, -1)
+                       for city in city_term.cat.categories] + [-1])
+    return lookup[city_term.cat.codes.values]
+
+
 def clean_indeed_jobs(df):
     """
     Extract job info only from postings placed directly on Indeed.
     This is possible due to the standardized structure of the page.
+    The DataFrame is updated in place: only the descriptions of the Indeed
+    postings are replaced, and the row order and index are unchanged.
     :param df: Pandas DataFrame containing data.
     :return: DataFrame with extra bool "cleaned" column and cleaned descriptions.
     """
     field = "job_description"
-    df["cleaned"] = df[field].str.contains("Indeed - Cookies, Privacy and Terms")
-    df2 = df[df["cleaned"]]
-    df2[field] = df2[field].apply(lambda x: max(x.split('\n'), key=len).split("Job Type:")[0])
-    df2["cleaned"] = ~df2["job_description"].str.contains("We know salary is a key component")
-    df2 = df2[df2["cleaned"]]
-    idx = df2.index.values
-    df = df.drop(idx)
-    df = df.append(df2, ignore_index = True)
+    descriptions = df[field].values.copy()
+    indeed = np.flatnonzero(df[field].str.contains(INDEED_FOOTER, regex=False,
+                                                  na=False).values)
+    # The description is the longest line, up to the job type
+    extracted = np.array([max(text.split("\n"), key=len).split("Job Type:", 1)[0]
+                          for text in descriptions[indeed]], dtype=object)
+    # The salary survey page has no description to extract
+    found = np.array([SALARY_SURVEY not in text for text in extracted], dtype=bool)
+    descriptions[indeed[found]] = extracted[found]
+    cleaned = np.zeros(len(df), dtype=bool)
+    cleaned[indeed] = True
+    df["cleaned"] = cleaned
+    df[field] = descriptions
     return df
@@ -0,0 +1,160 @@
+"""
+Explanations of model predictions.
+The contribution of a term to a document's class is the term's weight in
+the document's feature row times the model's weight of the term for the
+class. Only the non-zero entries of the sparse row are multiplied, and the
+top terms are found with np.argpartition rather than a full sort, so a
+document is explained in microseconds.
+"""
+
+from weakref import WeakKeyDictionary
+import numpy as np
+
+# Feature names and class weights are built once per fitted vectorizer and
+# model, and dropped with them
+_feature_names = WeakKeyDictionary()
+_class_weights = WeakKeyDictionary()
+
+
+def feature_names(vectorizer):
+    """
+    Get the term of each feature column of a fitted vectorizer.
+    :param vectorizer: a fitted SK-Learn or VocabularyVectorizer vectorizer.
+    :return: ndarray of str, or None if the features have no names, eg
+             hashed features.
+    """
+    # Refitting a vectorizer replaces its vocabulary
+    vocabulary = getattr(vectorizer, "vocabulary_", None)
+    cached = _feature_names.get(vectorizer)
+    if cached is not None and cached[0] is vocabulary:
+        return cached[1]
+    if hasattr(vectorizer, "get_feature_names_out"):
+        names = np.asarray(vectorizer.get_feature_names_out(), dtype=object)
+    elif hasattr(vectorizer, "get_feature_names"):
+        names = np.asarray(vectorizer.get_feature_names(), dtype=object)
+    else:
+        names = None
+    _feature_names[vectorizer] = (vocabulary, names)
+    return names
+
+
+def class_weights(model):
+    """
+    Get the weight of each feature for each class of a fitted model.
+    Naive Bayes log probabilities are centred on their mean over the
+    classes, so a term's weight for a class is its log likelihood relative
+    to the other classes. Models without per-class weights, eg forests,
+    give every class their feature importances.
+    :param model: a fitted SK-Learn model object.
+    :return: ndarray of shape (n_classes, n_features)
+    """
+    cached = _class_weights.get(model)
+    for attribute in ["feature_log_prob_", "coef_"]:
+        if hasattr(model, attribute):
+            source = getattr(model, attribute)
+            break
+    else:
+        # Feature importances are recomputed from the trees on every access,
+        # so they are cached for the lifetime of the model
+        if cached is not None:
+            return cached[1]
+        if not hasattr(model, "feature_importances_"):
+            raise ValueError("{} has no feature weights to explain predictions "
+                             "with".format(type(model).__name__))
+        attribute, source = "feature_importances_", None
+    # partial_fit replaces the weights of the model
+    if cached is not None and cached[0] is source:
+        return cached[1]
+    if attribute == "feature_log_prob_":
+        weights = source - source.mean(axis=0)
+    elif attribute == "coef_":
+        weights = np.asarray(source)
+        if weights.shape[0] == 1:
+            # Binary models have one set of weights, for the second class
+            weights = np.vstack([-weights, weights])
+    else:
+        importances = np.asarray(model.feature_importances_)
+        weights = np.broadcast_to(importances, (len(model.classes_), len(importances)))
+    _class_weights[model] = (source, weights)
+    return weights
+
+
+def top_k(values, k):
+    """
+    Find the positions of the k largest values, largest first.
+    :param values: ndarray of float
+    :param k: int, the number of values to find.
+    :return: ndarray of int
+    """
+    if k < len(values):
+        top = np.argpartition(-values, k)[:k]
+    else:
+        top = np.arange(len(values))
+    return top[np.argsort(-values[top], kind="stable")]
+
+
+def explain_rows(jhp_model, features, columns, k=5):
+    """
+    Find the terms that contributed most to one class of each document.
+    :param jhp_model: a fitted model object with processing and model
+                      attributes.
+    :param features: scipy sparse matrix, the documents' feature rows.
+    :param columns: ndarray of int, the column of the model's classes to
+                    explain for each document, eg its predicted class.
+    :param k: int, the number of terms to return per document.
+    :return: list of lists of (str, float) tuples, the terms and their
+             contributions, largest first. Only positive contributions
+             are returned. Features without names are named "#<column>".
+    """
+    names = feature_names(jhp_model.processing.vectorize)
+    weights = class_weights(jhp_model.model)
+    features = features.tocsr()
+    rows = np.repeat(np.arange(features.shape[0]), np.diff(features.indptr))
+    contributions = features.data * weights[np.asarray(columns)[rows], features.indices]
+    explanations = []
+    for start, end in zip(features.indptr[:-1].tolist(), features.indptr[1:].tolist()):
+        row = contributions[start:end]
+        top = top_k(row, k)
+        top = top[row[top] > 0]
+        top_columns = features.indices[start:end][top]
+        terms = (["#{}".format(column) for column in top_columns.tolist()]
+                 if names is None else names[top_columns].tolist())
+        explanations.append(list(zip(terms, row[top].tolist())))
+    return explanations
+
+
+def explain(jhp_model, testing, k=5):
+    """
+    Predict the city of each document, and find the terms that contributed
+    most to the prediction.
+    :param jhp_model: a fitted model object with processing and model
+                      attributes.
+    :param testing: str, list or Pandas DataFrame, the documents.
+    :param k: int, the number of terms to return per document.
+    :return: tuple of (ndarray, list), the probability of each class for
+             each document, and the top terms of each, as explain_rows.
+    """
+    features = jhp_model.processing.transform(testing)
+    probabilities = jhp_model.model.predict_proba(features)
+    return probabilities, explain_rows(jhp_model, features, probabilities.argmax(axis=1), k)
+
+
+def informative_features(model, names, n=20):
+    """
+    Find the most and least important features of a model.
+    :param model: a fitted SK-Learn model object with feature_importances_.
+    :param names: ndarray of str, the term of each feature column, or None
+                  if the features have no names, eg hashed features.
+    :param n: int, the number of features to return at each end.
+    :return: tuple of lists of (float, str) tuples, the most important
+             features (most first) and the least important (least first).
+             Features without names are named "#<column>".
+    """
+    importances = np.asarray(model.feature_importances_)
+    if names is None:
+        names = np.array(["#{}".format(column) for column in range(len(importances))],
+                         dtype=object)
+    most = top_k(importances, n)
+    least = top_k(-importances, n)
+    return (list(zip(importances[most].tolist(), names[most].tolist())),
+            list(zip(importances[least].tolist(), names[least].tolist())))
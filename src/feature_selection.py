@@ -0,0 +1,142 @@
+"""
+Feature reduction after vectorization.
+With a low min_df and n-grams the vocabulary runs to hundreds of thousands
+of terms, most of which say nothing about the city. The top k terms by chi2
+or by the mutual information of a term's presence with the city are kept,
+and the vectorizer's vocabulary is pruned to them, so the training matrix,
+the model and the saved vocabulary all shrink, and new documents are
+vectorized straight into the k columns. Alternatively, terms are collapsed
+into k hashed columns, keeping every term but fewer columns.
+"""
+
+import zlib
+import numpy as np
+import scipy.sparse as sp
+
+METHODS = ["chi2", "mutual_info", "hash"]
+
+
+def mutual_info_scores(x, labels):
+    """
+    Compute the mutual information between the presence of each term in a
+    document and the document's class.
+    :param x: scipy sparse matrix, the feature matrix.
+    :param labels: ndarray of int, the class of each document.
+    :return: ndarray of float, the mutual information of each feature, in nats.
+    """
+    classes, labels = np.unique(labels, return_inverse=True)
+    n_docs = x.shape[0]
+    present = sp.csr_matrix(x, copy=True)
+    present.eliminate_zeros()
+    present.data = np.ones_like(present.data, dtype=np.float64)
+    onehot = sp.csr_matrix((np.ones(n_docs), (np.arange(n_docs), labels)),
+                           shape=(n_docs, len(classes)))
+    # The number of documents of each class with and without each term
+    with_term = np.asarray((present.T @ onehot).todense())
+    class_docs = np.bincount(labels, minlength=len(classes)).astype(np.float64)
+    without_term = class_docs - with_term
+    term_docs = with_term.sum(axis=1, keepdims=True)
+    scores = np.zeros(x.shape[1])
+    for joint, marginal in [(with_term, term_docs), (without_term, n_docs - term_docs)]:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terms = joint / n_docs * np.log(joint * n_docs / (marginal * class_docs))
+        scores += np.nansum(np.where(joint > 0, terms, 0), axis=1)
+    return scores
+
+
+def feature_scores(x, labels, method="chi2"):
+    """
+    Score how informative each feature is about the class.
+    :param x: scipy sparse matrix, the non-negative feature matrix.
+    :param labels: ndarray of int, the class of each document.
+    :param method: str, "chi2" or "mutual_info".
+    :return: ndarray of float, the score of each feature. Features that are
+             never present score 0.
+    """
+    if method == "chi2":
+        from sklearn.feature_selection import chi2
+        scores, _ = chi2(x, labels)
+    elif method == "mutual_info":
+        scores = mutual_info_scores(x, labels)
+    else:
+        raise ValueError("method must be one of {}".format(METHODS[:2]))
+    return np.nan_to_num(scores)
+
+
+def top_features(scores, k):
+    """
+    Find the k highest scoring features.
+    :param scores: ndarray of float, the score of each feature.
+    :param k: int, the number of features to keep.
+    :return: ndarray of int, the kept feature columns in ascending order.
+             Ties are broken in favour of earlier columns.
+    """
+    if k >= len(scores):
+        return np.arange(len(scores))
+    return np.sort(np.argsort(-scores, kind="stable")[:k])
+
+
+def prune_vectorizer(vectorizer, keep):
+    """
+    Reduce a fitted CountVectorizer or TfidfVectorizer to a subset of its
+    feature columns, in place.
+    :param vectorizer: a fitted SK-Learn CountVectorizer or TfidfVectorizer.
+    :param keep: ndarray of int, the feature columns to keep, in ascending
+                 order. They become columns 0 to len(keep) - 1.
+    """
+    columns = np.full(len(vectorizer.vocabulary_), -1, dtype=np.int64)
+    columns[keep] = np.arange(len(keep))
+    idf = getattr(vectorizer, "idf_", None) if getattr(vectorizer, "use_idf", False) else None
+    vectorizer.vocabulary_ = {term: int(columns[column])
+                              for term, column in vectorizer.vocabulary_.items()
+                              if columns[column] >= 0}
+    if idf is not None:
+        # The idf_ setter checks its length against the vocabulary
+        vectorizer.idf_ = idf[keep]
+        # A vectorizer fitted on documents also checks the number of columns
+        tfidf = getattr(vectorizer, "_tfidf", None)
+        if hasattr(tfidf, "n_features_in_"):
+            tfidf.n_features_in_ = len(keep)
+
+
+class HashedFeatures:
+    """
+    Vectorizes documents with a fitted vectorizer and sums its feature
+    columns into a fixed number of hashed columns. The hash of a term is the
+    same in every process, so a saved model vectorizes new documents into
+    the columns it was trained on.
+    """
+    def __init__(self, vectorizer, n_features, dtype=None):
+        """
+        Instantiate the hashed features.
+        :param vectorizer: a fitted vectorizer with a vocabulary_.
+        :param n_features: int, the number of hashed columns.
+        :param dtype: the dtype of the feature matrix, or None for the
+                      vectorizer's dtype.
+        """
+        self.vectorizer = vectorizer
+        self.n_features = n_features
+        self.dtype = np.dtype(dtype or vectorizer.dtype)
+        buckets = np.empty(len(vectorizer.vocabulary_), dtype=np.int64)
+        for term, column in vectorizer.vocabulary_.items():
+            buckets[column] = zlib.crc32(term.encode("utf-8")) % n_features
+        self.projection = sp.csr_matrix(
+            (np.ones(len(buckets), dtype=self.dtype), (np.arange(len(buckets)), buckets)),
+            shape=(len(buckets), n_features))
+
+    def collapse(self, x):
+        """
+        Sum the columns of a feature matrix of the vectorizer into their
+        hashed columns.
+        :param x: scipy sparse matrix, as returned by the vectorizer.
+        :return: scipy sparse CSR matrix with n_features columns.
+        """
+        return (sp.csr_matrix(x, dtype=self.dtype) @ self.projection).tocsr()
+
+    def transform(self, docs):
+        """
+        Vectorize documents into the hashed columns.
+        :param docs: list or ndarray of str, the documents.
+        :return: scipy sparse CSR matrix
+        """
+        return self.collapse(self.vectorizer.transform(docs))
@@ -0,0 +1,450 @@
+"""
+Content-addressed store of processed documents and feature rows.
+Documents are keyed by a hash of their text, within a namespace for the
+preprocessing settings, so retraining on a corpus that has grown by a daily
+scrape only cleans and stems/lemmatizes the new descriptions.
+The term counts of each document are stored against a term dictionary that
+grows with the corpus, so a vocabulary can be refit from the stored counts
+without tokenizing the documents again. Feature rows are keyed by the
+document and the fitted vectorizer, so transforming documents with a frozen
+vocabulary only vectorizes the new ones.
+"""
+
+from weakref import WeakKeyDictionary
+from sys import argv
+import hashlib
+import json
+import pickle
+import sqlite3
+import time
+import numpy as np
+from scipy import sparse
+
+# Bump when the cleaning or stemming/lemmatizing code changes its output, so
+# that documents processed by older code are not reused
+PREPROCESS_VERSION = 1
+
+# Vectorizer fingerprints, computed once per fitted vectorizer
+_fingerprints = WeakKeyDictionary()
+
+
+def document_keys(series):
+    """
+    Get the content hash of each document.
+    :param series: Pandas Series, ndarray or list of str, the documents.
+    :return: list of bytes
+    """
+    return [hashlib.sha1(text.encode("utf-8")).digest() for text in series]
+
+
+def processing_config(processing):
+    """
+    Get the key of the preprocessing settings of an NLPProcessing object:
+    the settings that change the cleaned and stemmed/lemmatized text.
+    :param processing: NLPProcessing
+    :return: str
+    """
+    settings = {"version": PREPROCESS_VERSION,
+                "stemlem": processing.stemlem,
+                "use_stopwords": processing.use_stopwords,
+                "stopwords": sorted(processing.get_stopwords()) if processing.use_stopwords else []}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def vectorizer_fingerprint(vectorizer):
+    """
+    Get a hash of a fitted vectorizer: its settings, vocabulary and weights.
+    Vectorizers with the same fingerprint give the same feature rows.
+    :param vectorizer: a fitted SK-Learn or VocabularyVectorizer vectorizer.
+    :return: str
+    """
+    # Refitting a vectorizer replaces its vocabulary
+    vocabulary = getattr(vectorizer, "vocabulary_", None)
+    cached = _fingerprints.get(vectorizer)
+    if cached is not None and cached[0] is vocabulary:
+        return cached[1]
+    # stop_words_ is a set of the terms cut by min_df and max_df, which does
+    # not change the features and is pickled in an arbitrary order
+    state = {name: value for name, value in vars(vectorizer).items()
+             if name != "stop_words_"}
+    digest = hashlib.sha1(type(vectorizer).__name__.encode("utf-8"))
+    digest.update(pickle.dumps(state, protocol=4))
+    fingerprint = digest.hexdigest()
+    _fingerprints[vectorizer] = (vocabulary, fingerprint)
+    return fingerprint
+
+
+class FeatureStore:
+    """
+    Processed documents and feature rows persisted in SQLite.
+    Each preprocessing configuration and each vectorizer has its own
+    namespace, with the time it was last used, so namespaces of settings
+    that are no longer used can be garbage collected.
+    """
+    def __init__(self, path):
+        """
+        Open the store, creating it if necessary.
+        :param path: str, the SQLite database file.
+        """
+        self.path = path
+        self._conn = None
+        self._terms = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def conn(self):
+        """
+        The database connection, opened on first use so the store can be
+        pickled with a model and sent to worker processes.
+        """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            with self._conn:
+                self._conn.execute("CREATE TABLE IF NOT EXISTS configs "
+                                   "(config TEXT PRIMARY KEY, last_used REAL)")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS documents "
+                                   "(config TEXT, key BLOB, text TEXT, stemmed TEXT, "
+                                   "PRIMARY KEY (config, key)) WITHOUT ROWID")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS spaces "
+                                   "(space TEXT PRIMARY KEY, config TEXT, last_used REAL)")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS terms "
+                                   "(space TEXT, term TEXT, id INTEGER, "
+                                   "PRIMARY KEY (space, term)) WITHOUT ROWID")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS rows "
+                                   "(space TEXT, key BLOB, indices BLOB, data BLOB, "
+                                   "PRIMARY KEY (space, key)) WITHOUT ROWID")
+        return self._conn
+
+    def __getstate__(self):
+        """
+        Drop the database connection when pickling.
+        """
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_terms"] = {}
+        return state
+
+    def _lookup(self, table, namespace_column, namespace, keys, columns):
+        """
+        Fetch the stored entries of a list of keys.
+        :param table: str, "documents" or "rows".
+        :param namespace_column: str, "config" or "space".
+        :param namespace: str, the config or space.
+        :param keys: list of bytes, the document keys.
+        :param columns: list of str, the columns to fetch.
+        :return: dict mapping each stored key to a tuple of its columns.
+        """
+        query = ("SELECT t.key, {} FROM wanted w JOIN {} t ON t.key = w.key "
+                 "AND t.{} = ?".format(", ".join("t." + c for c in columns),
+                                       table, namespace_column))
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (key BLOB PRIMARY KEY)")
+            self.conn.execute("DELETE FROM wanted")
+            self.conn.executemany("INSERT OR IGNORE INTO wanted (key) VALUES (?)",
+                                  ((key,) for key in keys))
+            found = {row[0]: row[1:] for row in self.conn.execute(query, (namespace,))}
+            self.conn.execute("DELETE FROM wanted")
+        return found
+
+    def preprocess(self, processing, series):
+        """
+        Clean and stem/lemmatize documents, processing only the documents
+        that are not already stored for the processing settings.
+        :param processing: NLPProcessing, the preprocessing settings.
+        :param series: Pandas Series, the job description text.
+        :return: tuple of ndarrays of str, the cleaned text and the
+                 stemmed/lemmatized text of each document.
+        """
+        config = processing_config(processing)
+        keys = document_keys(series)
+        found = self._lookup("documents", "config", config, keys, ["text", "stemmed"])
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            new = series.iloc[missing]
+            text = processing._preprocess(new, stem=False)
+            stemmed = processing._stemlem(text)
+            new_entries = {}
+            for i, doc_text, doc_stemmed in zip(missing, text, stemmed):
+                new_entries[keys[i]] = (doc_text, doc_stemmed)
+            found.update(new_entries)
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO documents (config, key, text, stemmed) "
+                    "VALUES (?, ?, ?, ?)",
+                    ((config, key, doc_text, doc_stemmed)
+                     for key, (doc_text, doc_stemmed) in new_entries.items()))
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO configs (config, last_used) "
+                              "VALUES (?, ?)", (config, time.time()))
+        text = np.empty(len(keys), dtype=object)
+        stemmed = np.empty(len(keys), dtype=object)
+        for i, key in enumerate(keys):
+            text[i], stemmed[i] = found[key]
+        return text, stemmed
+
+    def _touch(self, space, config):
+        """
+        Record that a namespace of feature rows or term counts was used.
+        :param space: str, the namespace.
+        :param config: str, the preprocessing config the namespace belongs to.
+        """
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO spaces (space, config, last_used) "
+                              "VALUES (?, ?, ?)", (space, config, time.time()))
+
+    @staticmethod
+    def _space(*parts):
+        """
+        Get the name of a namespace from its parts.
+        :param parts: str, the parts that identify the namespace.
+        :return: str
+        """
+        return hashlib.sha1(" ".join(parts).encode("utf-8")).hexdigest()
+
+    def _rows(self, space, keys, process, vectorize, dtype):
+        """
+        Fetch the stored sparse rows of documents, computing and storing the
+        rows of documents that are not stored.
+        :param space: str, the namespace of the rows.
+        :param keys: list of bytes, the key of each document.
+        :param process: function that takes a list of positions of documents
+                        that are not stored and returns the documents.
+        :param vectorize: function that takes the documents returned by
+                          process and returns their rows as a scipy sparse
+                          CSR matrix.
+        :param dtype: numpy dtype of the values.
+        :return: tuple of (list of ndarray, list of ndarray), the column
+                 indices and values of each row. Stored rows are read-only
+                 views.
+        """
+        found = self._lookup("rows", "space", space, keys, ["indices", "data"])
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        computed = {}
+        if missing:
+            new = vectorize(process(missing))
+            for row, i in enumerate(missing):
+                start, end = new.indptr[row], new.indptr[row + 1]
+                computed[keys[i]] = (new.indices[start:end].astype(np.int32),
+                                     new.data[start:end])
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO rows (space, key, indices, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    ((space, key, indices.tobytes(), data.tobytes())
+                     for key, (indices, data) in computed.items()))
+        indices, data = [], []
+        for key in keys:
+            if key in computed:
+                row_indices, row_data = computed[key]
+            else:
+                row_indices, row_data = found[key]
+                row_indices = np.frombuffer(row_indices, dtype=np.int32)
+                row_data = np.frombuffer(row_data, dtype=dtype)
+            indices.append(row_indices)
+            data.append(row_data)
+        return indices, data
+
+    @staticmethod
+    def _csr(indices, data, n_columns, dtype):
+        """
+        Assemble rows into a sparse matrix.
+        :param indices: list of ndarray, the column indices of each row.
+        :param data: list of ndarray, the values of each row.
+        :param n_columns: int, the number of columns.
+        :param dtype: numpy dtype of the values.
+        :return: scipy sparse CSR matrix
+        """
+        indptr = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in indices], out=indptr[1:])
+        return sparse.csr_matrix(
+            (np.concatenate(data).astype(dtype, copy=False) if data else np.empty(0, dtype),
+             np.concatenate(indices) if indices else np.empty(0, np.int32), indptr),
+            shape=(len(indices), n_columns))
+
+    def features(self, processing, keys, process, stemmed):
+        """
+        Vectorize documents with the fitted vectorizer of an NLPProcessing
+        object, vectorizing only the documents whose rows are not already
+        stored for the vectorizer, eg documents added since a vocabulary was
+        frozen.
+        :param processing: NLPProcessing, with a fitted vectorizer.
+        :param keys: list of bytes, the key of each document, as
+                     document_keys of the text given to NLPProcessing.
+        :param process: function that takes a list of positions of documents
+                        and returns the processed documents.
+        :param stemmed: bool, whether the documents are stemmed/lemmatized.
+        :return: scipy sparse CSR matrix of float64
+        """
+        config = processing_config(processing)
+        space = self._space(config, "stemmed" if stemmed else "text",
+                            vectorizer_fingerprint(processing.vectorize))
+        vectorize = processing.vectorize
+        indices, data = self._rows(space, keys, process, lambda docs: vectorize.transform(
+            np.asarray(docs, dtype=object)).astype(np.float64).tocsr(), np.float64)
+        self._touch(space, config)
+        n_features = len(getattr(vectorize, "vocabulary_", ())) or vectorize.transform(
+            np.array([""], dtype=object)).shape[1]
+        return self._csr(indices, data, n_features, np.float64)
+
+    def _term_ids(self, space, new_terms=()):
+        """
+        Get the term dictionary of a namespace, adding new terms if required.
+        :param space: str, the namespace of the term dictionary.
+        :param new_terms: iterable of str, terms to add if not yet present.
+        :return: tuple of (dict, list), mapping terms to ids and ids to terms.
+        """
+        ids, terms = self._terms.setdefault(space, ({}, []))
+
+        def refresh():
+            for term, term_id in self.conn.execute(
+                    "SELECT term, id FROM terms WHERE space = ? AND id >= ? ORDER BY id",
+                    (space, len(terms))):
+                ids[term] = term_id
+                terms.append(term)
+
+        refresh()
+        new_terms = [term for term in new_terms if term not in ids]
+        if new_terms:
+            # Other processes may add terms too, so ids are allocated while
+            # holding the write lock
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                refresh()
+                new_terms = [term for term in dict.fromkeys(new_terms) if term not in ids]
+                start = len(terms)
+                self.conn.executemany("INSERT INTO terms (space, term, id) VALUES (?, ?, ?)",
+                                      ((space, term, start + i)
+                                       for i, term in enumerate(new_terms)))
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            for term in new_terms:
+                ids[term] = len(terms)
+                terms.append(term)
+        return ids, terms
+
+    def counts(self, processing, keys, process, stemmed):
+        """
+        Count the terms of documents, tokenizing only the documents whose
+        counts are not already stored. Terms are numbered in the order they
+        were first stored, by a dictionary shared by every document processed
+        with the same settings and n-gram range, so a vocabulary can be fit
+        from the counts of any set of documents.
+        :param processing: NLPProcessing, the preprocessing and n-gram
+                           settings.
+        :param keys: list of bytes, the key of each document, as
+                     document_keys of the text given to NLPProcessing.
+        :param process: function that takes a list of positions of documents
+                        and returns the processed documents.
+        :param stemmed: bool, whether the documents are stemmed/lemmatized.
+        :return: tuple of (scipy sparse CSR matrix of int64, ndarray of str),
+                 the term counts of each document and the term of each id.
+        """
+        from sklearn.feature_extraction.text import CountVectorizer
+        config = processing_config(processing)
+        analyzer_params = CountVectorizer(ngram_range=tuple(processing.n_grams)).get_params()
+        term_space = self._space(config, "terms", json.dumps(analyzer_params, sort_keys=True,
+                                                             default=str))
+        space = self._space(term_space, "stemmed" if stemmed else "text")
+        analyze = CountVectorizer(**analyzer_params).build_analyzer()
+
+        def count(docs):
+            tokens = [analyze(doc) for doc in docs]
+            ids, _ = self._term_ids(term_space, (term for doc in tokens for term in doc))
+            columns, counts = [], []
+            for doc in tokens:
+                doc_columns = np.fromiter((ids[term] for term in doc), np.int64, len(doc))
+                doc_columns, doc_counts = np.unique(doc_columns, return_counts=True)
+                columns.append(doc_columns)
+                counts.append(doc_counts)
+            return self._csr(columns, counts, len(ids), np.int64)
+
+        indices, data = self._rows(space, keys, process, count, np.int64)
+        self._touch(term_space, config)
+        self._touch(space, config)
+        _, terms = self._term_ids(term_space)
+        return (self._csr(indices, data, len(terms), np.int64),
+                np.asarray(terms, dtype=object))
+
+    def gc(self, max_age_days=30, keep=None):
+        """
+        Remove the documents, term counts and feature rows of preprocessing
+        settings and vectorizers that have not been used recently.
+        :param max_age_days: float, remove namespaces not used for this many
+                             days.
+        :param keep: list of NLPProcessing, settings whose documents are kept
+                     however old they are.
+        :return: dict with the number of configs, documents, namespaces,
+                 rows and terms removed.
+        """
+        cutoff = time.time() - max_age_days * 86400
+        kept = {processing_config(processing) for processing in keep or []}
+        configs = [config for (config,) in self.conn.execute(
+            "SELECT config FROM configs WHERE last_used < ?", (cutoff,))
+            if config not in kept]
+        spaces = [space for space, config in self.conn.execute(
+            "SELECT space, config FROM spaces WHERE last_used < ?", (cutoff,))
+            if config not in kept]
+        removed = {"configs": len(configs), "documents": 0, "spaces": 0, "rows": 0,
+                   "terms": 0}
+        with self.conn:
+            for config in configs:
+                removed["documents"] += self.conn.execute(
+                    "DELETE FROM documents WHERE config = ?", (config,)).rowcount
+                self.conn.execute("DELETE FROM configs WHERE config = ?", (config,))
+                spaces += [space for (space,) in self.conn.execute(
+                    "SELECT space FROM spaces WHERE config = ?", (config,))
+                    if space not in spaces]
+            for space in spaces:
+                removed["rows"] += self.conn.execute(
+                    "DELETE FROM rows WHERE space = ?", (space,)).rowcount
+                removed["terms"] += self.conn.execute(
+                    "DELETE FROM terms WHERE space = ?", (space,)).rowcount
+                self.conn.execute("DELETE FROM spaces WHERE space = ?", (space,))
+                self._terms.pop(space, None)
+        removed["spaces"] = len(spaces)
+        if configs or spaces:
+            self.conn.execute("VACUUM")
+        return removed
+
+    def stats(self):
+        """
+        Get the hit and miss counts since the store was opened, and the
+        number of stored documents and feature rows.
+        :return: dict
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "configs": self.conn.execute("SELECT COUNT(*) FROM configs").fetchone()[0],
+                "documents": self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0],
+                "spaces": self.conn.execute("SELECT COUNT(*) FROM spaces").fetchone()[0],
+                "rows": self.conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]}
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+if __name__ == "__main__":
+    """
+    Code that runs if called from the command line
+    To show the contents of a store:
+    Call: python -m src.feature_store <store_file>
+    To remove settings and vectorizers not used for max_age_days days:
+    Call: python -m src.feature_store <store_file> gc [max_age_days]
+    """
+    store = FeatureStore(argv[1])
+    if len(argv) > 2 and argv[2] == "gc":
+        print(store.gc(float(argv[3]) if len(argv) > 3 else 30))
+    print(store.stats())
+    store.close()
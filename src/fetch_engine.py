@@ -0,0 +1,189 @@
+"""
+Concurrent, rate-limited HTTP fetch engine used by the web scraper.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import urlparse
+import random
+
+# Status codes that indicate a transient failure worth retrying
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket that limits the request rate to a single host.
+    """
+    def __init__(self, rate, capacity=1):
+        """
+        Instantiate the token bucket. The bucket starts full.
+        :param rate: float, the number of tokens added per second.
+        :param capacity: int, the maximum number of tokens (burst size).
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available, and then consume it.
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class FetchEngine:
+    """
+    Fetches web pages through a pooled HTTP session, with bounded concurrency,
+    a per-host token bucket rate limit and retries with exponential backoff.
+    """
+    def __init__(self, max_workers=8, rate=2.0, burst=1, max_retries=3,
+                 backoff=1.0, timeout=30, session=None, cache=None):
+        """
+        Instantiate the fetch engine.
+        :param max_workers: int, the maximum number of concurrent requests.
+        :param rate: float, maximum requests per second to any one host.
+                     If None or 0, requests are not rate limited.
+        :param burst: int, the number of requests that may be made back to back.
+        :param max_retries: int, retries on connection errors, 429 and 5xx.
+        :param backoff: float, base delay in seconds between retries.
+        :param timeout: float, seconds to wait for a server response.
+        :param session: requests.Session to reuse, if applicable.
+        :param cache: ResponseCache to serve and store responses, if applicable.
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = session if session is not None else self._create_session()
+        self.cache = cache
+        self.buckets = {}
+        self.lock = Lock()
+
+    def _create_session(self):
+        """
+        Create an HTTP session whose connection pool matches the concurrency.
+        :return: requests.Session
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _get_bucket(self, url):
+        """
+        Return the token bucket for the host of the given URL.
+        :param url: str, the URL about to be requested.
+        :return: TokenBucket
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def _backoff_delay(self, attempt, page):
+        """
+        Get the delay before the next retry.
+        Honours a numeric Retry-After header, otherwise backs off exponentially
+        with a small amount of jitter.
+        :param attempt: int, the number of the failed attempt (from 0).
+        :param page: requests.Response or None, the failed response.
+        :return: float, the number of seconds to wait.
+        """
+        if page is not None:
+            retry_after = page.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+
+    def request(self, url, headers=None):
+        """
+        Make a GET request, retrying transient failures.
+        :param url: str, the URL to request.
+        :param headers: dict, extra request headers, if applicable.
+        :return: requests.Response, or None if every attempt failed.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.rate:
+                self._get_bucket(url).acquire()
+            try:
+                page = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException:
+                page = None
+            if page is not None and page.status_code not in RETRY_STATUS:
+                return page
+            if attempt < self.max_retries:
+                sleep(self._backoff_delay(attempt, page))
+        return None
+
+    def get(self, url, max_age=None):
+        """
+        Get the HTML text of a single page.
+        With a cache, a fresh cached response is returned without a request,
+        and a stale one is revalidated with a conditional request.
+        :param url: str, the URL to fetch.
+        :param max_age: float, seconds a cached response may be used for
+                        without revalidation. Defaults to the cache TTL.
+        :return: str, the page text, or None if it does not exist or failed.
+        """
+        if self.cache is None:
+            page = self.request(url)
+            if page is None or page.status_code == 404:
+                return None
+            return page.text
+
+        entry = self.cache.lookup(url)
+        text = None if entry is None else self.cache.read_text(entry)
+        if entry is not None and text is None:
+            # The body is missing or corrupt, so the entry cannot be
+            # revalidated: a 304 would leave nothing to return
+            self.cache.forget(url)
+            entry = None
+        if entry is not None and self.cache.is_fresh(entry, max_age):
+            return None if entry["status"] == 404 else text
+        if self.cache.offline:
+            return None
+        page = self.request(url, headers=self.cache.conditional_headers(entry))
+        if page is None:
+            return None
+        if page.status_code == 304 and entry is not None:
+            self.cache.revalidated(url)
+            return None if entry["status"] == 404 else text
+        self.cache.store(url, page)
+        return None if page.status_code == 404 else page.text
+
+    def fetch_all(self, urls):
+        """
+        Fetch several pages concurrently.
+        :param urls: list of str, the URLs to fetch.
+        :return: list of str or None, the page texts in the same order as urls.
+        """
+        if self.max_workers == 1 or len(urls) <= 1:
+            return [self.get(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self.get, urls))
+
+    def close(self):
+        """
+        Release the pooled connections.
+        """
+        self.session.close()
@@ -0,0 +1,311 @@
+"""
+Pluggable HTML parsers for Indeed results and job description pages.
+Every parser extracts the same fields in a single pass over each result row,
+so the fastest installed backend can be used in place of BeautifulSoup.
+"""
+
+from bs4 import BeautifulSoup
+from collections import namedtuple
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+# The parsed contents of a search results page
+ResultsPage = namedtuple("ResultsPage", ["rows", "has_next", "next_href",
+                                         "job_count"])
+
+
+def _has_class(name):
+    """
+    XPath predicate that matches elements with the given class, like
+    BeautifulSoup's attrs={"class": name}.
+    :param name: str, the class name.
+    :return: str, the XPath predicate.
+    """
+    return "[contains(concat(' ', normalize-space(@class), ' '), ' {} ')]".format(name)
+
+
+def clean_text(text):
+    """
+    Tidy up the raw text of a web page.
+    :param text: str, all of the text on the page.
+    :return: str, the non-blank lines and phrases of the page.
+    """
+    # break into lines and remove leading and trailing space on each
+    lines = (line.strip() for line in text.splitlines())
+    # break multi-headlines into a line each
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    # drop any blank lines
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
+
+def make_row(url, title, company, company_link, location, date):
+    """
+    Create a result row from the raw text of its fields.
+    :param url: str, the href of the job title link.
+    :param title: str, the title attribute of the job title link.
+    :param company: str or None, the text of the company span.
+    :param company_link: str or None, the text of the company name link.
+    :param location: str or None, the text of the location span.
+    :param date: str or None, the text of the date span.
+    :return: dict of listing fields.
+    """
+    if company is None:
+        company = "N/A"
+    else:
+        # The company name can appear in one of a couple of different places
+        company = ' '.join((company if company_link is None
+                            else company_link).split()).replace(",", "")
+    return {"url": url,
+            "job_title": title.replace(",", ""),
+            "company": company,
+            "location": "N/A" if location is None else location.replace(",", ""),
+            "date": date}
+
+
+def parse_job_count(text):
+    """
+    Get the number of jobs from the search count text.
+    :param text: str or None, eg "Page 1 of 1,234 jobs".
+    :return: int or None
+    """
+    if text is None:
+        return None
+    return int(text.split(" ")[-2].replace(",", ""))
+
+
+class SoupParser:
+    """
+    Parses pages with BeautifulSoup. This is the slowest parser, but works
+    with only BeautifulSoup installed.
+    """
+    def __init__(self, features="html.parser"):
+        """
+        Instantiate the parser.
+        :param features: str, the BeautifulSoup tree builder to use.
+        """
+        self.features = features
+
+    def parse_results(self, html):
+        """
+        Extract every result row and the pagination from a results page.
+        :param html: str, the page HTML.
+        :return: ResultsPage
+        """
+        soup = BeautifulSoup(html, self.features)
+        rows = []
+        for div in soup.find_all(name="div", attrs={"class": "row"}):
+            a = div.find(name="a", attrs={"data-tn-element": "jobTitle"})
+            if a is None:
+                continue
+            company = div.find(name="span", attrs={"class": "company"})
+            link = div.find(name="a", attrs={"data-tn-element": "companyName"})
+            location = div.find(name="span", attrs={"class": "location"})
+            date = div.find(name="span", attrs={"class": "date"})
+            rows.append(make_row(a["href"], a.get("title", ""),
+                                 None if company is None else company.text,
+                                 None if link is None else link.text,
+                                 None if location is None else location.text,
+                                 None if date is None else date.text))
+        has_next = any("Next" in tag.text for tag in
+                       soup.find_all(name="span", attrs={"class": "np"}))
+        pagination = soup.find(name="div", attrs={"class": "pagination"})
+        links = [] if pagination is None else pagination.find_all("a")
+        count = soup.find("div", {"id": "searchCount"})
+        return ResultsPage(rows, has_next, links[-1]["href"] if links else None,
+                           parse_job_count(None if count is None else count.text))
+
+    def parse_description(self, html):
+        """
+        Extract the visible text from a job description page.
+        :param html: str, the page HTML.
+        :return: str, the job description text.
+        """
+        soup = BeautifulSoup(html, self.features)
+        # Remove all script and style elements
+        for script in soup(["script", "style"]):
+            script.extract()
+        return clean_text(soup.get_text())
+
+
+class LxmlParser:
+    """
+    Parses pages with lxml and XPath.
+    """
+    def __init__(self):
+        """
+        Instantiate the parser.
+        """
+        if lxml is None:
+            raise ImportError("The lxml parser requires lxml to be installed")
+        self.parser = lxml.html.HTMLParser(encoding="utf-8")
+
+    def _parse(self, html):
+        """
+        Parse HTML into an lxml document.
+        :param html: str, the page HTML.
+        :return: lxml HtmlElement, or None if the page is empty.
+        """
+        try:
+            return lxml.html.document_fromstring(html.encode("utf-8"),
+                                                 parser=self.parser)
+        except etree.ParserError:
+            return None
+
+    def parse_results(self, html):
+        """
+        Extract every result row and the pagination from a results page.
+        :param html: str, the page HTML.
+        :return: ResultsPage
+        """
+        doc = self._parse(html)
+        if doc is None:
+            return ResultsPage([], False, None, None)
+
+        def first_text(div, xpath):
+            found = div.xpath(xpath)
+            return found[0].text_content() if found else None
+
+        rows = []
+        for div in doc.xpath("//div" + _has_class("row")):
+            a = div.xpath(".//a[@data-tn-element='jobTitle']")
+            if not a:
+                continue
+            rows.append(make_row(
+                a[0].get("href"), a[0].get("title", ""),
+                first_text(div, ".//span" + _has_class("company")),
+                first_text(div, ".//a[@data-tn-element='companyName']"),
+                first_text(div, ".//span" + _has_class("location")),
+                first_text(div, ".//span" + _has_class("date"))))
+        has_next = any("Next" in tag.text_content() for tag in
+                       doc.xpath("//span" + _has_class("np")))
+        links = doc.xpath("(//div{})[1]//a".format(_has_class("pagination")))
+        count = doc.xpath("//div[@id='searchCount']")
+        return ResultsPage(rows, has_next, links[-1].get("href") if links else None,
+                           parse_job_count(count[0].text_content() if count else None))
+
+    def parse_description(self, html):
+        """
+        Extract the visible text from a job description page.
+        :param html: str, the page HTML.
+        :return: str, the job description text.
+        """
+        doc = self._parse(html)
+        if doc is None:
+            return ""
+        # Remove all script and style elements
+        etree.strip_elements(doc, "script", "style", with_tail=False)
+        return clean_text("".join(doc.xpath("//text()")))
+
+
+class SelectolaxParser:
+    """
+    Parses pages with selectolax (the Modest/Lexbor engines), the fastest
+    parser.
+    """
+    def __init__(self):
+        """
+        Instantiate the parser.
+        """
+        if HTMLParser is None:
+            raise ImportError("The selectolax parser requires selectolax to be installed")
+
+    def parse_results(self, html):
+        """
+        Extract every result row and the pagination from a results page.
+        :param html: str, the page HTML.
+        :return: ResultsPage
+        """
+        tree = HTMLParser(html)
+
+        def first_text(div, selector):
+            found = div.css_first(selector)
+            return None if found is None else found.text()
+
+        rows = []
+        for div in tree.css("div.row"):
+            a = div.css_first('a[data-tn-element="jobTitle"]')
+            if a is None:
+                continue
+            rows.append(make_row(
+                a.attributes.get("href"), a.attributes.get("title") or "",
+                first_text(div, "span.company"),
+                first_text(div, 'a[data-tn-element="companyName"]'),
+                first_text(div, "span.location"),
+                first_text(div, "span.date")))
+        has_next = any("Next" in tag.text() for tag in tree.css("span.np"))
+        pagination = tree.css_first("div.pagination")
+        links = [] if pagination is None else pagination.css("a")
+        count = tree.css_first("div#searchCount")
+        return ResultsPage(rows, has_next,
+                           links[-1].attributes.get("href") if links else None,
+                           parse_job_count(None if count is None else count.text()))
+
+    def parse_description(self, html):
+        """
+        Extract the visible text from a job description page.
+        :param html: str, the page HTML.
+        :return: str, the job description text.
+        """
+        tree = HTMLParser(html)
+        # Remove all script and style elements
+        tree.strip_tags(["script", "style"])
+        if tree.root is None:
+            return ""
+        return clean_text(tree.root.text())
+
+
+def _soup_lxml_parser():
+    """
+    Create a BeautifulSoup parser that uses the lxml tree builder.
+    :return: SoupParser
+    """
+    if lxml is None:
+        raise ImportError("The bs4-lxml parser requires lxml to be installed")
+    return SoupParser("lxml")
+
+
+PARSERS = {"selectolax": SelectolaxParser,
+           "lxml": LxmlParser,
+           "bs4-lxml": _soup_lxml_parser,
+           "html.parser": SoupParser}
+
+
+def available_parsers():
+    """
+    List the parsers whose dependencies are installed, fastest first.
+    :return: list of str, the parser names.
+    """
+    names = []
+    for name, parser in PARSERS.items():
+        try:
+            parser()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_parser(name=None):
+    """
+    Get an HTML parser by name.
+    :param name: str, one of PARSERS. If None, the fastest installed parser
+                 is used, falling back to BeautifulSoup's html.parser.
+    :return: SelectolaxParser, LxmlParser or SoupParser
+    """
+    if name is None:
+        name = available_parsers()[0]
+    if name not in PARSERS:
+        raise ValueError("parser must be one of {}".format(list(PARSERS)))
+    return PARSERS[name]()
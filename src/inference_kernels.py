@@ -0,0 +1,455 @@
+"""
+Scoring kernels compiled from fitted classifiers.
+A kernel holds only NumPy arrays and plain attributes, and computes the
+same probabilities as the model's predict_proba with NumPy and SciPy alone:
+Naive Bayes and logistic regression become a dense weight matrix and a
+bias, and tree ensembles (SK-Learn forests, gradient boosting and XGBoost)
+become flat node arrays that are traversed for every row and every tree at
+once. Compiling needs the fitted model, but scoring imports neither
+SK-Learn nor XGBoost, skips their input validation, and the kernels can be
+saved as arrays in a model artifact.
+"""
+
+import json
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import expit
+
+
+def _logsumexp(a):
+    """
+    Compute log(sum(exp(a))) of each row, as scipy.special.logsumexp does.
+    :param a: 2d ndarray of float.
+    :return: ndarray of shape (n_rows, 1)
+    """
+    a_max = a.max(axis=1, keepdims=True)
+    a_max[~np.isfinite(a_max)] = 0
+    with np.errstate(divide="ignore"):
+        return np.log(np.exp(a - a_max).sum(axis=1, keepdims=True)) + a_max
+
+
+def _softmax(a):
+    """
+    Normalize each row of scores into probabilities. Float32 scores are
+    exponentiated and summed in double precision and rounded back, as
+    XGBoost does.
+    :param a: 2d ndarray of float.
+    :return: ndarray of the dtype of a.
+    """
+    shifted = a - a.max(axis=1, keepdims=True)
+    exps = np.exp(shifted.astype(np.float64)).astype(a.dtype)
+    return exps / exps.sum(axis=1, keepdims=True, dtype=np.float64).astype(a.dtype)
+
+
+class _Kernel:
+    """
+    The prediction methods shared by the kernels.
+    """
+    def predict(self, x):
+        """
+        Predict the class of each row.
+        :param x: scipy sparse matrix or ndarray, the feature matrix.
+        :return: ndarray, the class of each row.
+        """
+        return self.classes_[self.predict_proba(x).argmax(axis=1)]
+
+    def predict_log_proba(self, x):
+        """
+        Compute the log probability of each class for each row.
+        :param x: scipy sparse matrix or ndarray, the feature matrix.
+        :return: ndarray of shape (n_rows, n_classes)
+        """
+        with np.errstate(divide="ignore"):
+            return np.log(self.predict_proba(x))
+
+
+class LinearKernel(_Kernel):
+    """
+    Scores rows as x @ weights + bias, compiled from a MultinomialNB or a
+    LogisticRegression.
+    """
+    def __init__(self, classes, weights, bias, link, source):
+        """
+        Instantiate the kernel.
+        :param classes: ndarray, the class labels.
+        :param weights: ndarray of shape (n_classes, n_features).
+        :param bias: ndarray of shape (n_classes,).
+        :param link: str, how scores become probabilities: "log_softmax"
+                     (Naive Bayes joint log likelihoods), "softmax"
+                     (multinomial logistic regression) or "logistic"
+                     (one-vs-rest logistic regression).
+        :param source: str, the model attribute the weights came from,
+                       "feature_log_prob_" or "coef_", under which they are
+                       also available to explain predictions.
+        """
+        self.classes_ = classes
+        self.link = link
+        self.bias = bias
+        self.source = source
+        setattr(self, source, weights)
+
+    @property
+    def weights(self):
+        return getattr(self, self.source)
+
+    @property
+    def n_features_in_(self):
+        return self.weights.shape[1]
+
+    def decision_function(self, x):
+        """
+        Compute the score of each class for each row.
+        :param x: scipy sparse matrix or ndarray, the feature matrix.
+        :return: ndarray of shape (n_rows, n_classes)
+        """
+        return np.asarray(x @ self.weights.T) + self.bias
+
+    def predict_proba(self, x):
+        """
+        Compute the probability of each class for each row.
+        :param x: scipy sparse matrix or ndarray, the feature matrix.
+        :return: ndarray of shape (n_rows, n_classes)
+        """
+        scores = self.decision_function(x)
+        if self.link == "log_softmax":
+            return np.exp(scores - _logsumexp(scores))
+        if len(self.classes_) == 2 and scores.shape[1] == 1:
+            scores = scores.ravel()
+            if self.link == "softmax":
+                scores = np.c_[-scores, scores]
+            else:
+                positive = expit(scores)
+                return np.vstack([1 - positive, positive]).T
+        if self.link == "softmax":
+            return _softmax(scores)
+        probabilities = expit(scores)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+class TreeKernel(_Kernel):
+    """
+    Scores rows with an ensemble of binary trees stored as flat node
+    arrays. Every row is routed through every tree at once, one tree level
+    per step, and only the feature columns that some node splits on are
+    densified.
+    """
+    def __init__(self, classes, n_features, feature, threshold, left, right, default_left,
+                 value, roots, groups, kind, base=None, scale=1.0,
+                 feature_importances=None):
+        """
+        Instantiate the kernel.
+        :param classes: ndarray, the class labels.
+        :param n_features: int, the number of feature columns.
+        :param feature: ndarray of int, the feature each node splits on, -1
+                        for leaves.
+        :param threshold: ndarray of float, the threshold of each split.
+        :param left: ndarray of int, the node of the left child of each
+                     node, indexing the flat arrays.
+        :param right: ndarray of int, the node of the right child.
+        :param default_left: ndarray of bool, the child that missing values
+                             go to (XGBoost), or None if no value is missing.
+        :param value: ndarray of shape (n_nodes, n_outputs), the output of
+                      each leaf.
+        :param roots: ndarray of int, the root node of each tree.
+        :param groups: ndarray of int, the output column that each tree
+                       adds to, for boosted trees.
+        :param kind: str, how leaf outputs are combined: "forest" (the mean
+                     of the leaf class probabilities), "gradient_boosting"
+                     (SK-Learn) or "xgboost".
+        :param base: ndarray of float, the initial score of each output
+                     column, for boosted trees.
+        :param scale: float, the learning rate applied to each leaf output
+                      of SK-Learn gradient boosting.
+        :param feature_importances: ndarray of float, the feature importances
+                                    of the model, to explain predictions.
+        """
+        self.classes_ = classes
+        self.kind = kind
+        self.base = base
+        self.scale = scale
+        self.roots = roots.astype(np.int32)
+        self.groups = groups
+        self.value = value
+        self.default_left = default_left
+        # Features are renumbered to the columns they take in the densified
+        # matrix of the features that are split on
+        leaf = feature < 0
+        used, local = np.unique(feature[~leaf], return_inverse=True)
+        self.columns = np.full(n_features, -1, dtype=np.int32)
+        self.columns[used] = np.arange(len(used))
+        # Leaves send every row to themselves, so rows that have reached a
+        # leaf can keep stepping with the others
+        self.feature = np.zeros(len(feature), dtype=np.int32)
+        self.feature[~leaf] = local
+        self.threshold = np.where(leaf, np.inf, threshold).astype(threshold.dtype)
+        self.left = left.astype(np.int32)
+        self.right = right.astype(np.int32)
+        if default_left is not None:
+            self.default_left = default_left | leaf
+        self.feature_importances_ = feature_importances
+
+    @property
+    def n_features_in_(self):
+        return len(self.columns)
+
+    def _dense_features(self, x):
+        """
+        Densify the feature columns that the trees split on.
+        :param x: scipy sparse matrix or ndarray, the feature matrix.
+        :return: ndarray of float32 of shape (n_rows, n_used_features).
+                 Entries absent from a sparse matrix are missing (NaN) for
+                 XGBoost, whose sparse inputs treat them so, and 0 otherwise.
+        """
+        if not sp.issparse(x):
+            return np.asarray(x, dtype=np.float32)[:, np.flatnonzero(self.columns >= 0)]
+        if x.format != "csr":
+            x = x.tocsr()
+        fill = 0 if self.default_left is None else np.nan
+        dense = np.full((x.shape[0], self.columns.max(initial=-1) + 1), fill, dtype=np.float32)
+        local = self.columns[x.indices]
+        kept = local >= 0
+        rows = np.repeat(np.arange(x.shape[0]), np.diff(x.indptr))[kept]
+        local = local[kept]
+        if x.has_canonical_format:
+            dense[rows, local] = x.data[kept]
+        else:
+            # Duplicate entries of a row and column are summed
+            dense[rows, local] = 0
+            np.add.at(dense, (rows, local), x.data[kept].astype(np.float32))
+        return dense
+
+    def leaves(self, x):
+        """
+        Find the leaf that each row reaches in each tree.
+        :param x: scipy sparse matrix or ndarray, the feature matrix.
+        :return: ndarray of int of shape (n_rows, n_trees), indexing the
+                 flat node arrays.
+        """
+        dense = self._dense_features(x)
+        n_rows, n_trees = dense.shape[0], len(self.roots)
+        if not dense.shape[1]:
+            # Trees that are a single leaf split on no feature
+            dense = np.zeros((n_rows, 1), dtype=np.float32)
+        flat = dense.ravel()
+        nodes = np.tile(self.roots, n_rows)
+        # The start of each row in the flattened dense matrix
+        starts = np.repeat(np.arange(n_rows) * dense.shape[1], n_trees)
+        # The positions of the rows and trees that may not have reached a
+        # leaf, None for all of them
+        active = None
+        while True:
+            current = nodes if active is None else nodes[active]
+            values = flat[(starts if active is None else starts[active])
+                          + self.feature[current]]
+            if self.kind == "xgboost":
+                go_left = values < self.threshold[current]
+            else:
+                # SK-Learn compares float32 features with float64 thresholds
+                go_left = values <= self.threshold[current]
+            if self.default_left is not None:
+                missing = np.isnan(values)
+                go_left[missing] = self.default_left[current[missing]]
+            following = np.where(go_left, self.left[current], self.right[current])
+            moved = following != current
+            n_moved = np.count_nonzero(moved)
+            if not n_moved:
+                return nodes.reshape(n_rows, n_trees)
+            if active is None:
+                nodes = following
+            else:
+                nodes[active] = following
+            if n_moved < len(moved) // 2:
+                active = np.flatnonzero(moved) if active is None else active[moved]
+
+    def predict_proba(self, x):
+        """
+        Compute the probability of each class for each row.
+        Leaf outputs are summed tree by tree, in the order the model sums
+        them, with np.add.accumulate, which adds sequentially, so the sums
+        round exactly as the model's do.
+        :param x: scipy sparse matrix or ndarray, the feature matrix.
+        :return: ndarray of shape (n_rows, n_classes)
+        """
+        leaves = self.leaves(x)
+        if self.kind == "forest":
+            probabilities = np.add.accumulate(self.value[leaves], axis=1)[:, -1]
+            probabilities /= leaves.shape[1]
+            return probabilities
+        outputs = self.value[leaves, 0]
+        if self.kind == "gradient_boosting":
+            outputs *= self.scale
+        scores = np.empty((leaves.shape[0], len(self.base)), dtype=outputs.dtype)
+        for group in range(len(self.base)):
+            terms = np.empty((leaves.shape[0], np.count_nonzero(self.groups == group) + 1),
+                             dtype=outputs.dtype)
+            terms[:, 0] = self.base[group]
+            terms[:, 1:] = outputs[:, self.groups == group]
+            scores[:, group] = np.add.accumulate(terms, axis=1)[:, -1]
+        if scores.shape[1] == 1:
+            positive = expit(scores.ravel())
+            return np.vstack([1 - positive, positive]).T
+        if self.kind == "xgboost":
+            return _softmax(scores)
+        return np.nan_to_num(np.exp(scores - _logsumexp(scores)))
+
+
+def _flatten_trees(trees):
+    """
+    Concatenate the node arrays of several trees.
+    :param trees: list of dicts with the feature, threshold, left, right,
+                  value and optionally default_left arrays of a tree. Left
+                  and right index the tree's own nodes, and are -1 at leaves.
+    :return: dict of the concatenated arrays, with the root of each tree.
+    """
+    names = [name for name in ["feature", "threshold", "left", "right", "value",
+                               "default_left"] if trees and name in trees[0]]
+    flat = {name: [] for name in names}
+    roots, offset = [], 0
+    for tree in trees:
+        roots.append(offset)
+        leaf = tree["left"] < 0
+        for name in names:
+            flat[name].append(tree[name])
+        for name in ["left", "right"]:
+            # Leaves point to themselves
+            flat[name][-1] = np.where(leaf, np.arange(len(leaf)), tree[name]) + offset
+        flat["feature"][-1] = np.where(leaf, -1, tree["feature"])
+        offset += len(leaf)
+    flat = {name: np.concatenate(arrays) for name, arrays in flat.items()}
+    flat["roots"] = np.array(roots, dtype=np.int32)
+    return flat
+
+
+def _sklearn_tree(estimator, normalize=False):
+    """
+    Get the node arrays of a fitted SK-Learn decision tree.
+    :param estimator: a fitted DecisionTreeClassifier or DecisionTreeRegressor.
+    :param normalize: bool, turn the class counts of each leaf into class
+                      probabilities, as DecisionTreeClassifier.predict_proba.
+    :return: dict of node arrays.
+    """
+    tree = estimator.tree_
+    value = tree.value[:, 0, :]
+    if normalize:
+        totals = value.sum(axis=1, keepdims=True)
+        totals[totals == 0.0] = 1.0
+        value = value / totals
+    return {"feature": tree.feature, "threshold": tree.threshold,
+            "left": tree.children_left, "right": tree.children_right, "value": value}
+
+
+def _compile_forest(model):
+    """
+    Compile an SK-Learn random forest, extra trees or decision tree.
+    :param model: the fitted classifier.
+    :return: TreeKernel
+    """
+    if getattr(model, "n_outputs_", 1) != 1:
+        raise ValueError("Only single output forests can be compiled")
+    estimators = getattr(model, "estimators_", [model])
+    flat = _flatten_trees([_sklearn_tree(estimator, normalize=True)
+                           for estimator in estimators])
+    return TreeKernel(model.classes_, model.n_features_in_, flat["feature"],
+                      flat["threshold"], flat["left"], flat["right"], None, flat["value"],
+                      flat["roots"], np.zeros(len(estimators), dtype=np.int32), "forest",
+                      feature_importances=np.asarray(model.feature_importances_))
+
+
+def _compile_gradient_boosting(model):
+    """
+    Compile an SK-Learn GradientBoostingClassifier.
+    :param model: the fitted classifier.
+    :return: TreeKernel
+    """
+    # The initial estimator predicts the same scores for every row
+    base = model._raw_predict_init(sp.csr_matrix((1, model.n_features_in_),
+                                                 dtype=np.float32))[0]
+    stages = model.estimators_
+    flat = _flatten_trees([_sklearn_tree(tree) for tree in stages.ravel()])
+    groups = np.tile(np.arange(stages.shape[1], dtype=np.int32), stages.shape[0])
+    return TreeKernel(model.classes_, model.n_features_in_, flat["feature"],
+                      flat["threshold"], flat["left"], flat["right"], None, flat["value"],
+                      flat["roots"], groups, "gradient_boosting", base,
+                      scale=float(model.learning_rate),
+                      feature_importances=np.asarray(model.feature_importances_))
+
+
+def _compile_xgboost(model):
+    """
+    Compile an XGBoost XGBClassifier with a gbtree booster, from the JSON
+    dump of its booster.
+    :param model: the fitted classifier.
+    :return: TreeKernel
+    """
+    booster = model.get_booster()
+    learner = json.loads(booster.save_raw("json"))["learner"]
+    objective = learner["objective"]["name"]
+    if (learner["gradient_booster"]["name"] != "gbtree"
+            or objective not in ("binary:logistic", "multi:softprob")):
+        raise ValueError("Only gbtree boosters with a binary:logistic or "
+                         "multi:softprob objective can be compiled")
+    trees_json = learner["gradient_booster"]["model"]["trees"]
+    groups = np.array(learner["gradient_booster"]["model"]["tree_info"], dtype=np.int32)
+    try:
+        # predict_proba only uses the trees up to the best early stopping round
+        rounds = model.best_iteration + 1
+        trees_json = trees_json[:rounds * (len(trees_json) // booster.num_boosted_rounds())]
+        groups = groups[:len(trees_json)]
+    except AttributeError:
+        pass
+    trees = []
+    for tree in trees_json:
+        if tree["categories_nodes"]:
+            raise ValueError("Trees with categorical splits cannot be compiled")
+        conditions = np.array(tree["split_conditions"], dtype=np.float32)
+        trees.append({"feature": np.array(tree["split_indices"], dtype=np.int64),
+                      "threshold": conditions,
+                      "left": np.array(tree["left_children"], dtype=np.int64),
+                      "right": np.array(tree["right_children"], dtype=np.int64),
+                      # The split condition of a leaf is its output
+                      "value": conditions[:, None],
+                      "default_left": np.array(tree["default_left"], dtype=bool)})
+    flat = _flatten_trees(trees)
+    params = learner["learner_model_param"]
+    base = np.full(max(int(params["num_class"]), 1), np.float32(params["base_score"]))
+    if objective == "binary:logistic":
+        # The base score is a probability, which starts every row's margin
+        # at its log odds
+        base = -np.log(np.float32(1) / base - np.float32(1))
+    return TreeKernel(model.classes_, int(params["num_feature"]), flat["feature"],
+                      flat["threshold"], flat["left"], flat["right"], flat["default_left"],
+                      flat["value"], flat["roots"], groups, "xgboost", base,
+                      feature_importances=np.asarray(model.feature_importances_))
+
+
+def compile_model(model):
+    """
+    Compile a fitted classifier into a scoring kernel.
+    :param model: a fitted MultinomialNB, LogisticRegression,
+                  DecisionTreeClassifier, RandomForestClassifier,
+                  ExtraTreesClassifier, GradientBoostingClassifier or
+                  XGBClassifier.
+    :return: LinearKernel or TreeKernel, with the classes_, predict and
+             predict_proba of the model.
+    """
+    name = type(model).__name__
+    if isinstance(model, _Kernel):
+        return model
+    if name == "MultinomialNB":
+        return LinearKernel(model.classes_, np.asarray(model.feature_log_prob_),
+                            np.asarray(model.class_log_prior_), "log_softmax",
+                            "feature_log_prob_")
+    if name == "LogisticRegression":
+        ovr = model.multi_class in ("ovr", "warn") or (
+            model.multi_class == "auto" and (len(model.classes_) <= 2
+                                             or model.solver == "liblinear"))
+        return LinearKernel(model.classes_, np.asarray(model.coef_),
+                            np.asarray(model.intercept_), "logistic" if ovr else "softmax",
+                            "coef_")
+    if name in ("DecisionTreeClassifier", "RandomForestClassifier", "ExtraTreesClassifier"):
+        return _compile_forest(model)
+    if name == "GradientBoostingClassifier":
+        return _compile_gradient_boosting(model)
+    if name == "XGBClassifier":
+        return _compile_xgboost(model)
+    raise ValueError("{} cannot be compiled into a scoring kernel".format(name))
@@ -0,0 +1,462 @@
+"""
+Compact, versioned model artifacts that load quickly.
+A fitted JHPModel is saved as a directory holding a small JSON manifest with
+the preprocessing and vectorizer settings, the vocabulary as a sorted array
+of UTF-8 terms, and the IDF weights and model weights as NumPy arrays.
+The arrays are memory mapped when the artifact is loaded, so loading does
+not rebuild a Python dict of the vocabulary or copy the weights, and every
+web worker that maps the same files shares their pages through the
+operating system's page cache.
+Saving writes a new version directory and atomically switches a symbolic
+link to it, so the artifact is never missing or half written.
+An artifact whose model is a scoring kernel loads and predicts without
+importing SK-Learn or XGBoost.
+"""
+
+from .inference_kernels import compile_model
+from .nlp_processing import NLPProcessing
+from datetime import datetime
+from sys import argv
+import importlib
+import json
+import os
+import pickle
+import re
+import shutil
+import unicodedata
+import numpy as np
+import scipy.sparse as sp
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+# Each saved version of an artifact is kept in <path>.versions
+VERSIONS_SUFFIX = ".versions"
+# The version name of an artifact saved before versions were kept, which
+# sorts before the timestamped versions
+UNVERSIONED = "0-unversioned"
+
+# The vectorizer settings that determine how documents are tokenized
+ANALYZER_PARAMS = ["analyzer", "lowercase", "ngram_range", "strip_accents",
+                   "stop_words", "token_pattern", "binary"]
+PROCESSING_PARAMS = ["stemlem", "min_df", "max_df", "num_cities", "n_grams",
+                     "use_stopwords", "tokenize"]
+
+
+def strip_accents_unicode(text):
+    """
+    Remove accents, as SK-Learn's strip_accents="unicode".
+    :param text: str
+    :return: str
+    """
+    if text.isascii():
+        return text
+    return "".join(char for char in unicodedata.normalize("NFKD", text)
+                   if not unicodedata.combining(char))
+
+
+def strip_accents_ascii(text):
+    """
+    Remove accents and every other non-ASCII character, as SK-Learn's
+    strip_accents="ascii".
+    :param text: str
+    :return: str
+    """
+    return unicodedata.normalize("NFKD", text).encode("ASCII", "ignore").decode("ASCII")
+
+
+def word_analyzer(params):
+    """
+    Build the word analyzer of a CountVectorizer: lower case, strip accents,
+    find the tokens with the token pattern, remove stop words and join
+    consecutive tokens into n-grams.
+    :param params: dict, the CountVectorizer settings in ANALYZER_PARAMS.
+    :return: function that takes a document and returns its list of terms.
+    """
+    if params["analyzer"] != "word":
+        raise ValueError("Only word analyzers are supported, not {!r}".format(params["analyzer"]))
+    strip_accents = {None: None, "unicode": strip_accents_unicode,
+                     "ascii": strip_accents_ascii}[params["strip_accents"]]
+    token_pattern = re.compile(params["token_pattern"])
+    if token_pattern.groups > 1:
+        raise ValueError("The token pattern should have at most one capturing group")
+    stop_words = params["stop_words"]
+    if stop_words == "english":
+        # Artifacts store the stop words themselves, see save_artifact
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+        stop_words = ENGLISH_STOP_WORDS
+    stop_words = None if stop_words is None else frozenset(stop_words)
+    min_n, max_n = params["ngram_range"]
+
+    def analyze(doc):
+        if params["lowercase"]:
+            doc = doc.lower()
+        if strip_accents is not None:
+            doc = strip_accents(doc)
+        tokens = token_pattern.findall(doc)
+        if stop_words is not None:
+            tokens = [token for token in tokens if token not in stop_words]
+        if max_n == 1:
+            return tokens
+        terms = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            terms.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+    return analyze
+
+
+def normalize_rows(x, norm):
+    """
+    Scale each row of a sparse matrix to unit norm in place, leaving empty
+    rows as they are, as SK-Learn's normalize.
+    :param x: scipy sparse CSR matrix of float.
+    :param norm: str, "l1" or "l2".
+    :return: scipy sparse CSR matrix, x.
+    """
+    lengths = np.diff(x.indptr)
+    rows = np.repeat(np.arange(x.shape[0]), lengths)
+    # Squares in the matrix's dtype, summed and divided in float64, as
+    # SK-Learn does, so the features are identical
+    weights = np.abs(x.data) if norm == "l1" else x.data * x.data
+    norms = np.bincount(rows, weights, x.shape[0])
+    if norm == "l2":
+        np.sqrt(norms, norms)
+    norms[norms == 0] = 1
+    np.divide(x.data, norms[rows], out=x.data, casting="unsafe")
+    return x
+
+
+class ArtifactModel:
+    """
+    The preprocessing and scoring kernel of a model artifact, which make
+    predictions like a JHPModel.
+    """
+    def __init__(self, processing, model):
+        """
+        Instantiate the model.
+        :param processing: NLPProcessing with a fitted vectorizer.
+        :param model: a fitted scoring kernel, see inference_kernels.
+        """
+        self.processing = processing
+        self.model = model
+        self.classes = len(model.classes_)
+
+    def predict(self, testing):
+        """
+        Make a prediction about testing data.
+        :param testing: str, list, ndarray or Pandas DataFrame, the documents
+                        to predict
+        :return: ndarray, the predicted labels
+        """
+        return self.model.predict(self.processing.transform(testing))
+
+    def predict_proba(self, testing):
+        """
+        Get the probability of each city for the testing data.
+        :param testing: str, list, ndarray or Pandas DataFrame, the documents
+                        to predict
+        :return: ndarray, the probability of each class for each document
+        """
+        return self.model.predict_proba(self.processing.transform(testing))
+
+
+class VocabularyVectorizer:
+    """
+    Vectorizes documents like a fitted CountVectorizer or TfidfVectorizer,
+    using a sorted array of terms instead of a vocabulary dict. Terms are
+    looked up with a binary search, so the arrays can be memory mapped.
+    """
+    def __init__(self, terms, columns, params, idf=None, norm=None,
+                 sublinear_tf=False, dtype="float64"):
+        """
+        Instantiate the vectorizer.
+        :param terms: ndarray of bytes, the sorted UTF-8 encoded terms.
+        :param columns: ndarray of int, the feature column of each term.
+        :param params: dict, the CountVectorizer settings in ANALYZER_PARAMS.
+        :param idf: ndarray of float, the IDF weight of each column, or None
+                    for term counts.
+        :param norm: str, "l1", "l2" or None, the row normalization.
+        :param sublinear_tf: bool, replace term counts with 1 + log(count).
+        :param dtype: str, the dtype of the feature matrix.
+        """
+        self.terms = terms
+        self.columns = columns
+        self.params = params
+        self.idf = idf
+        self.norm = norm
+        self.sublinear_tf = sublinear_tf
+        self.dtype = np.dtype(dtype)
+        self.analyze = word_analyzer(params)
+
+    def transform(self, docs):
+        """
+        Vectorize documents.
+        :param docs: list or ndarray of str, the documents.
+        :return: scipy sparse matrix
+        """
+        tokens, lengths = [], []
+        for doc in docs:
+            doc_tokens = self.analyze(doc)
+            tokens.extend(token.encode("utf-8") for token in doc_tokens)
+            lengths.append(len(doc_tokens))
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        found = np.zeros(len(tokens), dtype=bool)
+        position = found.astype(np.intp)
+        if len(tokens) and len(self.terms):
+            # Longer tokens would be truncated to the width of the terms
+            fits = np.fromiter(map(len, tokens), np.intp, len(tokens)) <= self.terms.itemsize
+            keys = np.array(tokens, dtype=self.terms.dtype)
+            position = np.minimum(np.searchsorted(self.terms, keys), len(self.terms) - 1)
+            found = fits & (self.terms[position] == keys)
+        counts = sp.csr_matrix((np.ones(found.sum(), dtype=self.dtype),
+                                (rows[found], self.columns[position[found]])),
+                               shape=(len(lengths), len(self.terms)))
+        counts.sum_duplicates()
+        if self.params.get("binary"):
+            counts.data[:] = 1
+        if self.sublinear_tf:
+            np.log(counts.data, counts.data)
+            counts.data += 1
+        if self.idf is not None:
+            counts.data *= self.idf[counts.indices]
+        return counts if self.norm is None else normalize_rows(counts, self.norm)
+
+    def get_feature_names_out(self):
+        """
+        Get the term of each feature column.
+        :return: ndarray of str
+        """
+        names = np.empty(len(self.terms), dtype=object)
+        names[self.columns] = [term.decode("utf-8") for term in self.terms.tolist()]
+        return names
+
+
+def save_artifact(jhp_model, path, kernel=False, keep=2):
+    """
+    Save a fitted JHPModel as a model artifact directory.
+    Each save writes a new version directory next to the path, in
+    <path>.versions, and then atomically points the path, a symbolic link,
+    at it. A reader that opens the path always finds a complete artifact.
+    :param jhp_model: JHPModel with a fitted CountVectorizer or
+                      TfidfVectorizer.
+    :param path: str, the artifact path.
+    :param kernel: bool, save the model compiled into a scoring kernel, see
+                   inference_kernels, which gives the same probabilities
+                   without SK-Learn or XGBoost. Tree ensembles are then
+                   saved as arrays rather than pickled.
+    :param keep: int, the number of versions to keep, including the new
+                 one. Older versions are deleted; the previous one is kept
+                 by default for readers that are still loading it.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+    processing = jhp_model.processing
+    vectorizer = processing.vectorize
+    if not isinstance(vectorizer, CountVectorizer):
+        raise ValueError("Only models with a fitted CountVectorizer or "
+                         "TfidfVectorizer can be saved as an artifact")
+    path = path.rstrip(os.sep)
+    versions = path + VERSIONS_SUFFIX
+    version = "{}-{}".format(datetime.utcnow().strftime("%Y%m%dT%H%M%S%f"), os.getpid())
+    tmp = os.path.join(versions, version + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    terms = sorted(vectorizer.vocabulary_)
+    arrays = {"terms": np.array([term.encode("utf-8") for term in terms], dtype=bytes),
+              "columns": np.array([vectorizer.vocabulary_[term] for term in terms],
+                                  dtype=np.int64)}
+    params = dict(vectorizer.get_params(), stop_words=vectorizer.get_stop_words())
+    if params["stop_words"] is not None:
+        params["stop_words"] = sorted(params["stop_words"])
+    vectorizer_manifest = {"class": type(vectorizer).__name__,
+                           "params": _to_json({name: params[name] for name in ANALYZER_PARAMS}),
+                           "dtype": np.dtype(params["dtype"]).name,
+                           "norm": params.get("norm"),
+                           "sublinear_tf": params.get("sublinear_tf", False)}
+    if isinstance(vectorizer, TfidfVectorizer) and vectorizer.use_idf:
+        arrays["idf"] = vectorizer.idf_
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, name + ".npy"), array)
+
+    manifest = {"format_version": FORMAT_VERSION,
+                "created": datetime.utcnow().isoformat(),
+                "preprocessing": _to_json({name: getattr(processing, name)
+                                           for name in PROCESSING_PARAMS}),
+                "stop_words": sorted(processing.get_stopwords())
+                              if processing.use_stopwords else [],
+                "vectorizer": vectorizer_manifest,
+                "model": _save_model(compile_model(jhp_model.model) if kernel
+                                     else jhp_model.model, tmp)}
+    with open(os.path.join(tmp, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(tmp, os.path.join(versions, version))
+    _publish(path, version)
+    _remove_old_versions(versions, max(keep, 1))
+
+
+def _publish(path, version):
+    """
+    Point an artifact path at a saved version, atomically.
+    :param path: str, the artifact path.
+    :param version: str, the name of the version directory.
+    """
+    versions = path + VERSIONS_SUFFIX
+    if os.path.isdir(path) and not os.path.islink(path):
+        # An artifact saved before versions were kept is moved into the
+        # versions directory. The path is briefly missing, this once.
+        os.replace(path, os.path.join(versions, UNVERSIONED))
+    link = "{}.{}.link".format(path, os.getpid())
+    if os.path.lexists(link):
+        os.remove(link)
+    # A relative link keeps working if the parent directory is moved
+    os.symlink(os.path.join(os.path.basename(versions), version), link)
+    os.replace(link, path)
+
+
+def _remove_old_versions(versions, keep):
+    """
+    Delete all but the newest versions of an artifact. Unfinished versions
+    are left to the process writing them.
+    :param versions: str, the versions directory of the artifact.
+    :param keep: int, the number of versions to keep.
+    """
+    # Version names start with their creation time, so sort in age order
+    names = sorted(name for name in os.listdir(versions) if not name.endswith(".tmp"))
+    for name in names[:-keep]:
+        shutil.rmtree(os.path.join(versions, name), ignore_errors=True)
+
+
+def load_artifact(path, mmap=True):
+    """
+    Load a model artifact saved with save_artifact.
+    :param path: str, the artifact directory.
+    :param mmap: bool, memory map the arrays rather than reading them.
+    :return: ArtifactModel if the model is a scoring kernel, and JHPModel
+             otherwise, ready to make predictions.
+    """
+    # Every file is read from the same version, even if the artifact is
+    # saved again while it loads
+    path = os.path.realpath(path)
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest["format_version"] > FORMAT_VERSION:
+        raise ValueError("Model artifact format {} is newer than the supported "
+                         "format {}".format(manifest["format_version"], FORMAT_VERSION))
+    mmap_mode = "r" if mmap else None
+
+    def load_array(name):
+        return np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+
+    config = manifest["preprocessing"]
+    # Artifacts saved before the stop words were stored use get_stopwords
+    processing = NLPProcessing(config["stemlem"], config["min_df"], config["max_df"],
+                               config["num_cities"], tuple(config["n_grams"]),
+                               config["use_stopwords"], config["tokenize"],
+                               stop_words=manifest.get("stop_words"))
+    vectorizer = manifest["vectorizer"]
+    params = dict(vectorizer["params"], ngram_range=tuple(vectorizer["params"]["ngram_range"]))
+    has_idf = os.path.exists(os.path.join(path, "idf.npy"))
+    processing.vectorize = VocabularyVectorizer(
+        load_array("terms"), load_array("columns"), params,
+        load_array("idf") if has_idf else None, vectorizer["norm"],
+        vectorizer["sublinear_tf"], vectorizer["dtype"])
+    model = _load_model(manifest["model"], path, load_array)
+    if manifest["model"].get("module") == compile_model.__module__:
+        return ArtifactModel(processing, model)
+    # Other models need SK-Learn or XGBoost anyway
+    from .build_model import JHPModel
+    jhp_model = JHPModel(model, num_cities=config["num_cities"])
+    jhp_model.processing = processing
+    return jhp_model
+
+
+def load_model(path):
+    """
+    Load a model from an artifact directory or a pkl file.
+    :param path: str, the artifact directory or pkl file.
+    :return: a fitted model object with processing and model attributes.
+    """
+    if os.path.isdir(path):
+        return load_artifact(path)
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _save_model(model, path):
+    """
+    Save a fitted SK-Learn model. Numeric array attributes are saved as
+    arrays and the other attributes in the manifest. Models with
+    attributes that cannot be saved this way, eg the trees of a forest, are
+    pickled instead.
+    :param model: a fitted SK-Learn model object or scoring kernel.
+    :param path: str, the artifact directory.
+    :return: dict, the model's manifest entry.
+    """
+    arrays, attributes = {}, {}
+    for name, value in vars(model).items():
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            arrays[name] = value
+        else:
+            attributes[name] = value
+    try:
+        attributes = json.loads(json.dumps(_to_json(attributes)))
+    except TypeError:
+        with open(os.path.join(path, "model.pkl"), "wb") as f:
+            pickle.dump(model, f)
+        return {"format": "pickle", "file": "model.pkl"}
+    for name, array in arrays.items():
+        np.save(os.path.join(path, "model." + name + ".npy"), array)
+    return {"format": "arrays",
+            "module": type(model).__module__,
+            "class": type(model).__name__,
+            "attributes": attributes,
+            "arrays": sorted(arrays)}
+
+
+def _load_model(entry, path, load_array):
+    """
+    Rebuild a model saved with _save_model.
+    :param entry: dict, the model's manifest entry.
+    :param path: str, the artifact directory.
+    :param load_array: function that loads an array of the artifact by name.
+    :return: a fitted SK-Learn model object.
+    """
+    if entry["format"] == "pickle":
+        with open(os.path.join(path, entry["file"]), "rb") as f:
+            return pickle.load(f)
+    cls = getattr(importlib.import_module(entry["module"]), entry["class"])
+    # Restore the attributes the way unpickling does, without calling __init__
+    model = cls.__new__(cls)
+    model.__dict__.update(entry["attributes"])
+    for name in entry["arrays"]:
+        setattr(model, name, load_array("model." + name))
+    return model
+
+
+def _to_json(value):
+    """
+    Convert tuples and NumPy scalars to their JSON equivalents.
+    :param value: the value to convert, which can be a dict or list.
+    :return: the converted value.
+    """
+    if isinstance(value, dict):
+        return {key: _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+if __name__ == "__main__":
+    """
+    Code that runs if called from the command line
+    Call: python -m src.model_artifact <model.pkl> <artifact directory> [--kernel]
+    Converts a pickled JHPModel to a model artifact, with the model compiled
+    into a scoring kernel if --kernel is given.
+    """
+    with open(argv[1], "rb") as f:
+        saved_model = pickle.load(f)
+    save_artifact(saved_model, argv[2], kernel="--kernel" in argv[3:])
+    print("Saved {} to {}".format(argv[1], argv[2]))
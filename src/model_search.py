@@ -0,0 +1,288 @@
+"""
+Hyperparameter search over the preprocessing, vectorizer and classifier
+settings of JHPModel, with cross-validation.
+Trials that share upstream settings share their intermediate outputs: the
+corpus is cleaned and stemmed/lemmatized once per (stemlem, use_stopwords),
+and each fold is vectorized once per vocabulary setting, however many
+classifiers are evaluated on it.
+"""
+
+from .build_model import JHPModel, score_model
+from .corpus_cache import PreprocessedCorpus
+from .utils import import_data
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import AdaBoostClassifier
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.model_selection import KFold, ParameterGrid, ParameterSampler
+from xgboost import XGBClassifier
+from time import perf_counter
+import argparse
+import json
+import os
+import pickle
+import sys
+import numpy as np
+import pandas as pd
+
+MODELS = {"naive_bayes": MultinomialNB,
+          "random_forest": RandomForestClassifier,
+          "adaboost": AdaBoostClassifier,
+          "gradient_boosting": GradientBoostingClassifier,
+          "xgboost": XGBClassifier}
+
+# Settings used for any parameter that is not searched over
+DEFAULTS = {"stemlem": "", "min_df": 1, "max_df": 1.0, "n_grams": (1, 1),
+            "use_stopwords": True, "tokenize": "tfidf", "model": "naive_bayes",
+            "n_features": None, "selection": "chi2", "dtype": None}
+
+# The preprocessed corpora used by a search worker process
+_search_corpora = None
+
+
+def _reset_peak_memory():
+    """
+    Reset the peak resident memory of this process to its current resident
+    memory, where the operating system allows it (Linux).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_memory_mb():
+    """
+    Get the peak resident memory of this process since it was last reset.
+    Where it cannot be reset, this is the peak since the process started.
+    :return: float, MB, or None if it cannot be measured.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB and macOS bytes
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _init_search_worker(corpora):
+    """
+    Set up a search worker process.
+    :param corpora: dict of PreprocessedCorpus, keyed by preprocessing settings.
+    """
+    global _search_corpora
+    _search_corpora = corpora
+
+
+def _run_fold(corpus_key, processing, train_rows, test_rows, trials):
+    """
+    Vectorize one fold once, and fit and score every trial that uses the
+    same vectorizer settings on it.
+    :param corpus_key: tuple, the preprocessing settings of the corpus.
+    :param processing: NLPProcessing, the vectorizer settings.
+    :param train_rows: ndarray of int, the corpus rows to train on.
+    :param test_rows: ndarray of int, the corpus rows to test on.
+    :param trials: list of (int, model) tuples, the trial numbers and their
+                   unfitted models.
+    :return: list of dicts, one per trial. The peak memory of a trial is
+             the peak resident memory of the worker process while the fold
+             was vectorized or while the trial was fitted and scored.
+    """
+    _reset_peak_memory()
+    start = perf_counter()
+    features = _search_corpora[corpus_key].fold_features(processing, train_rows,
+                                                         test_rows)
+    featurize_time = perf_counter() - start
+    featurize_peak = _peak_memory_mb()
+    X_train = features[0]
+    feature_bytes = X_train.data.nbytes + X_train.indices.nbytes + X_train.indptr.nbytes
+    results = []
+    for trial, model in trials:
+        model = clone(model)
+        _reset_peak_memory()
+        start = perf_counter()
+        score, confusion = score_model(model, features, processing.num_cities)
+        fit_time = perf_counter() - start
+        peak = _peak_memory_mb()
+        results.append({"trial": trial, "score": score, "confusion": confusion,
+                        "fit_time": fit_time,
+                        "peak_mb": None if peak is None else max(peak, featurize_peak),
+                        "featurize_time": featurize_time,
+                        "feature_bytes": feature_bytes,
+                        "model_bytes": len(pickle.dumps(model))})
+    return results
+
+
+class ModelSearch:
+    """
+    Grid or random search over JHPModel settings, scored with K-fold
+    cross-validation.
+    """
+    def __init__(self, param_grid, n_iter=None, n_splits=5, num_cities=2,
+                 n_jobs=1, random_state=None):
+        """
+        Instantiate the search.
+        :param param_grid: dict or list of dicts, mapping any of stemlem,
+                           min_df, max_df, n_grams, use_stopwords, tokenize,
+                           n_features, selection, dtype and model to lists
+                           of values to try. Models can be
+                           names in MODELS or instantiated SK-Learn models.
+                           For random search, values can also be scipy.stats
+                           distributions.
+        :param n_iter: int, the number of random trials. If None, every
+                       combination in the grid is tried.
+        :param n_splits: int, the number of cross-validation folds.
+        :param num_cities: int, the number of classes to use.
+        :param n_jobs: int, the number of processes to run folds in.
+                       -1 uses every CPU.
+        :param random_state: int, seed for the folds and random trials.
+        """
+        self.param_grid = param_grid
+        self.n_iter = n_iter
+        self.n_splits = n_splits
+        self.num_cities = num_cities
+        self.n_jobs = (os.cpu_count() or 1) if n_jobs == -1 else max(1, n_jobs)
+        self.random_state = random_state
+        self.results = None
+
+    def trials(self):
+        """
+        List the settings of every trial.
+        :return: list of dicts, the complete settings of each trial.
+        """
+        if self.n_iter is None:
+            params = ParameterGrid(self.param_grid)
+        else:
+            params = ParameterSampler(self.param_grid, self.n_iter,
+                                      random_state=self.random_state)
+        trials = []
+        for trial_params in params:
+            settings = dict(DEFAULTS, **trial_params)
+            settings["n_grams"] = tuple(settings["n_grams"])
+            trials.append(settings)
+        return trials
+
+    def fit(self, data=None, bucket=None, filename=None):
+        """
+        Run every trial.
+        :param data: Pandas DataFrame containing data.
+        :param bucket: str S3 bucket of data if applicable.
+        :param filename: str, name of the data file, if applicable.
+        :return: Pandas DataFrame, the results of each trial, best first.
+        """
+        df = import_data(bucket, filename) if data is None else data
+        trials = self.trials()
+        kf = KFold(self.n_splits, shuffle=True, random_state=self.random_state)
+        splits = list(kf.split(df))
+
+        # Group the trials by preprocessing, and then by vectorizer settings
+        corpora, groups = {}, {}
+        for trial, settings in enumerate(trials):
+            model = settings["model"]
+            jhp = JHPModel(MODELS[model]() if isinstance(model, str) else model,
+                           settings["stemlem"], settings["min_df"],
+                           settings["max_df"], self.num_cities,
+                           settings["n_grams"], settings["use_stopwords"],
+                           tokenize=settings["tokenize"],
+                           n_features=settings["n_features"],
+                           selection=settings["selection"], dtype=settings["dtype"])
+            corpus_key = (str(settings["stemlem"]), settings["use_stopwords"])
+            if corpus_key not in corpora:
+                corpora[corpus_key] = PreprocessedCorpus(df, jhp.processing,
+                                                         self.num_cities)
+            vocab_key = corpus_key + (settings["min_df"], settings["max_df"],
+                                      settings["n_grams"], settings["tokenize"],
+                                      settings["n_features"], settings["selection"],
+                                      settings["dtype"])
+            if vocab_key not in groups:
+                groups[vocab_key] = (corpus_key, jhp.processing, [])
+            groups[vocab_key][2].append((trial, jhp.model))
+
+        corpus = next(iter(corpora.values()))
+        folds = [(corpus.rows(train_index), corpus.rows(test_index))
+                 for train_index, test_index in splits]
+        tasks = [(corpus_key, processing, train_rows, test_rows, group_trials)
+                 for corpus_key, processing, group_trials in groups.values()
+                 for train_rows, test_rows in folds]
+        if self.n_jobs == 1:
+            _init_search_worker(corpora)
+            fold_results = [_run_fold(*task) for task in tasks]
+            _init_search_worker(None)
+        else:
+            with ProcessPoolExecutor(min(self.n_jobs, len(tasks)),
+                                     initializer=_init_search_worker,
+                                     initargs=(corpora,)) as pool:
+                fold_results = list(pool.map(_run_fold, *zip(*tasks)))
+        self.results = self._summarize(trials, [result for results in fold_results
+                                                for result in results])
+        return self.results
+
+    def _summarize(self, trials, fold_results):
+        """
+        Combine the fold results of each trial into a results table.
+        :param trials: list of dicts, the settings of each trial.
+        :param fold_results: list of dicts, the result of each trial and fold.
+        :return: Pandas DataFrame, the results of each trial, best first.
+        """
+        folds = pd.DataFrame(fold_results)
+        rows = []
+        for trial, trial_folds in folds.groupby("trial"):
+            settings = dict(trials[trial])
+            if not isinstance(settings["model"], str):
+                settings["model"] = type(settings["model"]).__name__
+            settings["stemlem"] = str(settings["stemlem"])
+            confusion = sum(trial_folds["confusion"])
+            _, _, F1 = JHPModel._get_scores(confusion, verbose=False)
+            row = dict(settings, accuracy=trial_folds["score"].mean())
+            for i, f1 in enumerate(F1):
+                row["f1_{}".format(i)] = f1
+            row["fit_time"] = trial_folds["fit_time"].mean()
+            row["featurize_time"] = trial_folds["featurize_time"].mean()
+            # The largest peak of any fold, as it bounds the memory needed
+            row["peak_mb"] = trial_folds["peak_mb"].max()
+            row["feature_mb"] = trial_folds["feature_bytes"].mean() / 1024 ** 2
+            row["model_mb"] = trial_folds["model_bytes"].mean() / 1024 ** 2
+            rows.append(row)
+        return (pd.DataFrame(rows).sort_values("accuracy", ascending=False)
+                .reset_index(drop=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Search JHPModel settings with cross-validation.")
+    parser.add_argument("bucket", help='S3 bucket of the data, or "local"')
+    parser.add_argument("filename", help="name of the data file")
+    parser.add_argument("grid", help="JSON file mapping parameters to lists of values")
+    parser.add_argument("--n-iter", type=int, default=None,
+                        help="number of random trials (default: full grid)")
+    parser.add_argument("--n-splits", type=int, default=5)
+    parser.add_argument("--num-cities", type=int, default=2)
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--random-state", type=int, default=None)
+    parser.add_argument("--output", default="search_results.csv",
+                        help="csv file to write the results table to")
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        grid = json.load(f)
+    if args.bucket == "local":
+        df = pd.read_csv(args.filename)
+    else:
+        df = import_data(args.bucket, args.filename)
+    search = ModelSearch(grid, n_iter=args.n_iter, n_splits=args.n_splits,
+                         num_cities=args.num_cities, n_jobs=args.n_jobs,
+                         random_state=args.random_state)
+    results = search.fit(df)
+    results.to_csv(args.output, index=False)
+    print(results.to_string())
@@ -0,0 +1,273 @@
+"""
+Near-duplicate detection of job descriptions with MinHash and locality
+sensitive hashing (LSH).
+Each description is reduced to a MinHash signature of its word shingles, so
+the share of equal signature values estimates the Jaccard similarity of two
+descriptions. Signatures are split into bands, and only descriptions with
+an identical band are compared, so the work grows linearly with the number
+of descriptions. Candidate pairs are kept if their estimated similarity is
+above the threshold, and near duplicates are clustered transitively.
+"""
+
+from .utils import import_data
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import argparse
+import os
+import re
+import zlib
+import numpy as np
+import pandas as pd
+
+TOKEN = re.compile(r"\w+")
+# Hashes of the shingles and signature values are 32 bit. Shingle hashes are
+# permuted with multiply-shift hashing, (a * x + b) >> 32 with 64 bit
+# wrapping arithmetic, which avoids a slow modulo
+MAX_HASH = np.uint64((1 << 32) - 1)
+SHIFT = np.uint64(32)
+# The number of shingles hashed at a time, which bounds the memory used by
+# a batch to num_perm * SHINGLE_BATCH * 8 bytes
+SHINGLE_BATCH = 1 << 16
+
+
+class TokenHashes(dict):
+    """
+    Maps tokens to a 32 bit hash that is the same in every process,
+    computing the hash the first time a token is seen.
+    """
+    def __missing__(self, token):
+        value = self[token] = zlib.crc32(token.encode("utf-8"))
+        return value
+
+
+def shingle_hashes(tokens, shingle_size, token_hashes):
+    """
+    Hash the word shingles of a document: every run of shingle_size
+    consecutive tokens. Documents shorter than a shingle have one shingle.
+    :param tokens: list of str, the document's tokens.
+    :param shingle_size: int, the number of words in a shingle.
+    :param token_hashes: TokenHashes, the hash of each token.
+    :return: ndarray of uint64, the 32 bit hash of each shingle.
+    """
+    hashes = np.fromiter(map(token_hashes.__getitem__, tokens), np.uint64, len(tokens))
+    n_shingles = max(1, len(tokens) - shingle_size + 1)
+    combined = np.zeros(n_shingles, dtype=np.uint64)
+    # Polynomial hash of each window of tokens, wrapping at 64 bits
+    for offset in range(min(shingle_size, len(tokens))):
+        combined *= np.uint64(1000003)
+        combined += hashes[offset:offset + n_shingles]
+    return (combined ^ (combined >> SHIFT)) & MAX_HASH
+
+
+def minhash_signatures(texts, shingle_size=5, num_perm=64, seed=0, n_jobs=1):
+    """
+    Compute the MinHash signature of each document.
+    :param texts: iterable of str, the documents.
+    :param shingle_size: int, the number of words in a shingle.
+    :param num_perm: int, the number of hash permutations, ie the length of
+                     each signature.
+    :param seed: int, the seed of the permutations.
+    :param n_jobs: int, the number of processes to use. -1 uses every CPU.
+    :return: tuple of (ndarray of uint32 of shape (n_docs, num_perm),
+             ndarray of bool), the signatures, and whether each document
+             has any words. Documents without words have no signature.
+    """
+    n_jobs = (os.cpu_count() or 1) if n_jobs == -1 else max(1, n_jobs)
+    if n_jobs > 1:
+        texts = list(texts)
+        size = max(1000, -(-len(texts) // (n_jobs * 4)))
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        with ProcessPoolExecutor(min(n_jobs, len(chunks) or 1)) as pool:
+            results = list(pool.map(minhash_signatures, chunks, repeat(shingle_size),
+                                    repeat(num_perm), repeat(seed)))
+        if not results:
+            return np.empty((0, num_perm), dtype=np.uint32), np.empty(0, dtype=bool)
+        return (np.vstack([signatures for signatures, _ in results]),
+                np.concatenate([has_words for _, has_words in results]))
+    rng = np.random.RandomState(seed)
+    a = (rng.randint(0, 1 << 63, num_perm, dtype=np.uint64) << np.uint64(1) | np.uint64(1))[:, None]
+    b = rng.randint(0, 1 << 63, num_perm, dtype=np.uint64)[:, None]
+    token_hashes = TokenHashes()
+    signatures = []
+    has_words = []
+    batch, batch_size = [], 0
+
+    def flush():
+        hashes = np.concatenate(batch)
+        starts = np.cumsum([0] + [len(shingles) for shingles in batch[:-1]])
+        values = np.multiply(a, hashes)
+        values += b
+        values >>= SHIFT
+        signatures.append(np.minimum.reduceat(values, starts, axis=1).T.astype(np.uint32))
+
+    for text in texts:
+        tokens = TOKEN.findall(text.lower()) if isinstance(text, str) else []
+        has_words.append(len(tokens) > 0)
+        if not tokens:
+            tokens = [""]
+        shingles = shingle_hashes(tokens, shingle_size, token_hashes)
+        batch.append(shingles)
+        batch_size += len(shingles)
+        if batch_size >= SHINGLE_BATCH:
+            flush()
+            batch, batch_size = [], 0
+    if batch:
+        flush()
+    if not signatures:
+        return np.empty((0, num_perm), dtype=np.uint32), np.empty(0, dtype=bool)
+    return np.vstack(signatures), np.array(has_words)
+
+
+def lsh_params(num_perm, threshold, recall=0.95):
+    """
+    Choose the number of bands and rows per band of the LSH index: the
+    fewest bands, ie the fewest candidate pairs to verify, for which a pair
+    of documents at the threshold similarity shares a band with at least
+    the given probability.
+    :param num_perm: int, the length of each signature.
+    :param threshold: float, the Jaccard similarity threshold.
+    :param recall: float, the probability of finding a pair at the threshold.
+    :return: tuple of (int, int), the number of bands and rows per band.
+    """
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        if num_perm % bands == 0 and 1 - (1 - threshold ** rows) ** bands >= recall:
+            return bands, rows
+    return num_perm, 1
+
+
+def cluster_signatures(signatures, threshold=0.8, has_words=None):
+    """
+    Cluster documents whose estimated Jaccard similarity is at least the
+    threshold.
+    :param signatures: ndarray of uint32, the MinHash signature of each
+                       document.
+    :param threshold: float, the Jaccard similarity threshold.
+    :param has_words: ndarray of bool, the documents that have words, if
+                      applicable. Documents without words are not clustered.
+    :return: ndarray of int, the position of the first document of each
+             document's cluster. Documents that are not near duplicates of
+             an earlier document are their own cluster.
+    """
+    n_docs, num_perm = signatures.shape
+    if has_words is None:
+        has_words = np.ones(n_docs, dtype=bool)
+    bands, rows = lsh_params(num_perm, threshold)
+    candidates = np.flatnonzero(has_words)
+    multipliers = np.random.RandomState(0).randint(1, 1 << 62, rows, dtype=np.uint64) | 1
+    members, leaders = [], []
+    for band in range(bands):
+        band_values = signatures[candidates, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = (band_values * multipliers).sum(axis=1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        new_bucket = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        # Every document is compared with the first document of its bucket
+        leader = candidates[order[np.flatnonzero(new_bucket)[np.cumsum(new_bucket) - 1]]]
+        member = candidates[order]
+        paired = member != leader
+        members.append(member[paired])
+        leaders.append(leader[paired])
+    if members:
+        pairs = np.unique(np.concatenate(members) * n_docs + np.concatenate(leaders))
+    else:
+        pairs = np.empty(0, dtype=np.int64)
+    member, leader = pairs // n_docs, pairs % n_docs
+    similar = np.empty(len(pairs), dtype=bool)
+    for start in range(0, len(pairs), SHINGLE_BATCH):
+        end = start + SHINGLE_BATCH
+        similar[start:end] = ((signatures[member[start:end]] == signatures[leader[start:end]])
+                              .mean(axis=1) >= threshold)
+    graph = sparse.coo_matrix((np.ones(similar.sum(), dtype=np.int8),
+                               (member[similar], leader[similar])), shape=(n_docs, n_docs))
+    _, components = connected_components(graph, directed=False)
+    first = np.full(n_docs, n_docs)
+    np.minimum.at(first, components, np.arange(n_docs))
+    return first[components]
+
+
+def find_near_duplicates(texts, threshold=0.8, shingle_size=5, num_perm=64, seed=0,
+                         n_jobs=1):
+    """
+    Cluster near duplicate documents.
+    :param texts: iterable of str, the documents.
+    :param threshold: float, the Jaccard similarity threshold of the word
+                      shingles of two documents.
+    :param shingle_size: int, the number of words in a shingle.
+    :param num_perm: int, the length of each MinHash signature. Longer
+                     signatures estimate similarity more accurately.
+    :param seed: int, the seed of the MinHash permutations.
+    :param n_jobs: int, the number of processes used to compute signatures.
+    :return: tuple of (ndarray of int, ndarray of uint32), the position of
+             the first document of each document's cluster, as
+             cluster_signatures, and the signatures.
+    """
+    signatures, has_words = minhash_signatures(texts, shingle_size, num_perm, seed, n_jobs)
+    return cluster_signatures(signatures, threshold, has_words), signatures
+
+
+def cluster_report(df, clusters, signatures):
+    """
+    Describe the clusters of near duplicate descriptions.
+    :param df: Pandas DataFrame of scraped data, with one row per document.
+    :param clusters: ndarray of int, as find_near_duplicates.
+    :param signatures: ndarray of uint32, as find_near_duplicates.
+    :return: Pandas DataFrame with a row per cluster of more than one
+             document: the index of the first document, which is kept, the
+             number of documents, the indexes of the duplicates, the cities
+             and search terms of the cluster, and the lowest estimated
+             similarity of a duplicate to the first document.
+    """
+    sizes = np.bincount(clusters, minlength=len(clusters))
+    duplicates = np.flatnonzero((clusters != np.arange(len(clusters))))
+    if len(duplicates) == 0:
+        return pd.DataFrame(columns=["kept", "size", "duplicates", "cities",
+                                     "search_terms", "min_similarity"])
+    similarity = (signatures[duplicates] == signatures[clusters[duplicates]]).mean(axis=1)
+    members = pd.DataFrame({"cluster": clusters[duplicates], "row": duplicates,
+                            "similarity": similarity})
+    index = df.index.values
+    rows = []
+    for cluster, group in members.groupby("cluster", sort=True):
+        positions = np.r_[cluster, group["row"].values]
+        row = {"kept": index[cluster], "size": sizes[cluster],
+               "duplicates": index[group["row"].values].tolist(),
+               "min_similarity": group["similarity"].min()}
+        for column, name in [("city_term", "cities"), ("search_term", "search_terms")]:
+            if column in df:
+                row[name] = sorted(set(df[column].values[positions].astype(str).tolist()))
+        rows.append(row)
+    report = pd.DataFrame(rows).reindex(columns=["kept", "size", "duplicates", "cities",
+                                                 "search_terms", "min_similarity"])
+    return report.sort_values("size", ascending=False, kind="stable").reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find clusters of near duplicate job descriptions.")
+    parser.add_argument("bucket", help='S3 bucket of the data, or "local"')
+    parser.add_argument("filename", help="name of the data file")
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="Jaccard similarity of near duplicates")
+    parser.add_argument("--shingle-size", type=int, default=5)
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--output", default="near_duplicates.csv",
+                        help="csv file to write the cluster report to")
+    args = parser.parse_args()
+
+    if args.bucket == "local":
+        df = pd.read_csv(args.filename)
+    else:
+        df = import_data(args.bucket, args.filename)
+    df = df[df["job_description"].notnull()]
+    clusters, signatures = find_near_duplicates(df["job_description"].values, args.threshold,
+                                                args.shingle_size, args.num_perm,
+                                                n_jobs=args.n_jobs)
+    report = cluster_report(df, clusters, signatures)
+    report.to_csv(args.output, index=False)
+    print("{} descriptions, {} clusters of near duplicates, {} duplicates".format(
+        len(df), len(report), int((report["size"] - 1).sum())))
+    print(report.head(20).to_string())
@@ -5,12 +5,126 @@ Class that makes up the natural language processing pipeline.
 import pandas as pd
 import numpy as np
 import re
+import copy
+import gc
+import hashlib
+import numbers
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain, repeat
+from operator import is_not
 from .utils import get_stopwords, import_data
-from nltk.stem.porter import PorterStemmer
-from nltk.stem.snowball import SnowballStemmer
-from nltk.stem.wordnet import WordNetLemmatizer
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.feature_extraction.text import TfidfVectorizer
+from .token_cache import get_token_cache
+from .feature_store import document_keys
+from .token_corpus import NGramVocabulary, TokenCorpus
+from .feature_selection import (HashedFeatures, feature_scores, prune_vectorizer,
+                                top_features)
+from scipy import sparse
+from weakref import WeakKeyDictionary
+
+# Capital letters that start a joined word, eg the P in "skillsPython".
+# Matches a capital (not at the start) after a lower case letter or before
+# one. Starting the pattern with the capital lets the regex engine skip
+# quickly to candidate characters.
+CAMEL_CASE = re.compile(r"[A-Z](?:(?<=[a-z][A-Z])|(?<=.[A-Z])(?=[a-z]))",
+                        flags=re.DOTALL)
+SPECIAL_CHARACTERS = re.compile(r"[^\w\s]|â", flags=re.UNICODE)
+
+# Parallel preprocessing sends each worker about CHUNKS_PER_JOB chunks, so
+# that uneven chunks balance out, but never fewer than MIN_CHUNK_SIZE
+# documents per chunk, so that process overhead stays small next to the work.
+CHUNKS_PER_JOB = 4
+MIN_CHUNK_SIZE = 250
+# The token corpus is built as the documents are cleaned, this many at a
+# time, rather than cleaning them all first
+PREPROCESS_CHUNK = 5000
+
+
+def _split_camel_case(match):
+    """
+    Insert a space before a capital letter matched by CAMEL_CASE.
+    :param match: re.Match
+    :return: str
+    """
+    return " " + match.group()
+
+
+# The NLPProcessing object used by a preprocessing worker process
+_worker_processing = None
+
+# The NGramVocabulary of each fitted vectorizer, with the vocabulary it was
+# built from, so it is rebuilt if the vocabulary is pruned
+_ngram_vocabularies = WeakKeyDictionary()
+
+
+def _ngram_vocabulary(vectorizer):
+    """
+    Get the n-grams of a fitted vectorizer's vocabulary, building them the
+    first time.
+    :param vectorizer: a fitted SK-Learn CountVectorizer or TfidfVectorizer.
+    :return: NGramVocabulary
+    """
+    vocabulary, ngrams = _ngram_vocabularies.get(vectorizer, (None, None))
+    if vocabulary is not vectorizer.vocabulary_:
+        ngrams = NGramVocabulary(vectorizer.vocabulary_)
+        _ngram_vocabularies[vectorizer] = (vectorizer.vocabulary_, ngrams)
+    return ngrams
+
+
+# Documents that the fitted state of _fit_frequencies is checked against
+# SK-Learn's fit with, once per process
+_FIT_CHECK_DOCS = ["data scientist python data", "Python data engineer",
+                   "machine learning data engineer SQL", "sql analyst python"]
+_fit_checked = False
+
+
+def _check_fit():
+    """
+    Check that fitting a vectorizer from token ids gives the same
+    vocabulary, weights and features as SK-Learn's own fit, as the fitted
+    state is set directly and could change between SK-Learn versions.
+    """
+    global _fit_checked
+    if _fit_checked:
+        return
+    # The check fits vectorizers itself
+    _fit_checked = True
+    docs = np.array(_FIT_CHECK_DOCS, dtype=object)
+    for tokenize, dtype in [("count", None), ("tfidf", None), ("tfidf", np.float32)]:
+        processing = NLPProcessing(n_grams=(1, 2), max_df=0.6, use_stopwords=False,
+                                   tokenize=tokenize, dtype=dtype)
+        processing._fit_corpus(TokenCorpus.from_texts(docs), stem=False)
+        expected = processing._new_vectorizer().fit(docs)
+        fitted = processing.vectorize
+        x, expected_x = fitted.transform(docs), expected.transform(docs)
+        if (fitted.vocabulary_ != expected.vocabulary_
+                or fitted.stop_words_ != expected.stop_words_
+                or x.dtype != expected_x.dtype or (x != expected_x).nnz):
+            _fit_checked = False
+            import sklearn
+            raise RuntimeError("Fitting from token ids no longer matches the fit of "
+                               "SK-Learn {}".format(sklearn.__version__))
+
+
+def _init_worker(processing):
+    """
+    Set up a preprocessing worker process.
+    :param processing: NLPProcessing, a copy without the fitted vectorizer.
+    """
+    global _worker_processing
+    _worker_processing = processing
+
+
+def _preprocess_worker(series, stem):
+    """
+    Preprocess a chunk of documents in a worker process.
+    :param series: Pandas Series, the job description text.
+    :param stem: bool, whether to stem/lemmatize after cleaning.
+    :return: list of str, the processed documents.
+    """
+    return list(_worker_processing._preprocess_serial(series, stem))
 
 
 class NLPProcessing:
@@ -19,7 +133,9 @@ class NLPProcessing:
     """
 
     def __init__(self, stemlem="", min_df=1, max_df=1.0, num_cities=2,
-                 n_grams=(1, 1), use_stopwords=True, tokenize="tfidf"):
+                 n_grams=(1, 1), use_stopwords=True, tokenize="tfidf",
+                 token_cache=None, n_jobs=1, feature_store=None, n_features=None,
+                 selection="chi2", dtype=None, stop_words=None):
         """
         Instantiate the preprocessing class.
         :param stemlem: str or list, stemmatizer or lemmatizer to use.
@@ -29,6 +145,23 @@ class NLPProcessing:
         :param n_grams: int, n-gram to use
         :param use_stopwords: bool, whether to use stopwords or not
         :param tokenize: str, which vectorizer to use
+        :param token_cache: TokenCache of stemmed/lemmatized tokens. If None,
+                            the cache shared by the whole process is used.
+        :param n_jobs: int, the number of processes used to clean and
+                       stem/lemmatize documents. -1 uses every CPU.
+        :param feature_store: FeatureStore of processed documents and feature
+                              rows, if applicable. Only documents that are
+                              not in the store are processed.
+        :param n_features: int, the number of features kept by
+                           select_features, or None to keep every feature.
+        :param selection: str, how select_features reduces the features:
+                          "chi2" or "mutual_info" keep the top n_features
+                          terms, "hash" sums the terms into n_features
+                          hashed columns.
+        :param dtype: the dtype of the feature matrices, eg np.float32 to
+                      halve their size, or None for the vectorizer default.
+        :param stop_words: set of str, the lower case stop words removed if
+                           use_stopwords, or None for utils.get_stopwords().
         """
         self.model = None
         self.stemlem = stemlem
@@ -40,6 +173,14 @@ class NLPProcessing:
         self.use_stopwords = use_stopwords
         self.done_stopwords = False
         self.tokenize = tokenize
+        self.token_cache = token_cache
+        self.n_jobs = n_jobs
+        self.feature_store = feature_store
+        self.n_features = n_features
+        self.selection = selection
+        # Vectorizers only accept NumPy scalar types, not names like "float32"
+        self.dtype = None if dtype is None else np.dtype(dtype).type
+        self.stop_words = None if stop_words is None else frozenset(stop_words)
 
     def fit(self, data=None, bucket=None, filename=None):
         """
@@ -50,14 +191,18 @@ class NLPProcessing:
         :param filename: str, name of the data file, if applicable.
         """
         df = import_data(bucket, filename) if data is None else data
-        fit_array = self._create_text_matrix(df[df["cleaned"]]["job_description"])
-        fit_array = self._stemlem(fit_array)
+        if getattr(self, "feature_store", None) is not None:
+            self._fit_counts(*self._store_counts(df[df["cleaned"]]["job_description"], True))
+            return
+        fit_array = self._preprocess(df[df["cleaned"]]["job_description"])
         self._do_vectorize(fit_array)
 
     def transform(self, data=None, bucket=None, filename=None):
         """
         Single function to apply the NLP transformation to every document.
-        :param data: Pandas DataFrame, str or list containing data.
+        Every document is cleaned and stemmed/lemmatized in the same way,
+        whether it is given as a DataFrame, a list or a single string.
+        :param data: Pandas DataFrame, Series, str or list containing data.
         :param bucket: str S3 bucket of data if applicable.
         :param filename: str, name of the data file, if applicable.
         :return: ndarrays for the feature and label matrices
@@ -67,12 +212,27 @@ class NLPProcessing:
             raise AttributeError("Must fit a processing pipeline before calling\
                                  the transform method")
         if isinstance(df, pd.DataFrame):
-            doc_array = self._create_text_matrix(df["job_description"])
-        elif isinstance(data, str):
-            doc_array = [data]
-        doc_array = self._stemlem(doc_array)
-        x = self.vectorize.transform(doc_array)
-        return x
+            series = df["job_description"]
+        elif isinstance(df, pd.Series):
+            series = df
+        elif isinstance(df, str):
+            series = pd.Series([df])
+        else:
+            series = pd.Series(list(df), dtype=object)
+        # Hashed features wrap the fitted vectorizer
+        vectorizer = getattr(self.vectorize, "vectorizer", self.vectorize)
+        if getattr(self, "feature_store", None) is not None:
+            x = self.feature_store.features(self, document_keys(series),
+                                            self._store_process(series, True), True)
+        elif hasattr(vectorizer, "vocabulary_"):
+            x = self._vectorize_corpus(TokenCorpus.from_texts(self._preprocess_chunks(series)),
+                                       vectorizer)
+            if vectorizer is not self.vectorize:
+                x = self.vectorize.collapse(x)
+        else:
+            x = self.vectorize.transform(self._preprocess(series))
+        dtype = getattr(self, "dtype", None)
+        return x if dtype is None else x.astype(dtype, copy=False)
 
     def fit_transform(self, data=None, bucket=None, filename=None):
         """
@@ -83,31 +243,370 @@ class NLPProcessing:
         :return: ndarrays for the feature and label matrices
         """
         df = import_data(bucket, filename) if data is None else data
-        fit_array = self._create_text_matrix(df[df["cleaned"]]["job_description"])
-        fit_array = self._stemlem(fit_array)
-        self._do_vectorize(fit_array)
-        doc_array = self._create_text_matrix(df["job_description"])
-        x = self.vectorize.transform(doc_array)
+        if getattr(self, "feature_store", None) is not None:
+            columns = self._fit_counts(
+                *self._store_counts(df[df["cleaned"]]["job_description"], True))
+            counts, _ = self._store_counts(df["job_description"], False)
+            return self._transform_counts(counts, columns)
+        # Every document is cleaned and tokenized once. The vectorizer is
+        # fitted on the training documents and counts the features of
+        # every document from the token ids
+        corpus = TokenCorpus.from_texts(self._preprocess_chunks(df["job_description"], False))
+        self._fit_corpus(corpus, df["cleaned"].values.astype(bool))
+        return self._vectorize_corpus(corpus, self.vectorize)
+
+    def _preprocess(self, series, stem=True):
+        """
+        Clean and stem/lemmatize documents, splitting them into chunks that
+        are processed in parallel when n_jobs is not 1.
+        The output is identical to processing the documents serially.
+        :param series: Pandas Series, the job description text.
+        :param stem: bool, whether to stem/lemmatize after cleaning.
+        :return: list or ndarray of str, the processed documents in order.
+        """
+        n_jobs, size = self._parallel_chunks(series)
+        if n_jobs == 1:
+            return self._preprocess_serial(series, stem)
+        chunks = [series.iloc[i:i + size] for i in range(0, len(series), size)]
+        with self._worker_pool(min(n_jobs, len(chunks))) as pool:
+            output = list(chain.from_iterable(
+                pool.map(_preprocess_worker, chunks, repeat(stem))))
+        return output if stem else np.array(output, dtype=object)
+
+    def _preprocess_chunks(self, series, stem=True):
+        """
+        Clean and stem/lemmatize documents a chunk at a time, so that the
+        processed text of every document is never held at once. In
+        parallel, one pool of workers processes every chunk, with a few
+        chunks per worker processed ahead.
+        :param series: Pandas Series, the job description text.
+        :param stem: bool, whether to stem/lemmatize after cleaning.
+        :return: generator of str, the processed documents in order.
+        """
+        n_jobs, size = self._parallel_chunks(series)
+        if n_jobs == 1:
+            for start in range(0, len(series), PREPROCESS_CHUNK):
+                docs = self._preprocess_serial(series.iloc[start:start + PREPROCESS_CHUNK],
+                                               stem)
+                if start + PREPROCESS_CHUNK < len(series):
+                    # The intermediate Series of cleaning are kept alive by
+                    # reference cycles until the next full garbage collection
+                    gc.collect()
+                yield from docs
+            return
+        size = min(size, PREPROCESS_CHUNK)
+        with self._worker_pool(min(n_jobs, -(-len(series) // size))) as pool:
+            pending = deque()
+            for start in range(0, len(series), size):
+                pending.append(pool.submit(_preprocess_worker,
+                                           series.iloc[start:start + size], stem))
+                if len(pending) > n_jobs * CHUNKS_PER_JOB:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def _parallel_chunks(self, series):
+        """
+        Choose how documents are split between worker processes.
+        :param series: Pandas Series, the documents.
+        :return: tuple of (int, int), the number of processes, 1 to process
+                 the documents in this process, and the documents per chunk.
+        """
+        n_jobs = getattr(self, "n_jobs", 1)
+        n_jobs = (os.cpu_count() or 1) if n_jobs == -1 else max(1, n_jobs)
+        size = max(MIN_CHUNK_SIZE, -(-len(series) // (n_jobs * CHUNKS_PER_JOB)))
+        return (1 if len(series) <= size else n_jobs), size
+
+    def _worker_pool(self, n_jobs):
+        """
+        Start a pool of preprocessing worker processes.
+        :param n_jobs: int, the number of processes.
+        :return: ProcessPoolExecutor
+        """
+        # Workers only need the preprocessing settings, not the vectorizer
+        worker_copy = copy.copy(self)
+        worker_copy.vectorize = None
+        worker_copy.model = None
+        worker_copy.feature_store = None
+        return ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(worker_copy,))
+
+    def _preprocess_serial(self, series, stem=True):
+        """
+        Clean and stem/lemmatize documents in this process.
+        :param series: Pandas Series, the job description text.
+        :param stem: bool, whether to stem/lemmatize after cleaning.
+        :return: list or ndarray of str, the processed documents.
+        """
+        text_array = self._create_text_matrix(series)
+        return self._stemlem(text_array) if stem else text_array
+
+    def _text_and_stemmed(self, series):
+        """
+        Clean documents, and stem/lemmatize the cleaned text, reusing the
+        documents in the feature store if applicable.
+        :param series: Pandas Series, the job description text.
+        :return: tuple of (ndarray, list or ndarray) of str, the cleaned and
+                 the stemmed/lemmatized documents.
+        """
+        if getattr(self, "feature_store", None) is not None:
+            return self.feature_store.preprocess(self, series)
+        text = self._preprocess(series, stem=False)
+        return text, self._stemlem(text)
+
+    def _store_process(self, series, stemmed):
+        """
+        Get a function that processes documents through the feature store.
+        :param series: Pandas Series, the job description text.
+        :param stemmed: bool, whether the function returns the
+                        stemmed/lemmatized text or the cleaned text.
+        :return: function that takes a list of positions in the series and
+                 returns the processed documents.
+        """
+        def process(positions):
+            text, stemmed_text = self.feature_store.preprocess(self, series.iloc[positions])
+            return stemmed_text if stemmed else text
+        return process
+
+    def _store_counts(self, series, stemmed):
+        """
+        Count the terms of documents, reusing the feature store's counts.
+        :param series: Pandas Series, the job description text.
+        :param stemmed: bool, count the stemmed/lemmatized text or the
+                        cleaned text.
+        :return: tuple of (scipy sparse matrix, ndarray of str), as
+                 FeatureStore.counts.
+        """
+        return self.feature_store.counts(self, document_keys(series),
+                                         self._store_process(series, stemmed), stemmed)
+
+    def _fit_counts(self, counts, terms):
+        """
+        Fit the vectorizer from the term counts of the training documents.
+        The vocabulary and weights are the same as fitting the vectorizer on
+        the documents themselves.
+        :param counts: scipy sparse CSR matrix, the count of each term in
+                       each document.
+        :param terms: ndarray of str, the term of each column of counts.
+        :return: ndarray of int, the vocabulary column of each term of
+                 counts, or -1 if the term is not in the vocabulary.
+        """
+        return self._fit_frequencies(np.bincount(counts.indices, minlength=counts.shape[1]),
+                                     terms, counts.shape[0])
+
+    def _fit_frequencies(self, doc_freq, terms, n_doc, tokenize=None):
+        """
+        Fit the vectorizer from the document frequencies of the terms of the
+        training documents. Every fit of the vectorizer ends here, and sets
+        the fitted state that SK-Learn's fit would, which is checked against
+        SK-Learn once per process.
+        :param doc_freq: ndarray of int, the number of documents that contain
+                         each term.
+        :param terms: ndarray of str, the term of each document frequency.
+        :param n_doc: int, the number of training documents.
+        :param tokenize: str, "tfidf" or "count", or None for self.tokenize.
+        :return: ndarray of int, the vocabulary column of each term, or -1
+                 if the term is not in the vocabulary.
+        """
+        _check_fit()
+        tokenize = tokenize or self.tokenize
+        self.vectorize = self._new_vectorizer(tokenize)
+        max_doc_count = (self.max_df if isinstance(self.max_df, numbers.Integral)
+                         else self.max_df * n_doc)
+        min_doc_count = (self.min_df if isinstance(self.min_df, numbers.Integral)
+                         else self.min_df * n_doc)
+        if max_doc_count < min_doc_count:
+            raise ValueError("max_df corresponds to < documents than min_df")
+        present = np.flatnonzero(doc_freq)
+        if len(present) == 0:
+            raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+        kept = (doc_freq[present] <= max_doc_count) & (doc_freq[present] >= min_doc_count)
+        if not kept.any():
+            raise ValueError("After pruning, no terms remain. Try a lower min_df or a "
+                             "higher max_df.")
+        # Vocabulary columns are in term order, as SK-Learn sorts them
+        vocabulary = present[kept][np.argsort(terms[present[kept]], kind="stable")]
+        columns = np.full(len(terms), -1, dtype=np.int64)
+        columns[vocabulary] = np.arange(len(vocabulary))
+        self.vectorize.vocabulary_ = dict(zip(terms[vocabulary].tolist(),
+                                              range(len(vocabulary))))
+        self.vectorize.fixed_vocabulary_ = False
+        self.vectorize.stop_words_ = set(terms[present[~kept]].tolist())
+        if tokenize == "tfidf":
+            # As TfidfTransformer.fit computes the weights, in the dtype of
+            # the counts
+            smooth = int(self.vectorize.smooth_idf)
+            frequencies = doc_freq[vocabulary].astype(self.vectorize.dtype) + smooth
+            idf = np.log((n_doc + smooth) / frequencies) + 1
+            self.vectorize.idf_ = idf
+            # The setter of older SK-Learn versions keeps the weights as a
+            # float64 diagonal matrix, fit keeps them in the dtype
+            tfidf = self.vectorize._tfidf
+            if hasattr(tfidf, "_idf_diag"):
+                tfidf._idf_diag = tfidf._idf_diag.astype(idf.dtype)
+        return columns
+
+    def _fit_corpus(self, corpus, fit_rows=None, stem=True, tokenize=None):
+        """
+        Fit the vectorizer on the training documents of a token corpus. The
+        vocabulary and weights are the same as fitting the vectorizer on
+        the documents themselves.
+        :param corpus: TokenCorpus of the documents.
+        :param fit_rows: ndarray of bool, the training documents, or None to
+                         train on every document.
+        :param stem: bool, whether to stem/lemmatize the cleaned documents
+                     first, or they already are.
+        :param tokenize: str, "tfidf" or "count", or None for self.tokenize.
+        """
+        analyze = self._token_analyzer(self._new_vectorizer(tokenize))
+        steps = self._token_steps() if stem else []
+        if steps:
+            tokens = corpus.tokens.tolist()
+            normalized = dict(zip(tokens, self._token_table(steps).map_tokens(tokens)))
+
+            def stem_and_analyze(token):
+                token = normalized[token]
+                return [] if token is None else analyze(token)
+        else:
+            stem_and_analyze = analyze
+        training = (corpus if fit_rows is None else corpus.subset(fit_rows)).map_tokens(
+            stem_and_analyze)
+        doc_freq, terms = training.ngram_frequencies(self.n_grams)
+        self._fit_frequencies(doc_freq, terms, len(training), tokenize)
+
+    def _vectorize_corpus(self, corpus, vectorizer):
+        """
+        Vectorize the documents of a token corpus as a fitted vectorizer
+        would vectorize the documents themselves, counting the vocabulary
+        terms from the token ids.
+        :param corpus: TokenCorpus of the documents, split on single spaces.
+        :param vectorizer: a fitted SK-Learn CountVectorizer or
+                           TfidfVectorizer.
+        :return: scipy sparse CSR matrix
+        """
+        x = _ngram_vocabulary(vectorizer).counts(corpus, vectorizer.ngram_range, vectorizer.dtype,
+                                                 self._token_analyzer(vectorizer))
+        return self._weight_counts(x, vectorizer)
+
+    @staticmethod
+    def _token_analyzer(vectorizer):
+        """
+        Build the function that splits a token into terms as the word
+        analyzer of a vectorizer does, before n-grams are joined.
+        :param vectorizer: an SK-Learn CountVectorizer or TfidfVectorizer.
+        :return: function that maps a token to a list of terms.
+        """
+        preprocess = vectorizer.build_preprocessor()
+        tokenize = vectorizer.build_tokenizer()
+
+        def analyze(token):
+            return tokenize(preprocess(token))
+        return analyze
+
+    def _select_counts(self, counts, columns):
+        """
+        Select the vocabulary columns of term counts.
+        :param counts: scipy sparse CSR matrix, the count of each term in
+                       each document.
+        :param columns: ndarray of int, as returned by _fit_counts.
+        :return: scipy sparse CSR matrix of the vectorizer's dtype, the
+                 counts of the vocabulary terms, as CountVectorizer.transform.
+        """
+        if counts.shape[1] > len(columns):
+            # Terms added to the store since fitting are not in the vocabulary
+            columns = np.concatenate([columns, np.full(counts.shape[1] - len(columns), -1)])
+        selected = columns[counts.indices]
+        keep = selected >= 0
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        indptr = np.zeros(counts.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[keep], minlength=counts.shape[0]), out=indptr[1:])
+        x = sparse.csr_matrix((counts.data[keep].astype(self.vectorize.dtype), selected[keep],
+                               indptr),
+                              shape=(counts.shape[0], len(self.vectorize.vocabulary_)))
+        x.sort_indices()
         return x
 
+    def _transform_counts(self, counts, columns):
+        """
+        Vectorize documents from their term counts, as the fitted vectorizer
+        would vectorize the documents themselves.
+        :param counts: scipy sparse CSR matrix, the count of each term in
+                       each document.
+        :param columns: ndarray of int, as returned by _fit_counts.
+        :return: scipy sparse CSR matrix
+        """
+        return self._weight_counts(self._select_counts(counts, columns), self.vectorize)
+
+    @staticmethod
+    def _weight_counts(x, vectorizer):
+        """
+        Weight the term counts of documents as a fitted vectorizer does.
+        :param x: scipy sparse CSR matrix, the count of each vocabulary
+                  term in each document.
+        :param vectorizer: a fitted SK-Learn CountVectorizer or
+                           TfidfVectorizer.
+        :return: scipy sparse CSR matrix
+        """
+        if not hasattr(vectorizer, "use_idf"):
+            return x
+        # As TfidfVectorizer.transform weights the counts of CountVectorizer
+        return vectorizer._tfidf.transform(x, copy=False)
+
     def _stemlem(self, text_array):
         """
         Controls the stemmatization/lemmatization process.
         Note that, if multiple methods are selected, lemmatization is performed
         before stemmatization.
+        Each distinct token is only stemmed/lemmatized once, the results are
+        kept in the token cache.
         :param text_array: ndarray, the documents to process.
         :return: ndarray, the processed documents
         """
+        steps = self._token_steps()
+        if steps:
+            return self._normalize(text_array, steps)
+        return list(text_array)
+
+    def _stemlem_steps(self):
+        """
+        Create the token steps of the selected stemmers/lemmatizers.
+        :return: list of (name, function) tuples, empty if no stemmer or
+                 lemmatizer is selected.
+        """
+        # NLTK imports SK-Learn if it is installed, so is only imported when
+        # documents are stemmed/lemmatized
         self.done_stopwords = False
+        steps = []
         if "wordnet" in self.stemlem:
-            text_array = self.wordnet_lemmatizer(text_array)
+            steps += self._lemmatize_steps()
         if "snowball" in self.stemlem:
-            text_array = self.do_stem(text_array, SnowballStemmer("english"))
+            from nltk.stem.snowball import SnowballStemmer
+            steps += self._stem_steps(SnowballStemmer("english"))
         elif "porter" in self.stemlem:
-            text_array = self.do_stem(text_array, PorterStemmer())
-        if self.stemlem == "":
-            text_array = self.remove_stopwords(text_array)
-        return text_array
+            from nltk.stem.porter import PorterStemmer
+            steps += self._stem_steps(PorterStemmer())
+        return steps
+
+    def _token_steps(self):
+        """
+        Create the token steps that _stemlem applies to each token: the
+        selected stemmers/lemmatizers, or stop word removal alone if none
+        is selected.
+        :return: list of (name, function) tuples, empty if tokens are kept
+                 as they are.
+        """
+        steps = self._stemlem_steps()
+        if not steps and self.stemlem == "" and self.use_stopwords:
+            steps = [self._stopword_step(self.get_stopwords())]
+        return steps
+
+    def get_stopwords(self):
+        """
+        Get the stop words that are removed from documents.
+        :return: set of str, the lower case stop words.
+        """
+        # Models pickled before stop_words was a setting have no attribute
+        stop_words = getattr(self, "stop_words", None)
+        return get_stopwords() if stop_words is None else stop_words
 
     def wordnet_lemmatizer(self, documents):
         """
@@ -117,17 +616,7 @@ class NLPProcessing:
         :param documents: ndarry of the desctiptions to be lemmatized.
         :return list, the transformed data.
         """
-        wn = WordNetLemmatizer()
-        stop_words = set()
-        if self.use_stopwords:
-            stop_words = get_stopwords()
-        self.done_stopwords = True
-        for pos_tag in ["a", "s", "r", "n", "v"]:
-            documents = [" ".join([wn.lemmatize(word, pos=pos_tag)
-                                   for word in text.split(" ")
-                                   if word.lower() not in stop_words])
-                         for text in documents]
-        return documents
+        return self._normalize(documents, self._lemmatize_steps())
 
     def do_stem(self, documents, model):
         """
@@ -136,13 +625,7 @@ class NLPProcessing:
         :param model: the instantiated transformation to use.
         :return: list, the transformed documents
         """
-        stop_words = set()
-        if self.use_stopwords and not self.done_stopwords:
-            stop_words = get_stopwords()
-        self.done_stopwords = True
-        return [" ".join([model.stem(word) for word in text.split(" ")
-                          if word.lower() not in stop_words])
-                for text in documents]
+        return self._normalize(documents, self._stem_steps(model))
 
     def remove_stopwords(self, documents):
         """
@@ -152,9 +635,90 @@ class NLPProcessing:
         """
         if not self.use_stopwords:
             return list(documents)
-        stop_words = get_stopwords()
-        return [" ".join([word for word in text.split(" ")
-                          if word.lower() not in stop_words]) for text in documents]
+        return self._normalize(documents, [self._stopword_step(self.get_stopwords())])
+
+    def _lemmatize_steps(self):
+        """
+        Create the token steps that lemmatize with all 5 WordNet POS tags,
+        removing stop words before each pass.
+        :return: list of (name, function) tuples, each function maps a token
+                 to its new form, or to None to remove it.
+        """
+        from nltk.stem.wordnet import WordNetLemmatizer
+        wn = WordNetLemmatizer()
+        stop_words = self.get_stopwords() if self.use_stopwords else set()
+        self.done_stopwords = True
+        steps = []
+        for pos_tag in ["a", "s", "r", "n", "v"]:
+            if stop_words:
+                steps.append(self._stopword_step(stop_words))
+            steps.append(("wordnet:" + pos_tag, partial(wn.lemmatize, pos=pos_tag)))
+        return steps
+
+    def _stem_steps(self, model):
+        """
+        Create the token steps that stem, removing stop words first unless
+        that has already been done.
+        :param model: the instantiated stemmer to use.
+        :return: list of (name, function) tuples, each function maps a token
+                 to its new form, or to None to remove it.
+        """
+        steps = []
+        if self.use_stopwords and not self.done_stopwords:
+            steps.append(self._stopword_step(self.get_stopwords()))
+        self.done_stopwords = True
+        # Snowball stemmers delegate to a language specific stemmer
+        steps.append((type(getattr(model, "stemmer", model)).__name__, model.stem))
+        return steps
+
+    @staticmethod
+    def _stopword_step(stop_words):
+        """
+        Create a token step that removes stop words (case insensitive).
+        The name includes a digest of the stop words, so processing objects
+        with different stop words do not share token tables.
+        :param stop_words: set of str, the lower case stop words.
+        :return: tuple of (name, function)
+        """
+        def remove(word):
+            return None if word.lower() in stop_words else word
+        digest = hashlib.sha1(" ".join(sorted(stop_words)).encode("utf-8")).hexdigest()
+        return "stopwords:" + digest[:12], remove
+
+    def _normalize(self, documents, steps):
+        """
+        Tokenize each document on single spaces, normalize every token with
+        the token steps, and join them back together. Each distinct token is
+        looked up in the token cache, so the steps run once per word rather
+        than once per occurrence.
+        :param documents: ndarray or list of str, the documents.
+        :param steps: list of (name, function) tuples.
+        :return: list of str, the transformed documents.
+        """
+        table = self._token_table(steps)
+        keep = partial(is_not, None)
+        return [" ".join(filter(keep, table.map_tokens(text.split(" "))))
+                for text in documents]
+
+    def _token_table(self, steps):
+        """
+        Get the token cache table of a list of token steps.
+        :param steps: list of (name, function) tuples.
+        :return: TokenTable, mapping tokens to their normalized form, or to
+                 None if they are removed.
+        """
+        functions = [func for _, func in steps]
+
+        def normalize_token(token):
+            for func in functions:
+                token = func(token)
+                if token is None:
+                    break
+            return token
+
+        # Models pickled before the token cache existed have no attribute
+        cache = getattr(self, "token_cache", None) or get_token_cache()
+        return cache.table("/".join(name for name, _ in steps), normalize_token)
 
     def _do_vectorize(self, docs):
         """
@@ -167,17 +731,60 @@ class NLPProcessing:
             self.count_vectorize(docs)
 
 
+    def _new_vectorizer(self, tokenize=None):
+        """
+        Create an unfitted vectorizer with the processing settings.
+        :param tokenize: str, "tfidf" or "count", or None for self.tokenize.
+        :return: SK Learn TfidfVectorizer or CountVectorizer object
+        """
+        # SK-Learn is only imported to fit, so fitted models that are saved
+        # as artifacts can be loaded without it
+        from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+        params = {"min_df": self.min_df, "max_df": self.max_df, "ngram_range": self.n_grams}
+        # Models pickled before dtype was a setting have no attribute
+        if getattr(self, "dtype", None) is not None:
+            params["dtype"] = self.dtype
+        if (tokenize or self.tokenize) == "tfidf":
+            return TfidfVectorizer(**params)
+        return CountVectorizer(**params)
+
+    def select_features(self, x, labels):
+        """
+        Reduce the features of the fitted vectorizer to n_features, using the
+        training matrix and labels. With "chi2" or "mutual_info" the
+        vocabulary is pruned to the top terms, with "hash" the vectorizer is
+        wrapped so that its terms are summed into hashed columns. Either
+        way, transform returns the reduced features from then on.
+        :param x: scipy sparse matrix, the training matrix of the vectorizer.
+        :param labels: ndarray of int, the class of each training document.
+        :return: scipy sparse CSR matrix, the reduced training matrix.
+        """
+        n_features = getattr(self, "n_features", None)
+        dtype = getattr(self, "dtype", None)
+        if n_features is None:
+            return x if dtype is None else x.astype(dtype)
+        if self.selection == "hash":
+            self.vectorize = HashedFeatures(self.vectorize, n_features, dtype)
+            return self.vectorize.collapse(x)
+        keep = top_features(feature_scores(x, labels, self.selection), n_features)
+        prune_vectorizer(self.vectorize, keep)
+        x = sparse.csr_matrix(x)[:, keep]
+        norm = getattr(self.vectorize, "norm", None)
+        if norm is not None:
+            # The rows were normalized over every term, transform normalizes
+            # them over the kept terms
+            from sklearn.preprocessing import normalize
+            x = normalize(x, norm=norm, copy=False)
+        return x if dtype is None else x.astype(dtype)
+
     def count_vectorize(self, training_docs):
         """
         Vectorize the corpus using bag of words vectorization
         :param training_docs: ndarray, the text to fit the vectorizer.
         :return: SK Learn vectorizer object
         """
-        # Instantiate class and fit vocabulary
-        self.vectorize = CountVectorizer(training_docs, min_df=self.min_df,
-                                         max_df=self.max_df,
-                                         ngram_range=self.n_grams)
-        self.vectorize.fit(training_docs)
+        # Fit the vocabulary from the token ids, as fit_transform does
+        self._fit_corpus(TokenCorpus.from_texts(training_docs), stem=False, tokenize="count")
 
     def tfidf_vectorize(self, training_docs):
         """
@@ -185,11 +792,8 @@ class NLPProcessing:
         :param training_docs: Numpy array, the text to fit the vectorizer
         :return: SK Learn vectorizer object
         """
-        # Instantiate class and fit vocabulary
-        self.vectorize = TfidfVectorizer(training_docs, min_df=self.min_df,
-                                         max_df=self.max_df,
-                                         ngram_range=self.n_grams)
-        self.vectorize.fit(training_docs)
+        # Fit the vocabulary from the token ids, as fit_transform does
+        self._fit_corpus(TokenCorpus.from_texts(training_docs), stem=False, tokenize="tfidf")
 
     @staticmethod
     def _create_text_matrix(series):
@@ -198,9 +802,7 @@ class NLPProcessing:
         :param series: Pandas Series, the job description text
         :return: Numpy array, the cleaned up text
         """
-        series = series.apply(lambda x: re.sub(r"((?<=[a-z])[A-Z]|(?<!\A)[A-Z](?=[a-z]))", r" \1", x))
-        sm = series.as_matrix()
-        for index, document in enumerate(series):
-            document = document.replace("\n", " ")
-            sm[index] = re.sub("[^\w\s]|â", "", document, flags=re.UNICODE)
-        return sm
+        series = (series.str.replace(CAMEL_CASE, _split_camel_case, regex=True)
+                        .str.replace("\n", " ", regex=False)
+                        .str.replace(SPECIAL_CHARACTERS, "", regex=True))
+        return series.values
@@ -0,0 +1,438 @@
+"""
+Serving layer for city predictions.
+Results are cached by a hash of the document text, so a posting that is
+submitted again is answered without cleaning, vectorizing or scoring it,
+and concurrent requests can be collected for a few milliseconds and scored
+as one batch. Cache hit rates and latency percentiles are recorded, and the
+model is reloaded when a new one is saved.
+"""
+
+from .batch_predict import model_classes
+from .explain import explain_rows
+from .model_artifact import load_model, MANIFEST
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from datetime import datetime
+from functools import partial
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import perf_counter, monotonic
+import hashlib
+import os
+import numpy as np
+
+
+class PredictionCache:
+    """
+    A size-bounded LRU cache of prediction results, keyed by the SHA-256
+    digest of the document text. Every entry belongs to a model version,
+    and changing the version removes every entry.
+    """
+    def __init__(self, maxsize=10000):
+        """
+        Instantiate the cache.
+        :param maxsize: int, the maximum number of documents to keep.
+        """
+        self.maxsize = maxsize
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text):
+        """
+        Get the cache key of a document.
+        :param text: str, the document.
+        :return: bytes, the SHA-256 digest of the text.
+        """
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def get(self, key):
+        """
+        Get a cached result, marking it as recently used.
+        :param key: bytes, the cache key.
+        :return: the cached result, or None if not cached.
+        """
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, result, version):
+        """
+        Cache a result, evicting the least recently used one if full.
+        :param key: bytes, the cache key.
+        :param result: the result to cache.
+        :param version: the version of the model that made the result. It
+                        is not cached if the model has changed since.
+        """
+        with self.lock:
+            if version != self.version or self.maxsize <= 0:
+                return
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, version):
+        """
+        Remove every entry, as the model has changed.
+        :param version: the new model version.
+        """
+        with self.lock:
+            self.version = version
+            self.entries.clear()
+
+    def hit_rate(self):
+        """
+        Get the fraction of lookups that were found in the cache.
+        :return: float
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LatencyStats:
+    """
+    Records the latency of recent requests and reports their percentiles.
+    """
+    def __init__(self, window=10000):
+        """
+        Instantiate the recorder.
+        :param window: int, the number of most recent requests to keep.
+        """
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds):
+        """
+        Record the latency of one request.
+        :param seconds: float, the request latency.
+        """
+        self.latencies.append(seconds)
+        self.count += 1
+
+    def percentiles(self, q=(50, 95, 99)):
+        """
+        Get latency percentiles of the recent requests.
+        :param q: tuple of float, the percentiles.
+        :return: dict mapping "p50" etc to milliseconds, None if no requests.
+        """
+        latencies = np.array(self.latencies)
+        return {"p{:g}".format(p): (float(np.percentile(latencies, p)) * 1000
+                                    if len(latencies) else None)
+                for p in q}
+
+
+class MicroBatcher:
+    """
+    Collects documents submitted by concurrent requests and scores them
+    together. A batch is scored when it reaches max_batch documents, or
+    max_wait seconds after its first document arrived.
+    """
+    def __init__(self, score, max_batch=64, max_wait=0.005):
+        """
+        Instantiate the batcher and start its worker thread.
+        :param score: function that maps a list of documents to a sequence
+                      with one result per document.
+        :param max_batch: int, the maximum number of documents in a batch.
+        :param max_wait: float, the seconds to wait for a batch to fill.
+        """
+        self.score = score
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = Queue()
+        self.lock = Lock()
+        self.closed = False
+        self.batches = 0
+        self.documents = 0
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, text):
+        """
+        Submit a document to be scored.
+        :param text: str, the document.
+        :return: Future, the result for the document.
+        """
+        future = Future()
+        with self.lock:
+            if not self.closed:
+                self.queue.put((text, future))
+                return future
+        # The batcher was closed, eg as the model was replaced, after the
+        # request started, so score the document on its own
+        try:
+            future.set_result(self.score([text])[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _run(self):
+        """
+        Score batches of submitted documents until the batcher is closed.
+        """
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - perf_counter()
+                try:
+                    item = (self.queue.get(timeout=timeout) if timeout > 0
+                            else self.queue.get_nowait())
+                except Empty:
+                    break
+                if item is None:
+                    # Finish this batch, then stop
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+            texts, futures = zip(*batch)
+            try:
+                results = self.score(list(texts))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.documents += len(batch)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def close(self):
+        """
+        Stop the worker thread once the documents already submitted have
+        been scored.
+        """
+        with self.lock:
+            self.closed = True
+            self.queue.put(None)
+
+
+class PredictionService:
+    """
+    Predicts the city probabilities of documents with a fitted model,
+    caching the results and optionally micro-batching concurrent requests.
+    The model can be replaced while requests are being served: each request
+    uses the model that was current when it started.
+    """
+    def __init__(self, model=None, version=None, cache_size=10000, batching=False,
+                 max_batch=64, max_wait=0.005, explain=0):
+        """
+        Instantiate the service.
+        :param model: a fitted model object with processing and model
+                      attributes, or None to set it later.
+        :param version: the model version, eg the time it was created.
+        :param cache_size: int, the number of results to cache, 0 for none.
+        :param batching: bool, score concurrent requests together.
+        :param max_batch: int, the maximum number of documents in a batch.
+        :param max_wait: float, the seconds to wait for a batch to fill.
+        :param explain: int, the number of top contributing terms to return
+                        with each prediction, 0 for none.
+        """
+        self.cache = PredictionCache(cache_size)
+        self.latency = LatencyStats()
+        self.batching = batching
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.explain = explain
+        # The model, its classes, version and batcher, replaced together
+        self.current = (None, None, None, None)
+        if model is not None:
+            self.set_model(model, version)
+
+    @property
+    def ready(self):
+        """
+        Whether a model has been loaded.
+        """
+        return self.current[0] is not None
+
+    @property
+    def classes(self):
+        """
+        The label of each column of the current model's probabilities.
+        """
+        return self.current[1]
+
+    @property
+    def version(self):
+        """
+        The version of the current model.
+        """
+        return self.current[2]
+
+    def set_model(self, model, version=None):
+        """
+        Start using a new model, removing the cached results of the old one.
+        Requests that started with the old model finish with it.
+        :param model: a fitted model object with processing and model
+                      attributes.
+        :param version: the model version.
+        """
+        version = id(model) if version is None else version
+        batcher = (MicroBatcher(partial(self._score, model, self.explain), self.max_batch,
+                                self.max_wait) if self.batching else None)
+        old_batcher = self.current[3]
+        self.current = (model, model_classes(model), version, batcher)
+        self.cache.invalidate(version)
+        if old_batcher is not None:
+            old_batcher.close()
+
+    def predict(self, texts):
+        """
+        Get the probability of each city for each document.
+        :param texts: list of str, the documents.
+        :return: tuple of (ndarray, ndarray, version, list), the probability
+                 of each class for each document, the label of each column,
+                 the version of the model that made the predictions, and the
+                 top terms of each document's predicted class, as
+                 explain.explain_rows, or None if explain is 0.
+        """
+        start = perf_counter()
+        model, classes, version, batcher = self.current
+        if model is None:
+            raise RuntimeError("No model has been loaded")
+        keys = [self.cache.key(text) for text in texts]
+        results = [self.cache.get(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            if batcher is None:
+                scored = self._score(model, self.explain, [texts[i] for i in misses])
+            else:
+                futures = [batcher.submit(texts[i]) for i in misses]
+                scored = [future.result() for future in futures]
+            for i, (row, terms) in zip(misses, scored):
+                # Copy the row, so the cache does not keep the whole batch
+                results[i] = (np.array(row), terms)
+                self.cache.put(keys[i], results[i], version)
+        self.latency.record(perf_counter() - start)
+        probabilities = np.array([row for row, _ in results]).reshape(len(texts), len(classes))
+        explanations = [terms for _, terms in results] if self.explain else None
+        return probabilities, classes, version, explanations
+
+    def predict_proba(self, texts):
+        """
+        Get the probability of each city for each document.
+        :param texts: list of str, the documents.
+        :return: ndarray, the probability of each class for each document.
+        """
+        return self.predict(texts)[0]
+
+    @staticmethod
+    def _score(model, explain, texts):
+        """
+        Clean, vectorize and score documents.
+        :param model: a fitted model object with processing and model
+                      attributes.
+        :param explain: int, the number of top terms to find, 0 for none.
+        :param texts: list of str, the documents.
+        :return: list of (ndarray, list) tuples, the probability of each
+                 class and the top terms of each document.
+        """
+        features = model.processing.transform(texts)
+        probabilities = model.model.predict_proba(features)
+        if not explain:
+            return [(row, None) for row in probabilities]
+        return list(zip(probabilities, explain_rows(model, features,
+                                                    probabilities.argmax(axis=1),
+                                                    explain)))
+
+    def stats(self):
+        """
+        Get the cache and latency statistics.
+        :return: dict
+        """
+        stats = {"requests": self.latency.count,
+                 "cache_size": len(self.cache.entries),
+                 "cache_hits": self.cache.hits,
+                 "cache_misses": self.cache.misses,
+                 "cache_hit_rate": self.cache.hit_rate()}
+        stats.update({name + "_ms": value
+                      for name, value in self.latency.percentiles().items()})
+        batcher = self.current[3]
+        if batcher is not None:
+            stats["batches"] = batcher.batches
+            stats["mean_batch_size"] = (batcher.documents / batcher.batches
+                                        if batcher.batches else 0.0)
+        return stats
+
+
+class ModelWatcher:
+    """
+    Reloads a model when its artifact directory or pkl file changes, and
+    swaps it into a PredictionService.
+    Checks are made from request handlers, at most once per interval,
+    rather than by a background thread, so they work in every worker
+    process of a pre-forking server.
+    """
+    def __init__(self, path, service, interval=5.0):
+        """
+        Instantiate the watcher.
+        :param path: str, the model artifact directory or pkl file.
+        :param service: PredictionService to load the model into.
+        :param interval: float, the minimum seconds between checks.
+        """
+        self.path = path
+        self.service = service
+        self.interval = interval
+        self.lock = Lock()
+        self.signature = None
+        self.next_check = 0.0
+        self.error = None
+
+    def _signature(self):
+        """
+        Identify the current model file. save_artifact writes every model
+        to a new version directory, so the manifest is a new file for every
+        model.
+        :return: tuple of (inode, mtime in ns, size), or None if missing.
+        """
+        path = self.path
+        if os.path.isdir(path):
+            path = os.path.join(path, MANIFEST)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def check(self, force=False):
+        """
+        Load the model if it has changed since the last check. Only one
+        thread checks at a time; the others carry on with the current model.
+        :param force: bool, check even if the interval has not passed.
+        :return: bool, whether a new model was loaded.
+        """
+        now = monotonic()
+        if not force and now < self.next_check:
+            return False
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            self.next_check = now + self.interval
+            signature = self._signature()
+            if signature is None or signature == self.signature:
+                return False
+            try:
+                model = load_model(self.path)
+            except Exception as e:
+                # Eg the model is being replaced, so try again next time
+                self.error = repr(e)
+                return False
+            self.signature = signature
+            self.error = None
+            self.service.set_model(model, datetime.fromtimestamp(
+                signature[1] / 1e9).isoformat())
+            return True
+        finally:
+            self.lock.release()
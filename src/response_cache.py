@@ -0,0 +1,252 @@
+"""
+On-disk HTTP response cache for the web scraper.
+Response bodies are stored once per distinct content (named by their SHA-256
+digest), and a SQLite index maps each URL to its body, validators and age.
+"""
+
+import gzip
+import hashlib
+import os
+import sqlite3
+import zlib
+from threading import Lock
+from time import time
+
+
+class ResponseCache:
+    """
+    A content-addressed, size-bounded LRU cache of HTTP responses with TTL
+    expiry, ETag/Last-Modified revalidation and an offline replay mode.
+    """
+    def __init__(self, directory, ttl=7 * 24 * 3600, max_bytes=2 * 1024 ** 3,
+                 offline=False):
+        """
+        Open the cache, creating it if necessary.
+        :param directory: str, the directory to keep the cache in.
+        :param ttl: float, seconds before a cached response must be revalidated.
+        :param max_bytes: int, the maximum total size of the stored bodies.
+                          The least recently used responses are evicted first.
+        :param offline: bool, replay only: serve every response from the cache
+                        regardless of age, and never touch the network.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, "index.db"),
+                                    timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                          "url TEXT PRIMARY KEY, digest TEXT, status INTEGER, "
+                          "etag TEXT, last_modified TEXT, size INTEGER, "
+                          "fetched_at REAL, accessed_at REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed "
+                          "ON responses (accessed_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_digest "
+                          "ON responses (digest)")
+        # The total size of the distinct stored bodies, updated in the same
+        # transaction as the responses, so that every process that shares
+        # the cache sees the same total. Caches created without it start
+        # from the sum over the index.
+        self.conn.execute("CREATE TABLE IF NOT EXISTS totals ("
+                          "name TEXT PRIMARY KEY, bytes INTEGER)")
+        self.conn.execute("INSERT OR IGNORE INTO totals SELECT 'bodies', "
+                          "COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size "
+                          "FROM responses)")
+        self.conn.commit()
+
+    def lookup(self, url):
+        """
+        Get the cached response for a URL, marking it as recently used.
+        :param url: str, the requested URL.
+        :return: dict with the response metadata, or None if not cached.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest, status, etag, last_modified, fetched_at "
+                "FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE responses SET accessed_at = ? "
+                                  "WHERE url = ?", (time(), url))
+        return dict(zip(["digest", "status", "etag", "last_modified",
+                         "fetched_at"], row))
+
+    def is_fresh(self, entry, max_age=None):
+        """
+        Check whether a cached response can be used without revalidation.
+        :param entry: dict, the cached response metadata.
+        :param max_age: float, seconds, overrides the cache TTL if given.
+        :return: bool
+        """
+        max_age = self.ttl if max_age is None else max_age
+        return self.offline or time() - entry["fetched_at"] < max_age
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        Get the request headers that revalidate a cached response.
+        :param entry: dict, the cached response metadata, or None.
+        :return: dict of request headers.
+        """
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def read_text(self, entry):
+        """
+        Read the body of a cached response.
+        :param entry: dict, the cached response metadata.
+        :return: str, the body, or None if the object has been evicted or
+                 is corrupt.
+        """
+        try:
+            with open(self._object_path(entry["digest"]), "rb") as f:
+                return gzip.decompress(f.read()).decode("utf-8")
+        except (OSError, EOFError, zlib.error, UnicodeDecodeError):
+            return None
+
+    def revalidated(self, url):
+        """
+        Mark a cached response as fresh after a 304 Not Modified.
+        :param url: str, the requested URL.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE responses SET fetched_at = ? WHERE url = ?",
+                              (time(), url))
+
+    def forget(self, url):
+        """
+        Remove the cached response of a URL whose body is missing or
+        corrupt. The body is deleted even if other responses share it, so
+        storing the same content again rewrites it, and those responses are
+        forgotten in turn when they are next read.
+        :param url: str, the requested URL.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT digest, size FROM responses WHERE url = ?",
+                                    (url,)).fetchone()
+            if row is None:
+                return
+            self.conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self._release(*row)
+            try:
+                os.remove(self._object_path(row[0]))
+            except FileNotFoundError:
+                pass
+
+    def store(self, url, page):
+        """
+        Store a response, evicting old responses if the cache is too big.
+        :param url: str, the requested URL.
+        :param page: requests.Response, the response to store.
+        """
+        body = page.text.encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, "wb") as f:
+                f.write(gzip.compress(body))
+            os.replace(tmp, path)
+        now = time()
+        with self.lock, self.conn:
+            # Take the write lock before reading, so that no other process
+            # changes the responses or the total in between
+            self.conn.execute("BEGIN IMMEDIATE")
+            previous = self.conn.execute("SELECT digest, size FROM responses WHERE url = ?",
+                                         (url,)).fetchone()
+            if not self._referenced(digest):
+                self._add_bytes(len(body))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, digest, page.status_code, page.headers.get("ETag"),
+                 page.headers.get("Last-Modified"), len(body), now, now))
+            if previous is not None and previous[0] != digest:
+                self._release(*previous)
+            self._evict()
+
+    def total_bytes(self):
+        """
+        Get the total size of the distinct stored bodies.
+        :return: int, bytes before compression.
+        """
+        return self.conn.execute("SELECT bytes FROM totals WHERE name = 'bodies'").fetchone()[0]
+
+    def _add_bytes(self, size):
+        """
+        Add to the total size of the stored bodies.
+        Must be called in a transaction, while holding the lock.
+        :param size: int, the bytes to add, negative to subtract.
+        """
+        self.conn.execute("UPDATE totals SET bytes = bytes + ? WHERE name = 'bodies'",
+                          (size,))
+
+    def _referenced(self, digest):
+        """
+        Check whether any cached response has the body.
+        Must be called while holding the lock.
+        :param digest: str, the SHA-256 hex digest of the body.
+        :return: bool
+        """
+        return self.conn.execute("SELECT 1 FROM responses WHERE digest = ?",
+                                 (digest,)).fetchone() is not None
+
+    def _release(self, digest, size):
+        """
+        Delete a body once no cached response refers to it.
+        Must be called in a transaction, while holding the lock.
+        :param digest: str, the SHA-256 hex digest of the body.
+        :param size: int, the size of the body before compression.
+        """
+        if self._referenced(digest):
+            return
+        self._add_bytes(-size)
+        try:
+            os.remove(self._object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """
+        Remove the least recently used responses until the cache fits
+        within max_bytes, deleting bodies that are no longer referenced.
+        Must be called in a transaction, while holding the lock.
+        """
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for url, digest, size in self.conn.execute(
+                "SELECT url, digest, size FROM responses ORDER BY accessed_at"):
+            evicted.append((url, digest, size))
+            excess -= size
+            if excess <= 0:
+                break
+        self.conn.executemany("DELETE FROM responses WHERE url = ?",
+                              [(url,) for url, _, _ in evicted])
+        for digest, size in {(digest, size) for _, digest, size in evicted}:
+            self._release(digest, size)
+
+    def _object_path(self, digest):
+        """
+        Get the path of a stored body.
+        :param digest: str, the SHA-256 hex digest of the body.
+        :return: str, the path.
+        """
+        return os.path.join(self.directory, "objects", digest[:2], digest[2:])
+
+    def close(self):
+        """
+        Close the index database.
+        """
+        self.conn.close()
@@ -0,0 +1,152 @@
+"""
+Persistent index of job posting URLs that have already been scraped.
+The scraper checks the index before fetching a job description page, so
+daily updates do not pay to fetch listings that are already stored.
+"""
+
+from .utils import import_data
+import hashlib
+import sqlite3
+from math import ceil, log
+from sys import argv
+
+
+class BloomFilter:
+    """
+    An in-memory Bloom filter of strings.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        Instantiate an empty filter.
+        :param capacity: int, the number of items the filter is sized for.
+        :param error_rate: float, the false positive rate at capacity.
+        """
+        capacity = max(1, capacity)
+        self.n_bits = int(ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * log(2))))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, item):
+        """
+        Get the bit positions of an item using double hashing.
+        :param item: str, the item.
+        :return: generator of int, the bit positions.
+        """
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.n_bits for i in range(self.n_hashes))
+
+    def add(self, item):
+        """
+        Add an item to the filter.
+        :param item: str, the item.
+        """
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+
+class SeenURLIndex:
+    """
+    A set of URLs persisted in SQLite, optionally fronted by a Bloom filter.
+    The SQLite file can be shared by several runs and worker processes.
+    """
+    def __init__(self, path, use_bloom=True, error_rate=0.001):
+        """
+        Open the index, creating it if necessary.
+        :param path: str, the SQLite database file.
+        :param use_bloom: bool, answer most misses from an in-memory Bloom
+                          filter without querying the database. URLs added by
+                          other processes after opening are not in the filter.
+        :param error_rate: float, the Bloom filter false positive rate.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen "
+                          "(url TEXT PRIMARY KEY) WITHOUT ROWID")
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.bloom = None
+        if use_bloom:
+            self._build_bloom(error_rate)
+
+    def _build_bloom(self, error_rate):
+        """
+        Load every URL in the database into a new Bloom filter.
+        :param error_rate: float, the Bloom filter false positive rate.
+        """
+        n_urls = len(self)
+        # Leave headroom so the filter stays accurate as the index grows
+        self.bloom = BloomFilter(2 * n_urls + 100000, error_rate)
+        for (url,) in self.conn.execute("SELECT url FROM seen"):
+            self.bloom.add(url)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def __contains__(self, url):
+        """
+        Check whether a URL has been seen, counting hits and misses.
+        :param url: str, the job posting URL.
+        :return: bool
+        """
+        if self.bloom is not None and url not in self.bloom:
+            seen = False
+        else:
+            seen = self.conn.execute("SELECT 1 FROM seen WHERE url = ?",
+                                     (url,)).fetchone() is not None
+        if seen:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return seen
+
+    def add_many(self, urls):
+        """
+        Mark URLs as seen.
+        :param urls: iterable of str, the job posting URLs.
+        """
+        urls = list(urls)
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO seen (url) VALUES (?)",
+                                  ((url,) for url in urls))
+        if self.bloom is not None:
+            for url in urls:
+                self.bloom.add(url)
+
+    def stats(self):
+        """
+        Get the hit and miss counts since the index was opened.
+        Every hit is a job description page that did not need to be fetched.
+        :return: dict
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    """
+    Code that runs if called from the command line
+    To seed an index with the URLs in the existing data file:
+    Call: python -m src.seen_index <index_file> <s3_bucket> <filename>
+    """
+    if len(argv) == 4:
+        index = SeenURLIndex(argv[1], use_bloom=False)
+        df = import_data(argv[2], argv[3])
+        # Listings without a description are left to be fetched again
+        index.add_many(df.loc[df["job_description"] != "N/A", "url"].dropna())
+        print("Index contains {} URLs".format(len(index)))
+        index.close()
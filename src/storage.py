@@ -0,0 +1,363 @@
+"""
+Append-only, partitioned storage for scraped listings.
+New listings are written as small, immutable part files under
+<prefix>/city_term=<city>/search_term=<query>/date=<yyyy-mm-dd>/, and a
+compaction step merges the parts of each partition into a single file.
+"""
+
+import pandas as pd
+import boto3
+import gzip
+import os
+import uuid
+from datetime import date, datetime
+from io import BytesIO
+from sys import argv
+
+FORMATS = {"jsonl": ".jsonl.gz", "parquet": ".parquet"}
+
+
+class LocalBackend:
+    """
+    Stores objects as files under a root directory on the local filesystem.
+    """
+    def __init__(self, root):
+        """
+        Instantiate the backend.
+        :param root: str, the directory to store objects in.
+        """
+        self.root = root
+
+    def write_bytes(self, key, data):
+        """
+        Write an object. The file appears atomically once it is complete.
+        :param key: str, the key of the object.
+        :param data: bytes, the contents of the object.
+        """
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def read_bytes(self, key):
+        """
+        Read an object.
+        :param key: str, the key of the object.
+        :return: bytes, the contents of the object.
+        """
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+    def list(self, prefix=""):
+        """
+        List the keys of every object that starts with the prefix.
+        :param prefix: str, the key prefix.
+        :return: list of str, the sorted keys.
+        """
+        keys = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, name), self.root)
+                key = key.replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def delete(self, key):
+        """
+        Delete an object.
+        :param key: str, the key of the object.
+        """
+        os.remove(os.path.join(self.root, key))
+
+
+class S3Backend:
+    """
+    Stores objects in an AWS S3 bucket, or in any S3-compatible store
+    (eg MinIO) when given an endpoint URL.
+    Requires AWS keys to be stored in your bash profile.
+    """
+    def __init__(self, bucket, prefix="", endpoint_url=None):
+        """
+        Instantiate the backend.
+        :param bucket: str, name of the s3 bucket.
+        :param prefix: str, prefix added to every key.
+        :param endpoint_url: str, URL of an S3-compatible service, if applicable.
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self._client = None
+
+    @property
+    def client(self):
+        """
+        The boto3 client, created on first use so the backend can be pickled
+        and sent to worker processes.
+        """
+        if self._client is None:
+            self._client = boto3.client(
+                "s3", endpoint_url=self.endpoint_url,
+                aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
+                aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"])
+        return self._client
+
+    def __getstate__(self):
+        """
+        Drop the boto3 client when pickling.
+        """
+        state = self.__dict__.copy()
+        state["_client"] = None
+        return state
+
+    def write_bytes(self, key, data):
+        """
+        Write an object.
+        :param key: str, the key of the object.
+        :param data: bytes, the contents of the object.
+        """
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def read_bytes(self, key):
+        """
+        Read an object.
+        :param key: str, the key of the object.
+        :return: bytes, the contents of the object.
+        """
+        obj = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        return obj["Body"].read()
+
+    def list(self, prefix=""):
+        """
+        List the keys of every object that starts with the prefix.
+        :param prefix: str, the key prefix.
+        :return: list of str, the sorted keys.
+        """
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            keys += [obj["Key"][len(self.prefix):] for obj in page.get("Contents", [])]
+        return sorted(keys)
+
+    def delete(self, key):
+        """
+        Delete an object.
+        :param key: str, the key of the object.
+        """
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+
+class ListingStore:
+    """
+    Append-only store of scraped listings, partitioned by city_term,
+    search_term and scrape date.
+    """
+    def __init__(self, backend, prefix="listings", fmt="jsonl"):
+        """
+        Instantiate the store.
+        :param backend: LocalBackend or S3Backend, where part files are kept.
+        :param prefix: str, the key prefix of the store.
+        :param fmt: str, "jsonl" (gzip compressed JSON lines) or "parquet".
+                    Parquet requires pyarrow to be installed.
+        """
+        if fmt not in FORMATS:
+            raise ValueError("fmt must be one of {}".format(sorted(FORMATS)))
+        self.backend = backend
+        self.prefix = prefix
+        self.fmt = fmt
+
+    def append(self, df, day=None):
+        """
+        Write new listings as one immutable part file per partition.
+        :param df: Pandas DataFrame of listings, with city_term and
+                   search_term columns.
+        :param day: datetime.date, the date partition. Defaults to today.
+        :return: list of str, the keys of the part files written.
+        """
+        day = date.today() if day is None else day
+        keys = []
+        if len(df) == 0:
+            return keys
+        for (city, query), part in df.groupby(["city_term", "search_term"]):
+            key = "/".join([self._partition(city, query, day),
+                            self._part_name()])
+            self.backend.write_bytes(key, self._serialize(part))
+            keys.append(key)
+        return keys
+
+    def read(self, city_term=None, search_term=None, columns=None, dedupe=True):
+        """
+        Read listings from the store into a DataFrame.
+        :param city_term: str, only read this city, if applicable.
+        :param search_term: str, only read this query, if applicable.
+        :param columns: list of str, the columns to read, if applicable.
+        :param dedupe: bool, remove listings with duplicate URLs, keeping
+                       the most recently written one.
+        :return: Pandas DataFrame of listings.
+        """
+        frames = list(self.iter_parts(city_term, search_term, columns))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True)
+        if dedupe and "url" in df.columns:
+            # Parts are read in the order they were written, so a listing
+            # that was fetched again replaces the earlier one
+            df = df.drop_duplicates(["url"], keep="last")
+        return df
+
+    def urls(self, city_term=None, search_term=None, described=False):
+        """
+        Get the URLs of the listings in the store.
+        :param city_term: str, only read this city, if applicable.
+        :param search_term: str, only read this query, if applicable.
+        :param described: bool, only get the URLs of listings whose
+                          description was fetched, not "N/A".
+        :return: set of str, the URLs.
+        """
+        if not described:
+            return set(self.read(city_term, search_term, columns=["url"],
+                                 dedupe=False)["url"])
+        df = self.read(city_term, search_term, columns=["url", "job_description"])
+        return set(df.loc[df["job_description"] != "N/A", "url"])
+
+    def iter_parts(self, city_term=None, search_term=None, columns=None,
+                   since=None):
+        """
+        Read the listings in the store one part file at a time.
+        :param city_term: str, only read this city, if applicable.
+        :param search_term: str, only read this query, if applicable.
+        :param columns: list of str, the columns to read, if applicable.
+        :param since: datetime.date, only read partitions from this date on.
+        :return: generator of Pandas DataFrames, one per part file.
+        """
+        for key in self.parts(city_term, search_term, since):
+            yield self._deserialize(self.backend.read_bytes(key), columns)
+
+    def parts(self, city_term=None, search_term=None, since=None):
+        """
+        List the part files in the store.
+        :param city_term: str, only list this city, if applicable.
+        :param search_term: str, only list this query, if applicable.
+        :param since: datetime.date, only list partitions from this date on.
+        :return: list of str, the keys of the part files.
+        """
+        prefix = self.prefix + "/"
+        if city_term is not None:
+            prefix += "city_term={}/".format(self._clean(city_term))
+            if search_term is not None:
+                prefix += "search_term={}/".format(self._clean(search_term))
+        keys = self.backend.list(prefix)
+        if city_term is None and search_term is not None:
+            match = "/search_term={}/".format(self._clean(search_term))
+            keys = [key for key in keys if match in key]
+        if since is not None:
+            keys = [key for key in keys
+                    if key.split("/date=", 1)[1][:10] >= since.isoformat()]
+        return [key for key in keys if key.endswith(FORMATS[self.fmt])]
+
+    def compact(self):
+        """
+        Merge the part files of every partition into a single deduplicated
+        part. The merged part is written before the old parts are deleted,
+        so an interrupted compaction never loses data.
+        :return: int, the number of part files removed.
+        """
+        partitions = {}
+        for key in self.parts():
+            partitions.setdefault(key.rsplit("/", 1)[0], []).append(key)
+        removed = 0
+        for partition, keys in partitions.items():
+            if len(keys) < 2:
+                continue
+            df = pd.concat([self._deserialize(self.backend.read_bytes(key))
+                            for key in keys], ignore_index=True)
+            df = df.drop_duplicates(["url"], keep="last")
+            self.backend.write_bytes("/".join([partition, self._part_name()]),
+                                     self._serialize(df))
+            for key in keys:
+                self.backend.delete(key)
+            removed += len(keys) - 1
+        return removed
+
+    def _partition(self, city, query, day):
+        """
+        Get the key prefix of a partition.
+        :param city: str, the city_term of the partition.
+        :param query: str, the search_term of the partition.
+        :param day: datetime.date, the date of the partition.
+        :return: str, the partition prefix.
+        """
+        return "{}/city_term={}/search_term={}/date={}".format(
+            self.prefix, self._clean(city), self._clean(query), day.isoformat())
+
+    @staticmethod
+    def _clean(value):
+        """
+        Make a partition value safe to use in a key.
+        :param value: str, the partition value.
+        :return: str, the cleaned value.
+        """
+        return str(value).replace("/", "_")
+
+    def _part_name(self):
+        """
+        Create a unique, time ordered name for a new part file.
+        :return: str, the file name.
+        """
+        return "part-{}-{}{}".format(datetime.now().strftime("%Y%m%d%H%M%S%f"),
+                                     uuid.uuid4().hex[:8], FORMATS[self.fmt])
+
+    def _serialize(self, df):
+        """
+        Serialize a DataFrame into the bytes of a part file.
+        :param df: Pandas DataFrame
+        :return: bytes
+        """
+        if self.fmt == "parquet":
+            buffer = BytesIO()
+            df.to_parquet(buffer, index=False)
+            return buffer.getvalue()
+        text = df.to_json(orient="records", lines=True)
+        return gzip.compress(text.encode("utf-8"))
+
+    def _deserialize(self, data, columns=None):
+        """
+        Deserialize the bytes of a part file into a DataFrame.
+        :param data: bytes
+        :param columns: list of str, the columns to keep, if applicable.
+        :return: Pandas DataFrame
+        """
+        if self.fmt == "parquet":
+            return pd.read_parquet(BytesIO(data), columns=columns)
+        df = pd.read_json(BytesIO(gzip.decompress(data)), orient="records",
+                          lines=True, dtype=False)
+        return df if columns is None else df[columns]
+
+
+def open_store(location, fmt="jsonl"):
+    """
+    Open a listing store from a location string.
+    :param location: str, either s3://bucket/prefix or a local directory.
+    :param fmt: str, the part file format.
+    :return: ListingStore
+    """
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://"):].partition("/")
+        return ListingStore(S3Backend(bucket), prefix=prefix.strip("/") or "listings",
+                            fmt=fmt)
+    return ListingStore(LocalBackend(location), fmt=fmt)
+
+
+if __name__ == "__main__":
+    """
+    Code that runs if called from the command line
+    To compact a store:
+    Call: python -m src.storage compact <s3://bucket/prefix or directory>
+    """
+    if len(argv) == 3 and argv[1] == "compact":
+        n_removed = open_store(argv[2]).compact()
+        print("Compacted {} part files".format(n_removed))
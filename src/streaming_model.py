@@ -0,0 +1,265 @@
+"""
+Streaming (out-of-core) model training.
+Listings are read and featurized in chunks with a stateless hashing
+vectorizer, and the model is trained incrementally with partial_fit, so
+memory does not grow with the corpus and new data can be folded into an
+existing model without reprocessing the history.
+"""
+
+from .nlp_processing import NLPProcessing
+from .dataframe_processing import create_model_data, iter_model_data
+from .storage import open_store
+from .utils import pickle_model
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.preprocessing import normalize
+from datetime import date
+import argparse
+import pickle
+import numpy as np
+
+
+class OnlineTfidfVectorizer:
+    """
+    Hashes documents into a fixed number of features, and optionally weights
+    them by inverse document frequencies that are updated as documents are
+    seen. Unlike TfidfVectorizer, there is no vocabulary to fit, so
+    documents can be vectorized one chunk at a time.
+    """
+    def __init__(self, n_features=2 ** 20, n_grams=(1, 1), use_idf=True,
+                 norm="l2"):
+        """
+        Instantiate the vectorizer.
+        :param n_features: int, the number of hashed features.
+        :param n_grams: tuple, the minimum and maximum n-gram sizes.
+        :param use_idf: bool, weight term counts by inverse document frequency.
+        :param norm: str, "l1", "l2" or None, the row normalization.
+        """
+        self.hasher = HashingVectorizer(n_features=n_features, ngram_range=n_grams,
+                                        alternate_sign=False, norm=None)
+        self.use_idf = use_idf
+        self.norm = norm
+        self.n_docs = 0
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+
+    def partial_fit(self, docs):
+        """
+        Update the document frequencies with a chunk of documents.
+        :param docs: list or ndarray of str, the documents.
+        :return: self
+        """
+        self._update(self.hasher.transform(docs))
+        return self
+
+    def partial_fit_transform(self, docs):
+        """
+        Update the document frequencies with a chunk of documents, and
+        vectorize them.
+        :param docs: list or ndarray of str, the documents.
+        :return: scipy sparse matrix
+        """
+        counts = self.hasher.transform(docs)
+        self._update(counts)
+        return self._weight(counts)
+
+    def transform(self, docs):
+        """
+        Vectorize documents with the current document frequencies.
+        :param docs: list or ndarray of str, the documents.
+        :return: scipy sparse matrix
+        """
+        return self._weight(self.hasher.transform(docs))
+
+    def idf(self):
+        """
+        Get the smoothed inverse document frequency of each feature, as
+        calculated by TfidfVectorizer.
+        :return: ndarray of float
+        """
+        return np.log((1 + self.n_docs) / (1 + self.doc_freq)) + 1
+
+    def _update(self, counts):
+        """
+        Count the documents that contain each feature.
+        :param counts: scipy sparse matrix, the hashed term counts.
+        """
+        self.n_docs += counts.shape[0]
+        self.doc_freq += np.bincount(counts.indices, minlength=len(self.doc_freq))
+
+    def _weight(self, counts):
+        """
+        Weight and normalize hashed term counts.
+        :param counts: scipy sparse matrix, the hashed term counts.
+        :return: scipy sparse matrix
+        """
+        x = counts.astype(np.float64)
+        if self.use_idf:
+            x.data *= self.idf()[x.indices]
+        return x if self.norm is None else normalize(x, norm=self.norm)
+
+
+class StreamingJHPModel:
+    """
+    A city prediction model that is trained one chunk of listings at a time.
+    Like JHPModel, it has processing and model attributes, so it can be used
+    by the web app in the same way.
+    """
+    def __init__(self, model=None, stemlem="", num_cities=2, n_grams=(1, 1),
+                 use_stopwords=True, n_features=2 ** 20, use_idf=True,
+                 chunksize=10000):
+        """
+        Instantiate the model.
+        :param model: an instantiated SK-Learn model with a partial_fit
+                      method. Defaults to MultinomialNB.
+        :param stemlem: str, the stemming/lemmatizing methods to use.
+        :param num_cities: int, number of classes to use.
+        :param n_grams: tuple, the minimum and maximum n-gram sizes.
+        :param use_stopwords: bool, remove stop words or not.
+        :param n_features: int, the number of hashed features.
+        :param use_idf: bool, weight features by online inverse document
+                        frequencies.
+        :param chunksize: int, the number of rows read at a time.
+        """
+        model = MultinomialNB() if model is None else model
+        if not hasattr(model, "partial_fit"):
+            raise ValueError("Streaming training requires a model with a "
+                             "partial_fit method")
+        self.processing = NLPProcessing(stemlem, num_cities=num_cities,
+                                        n_grams=n_grams, use_stopwords=use_stopwords)
+        self.processing.vectorize = OnlineTfidfVectorizer(n_features, n_grams,
+                                                          use_idf)
+        self.model = model
+        self.classes = num_cities
+        self.chunksize = chunksize
+        self.n_trained = 0
+        # The 64-bit hashes of the descriptions trained on, so that data
+        # that is read again is not trained on twice
+        self.seen = set()
+
+    def partial_fit(self, data):
+        """
+        Train the model on one chunk of scraped listings. Descriptions that
+        the model was already trained on are skipped.
+        :param data: Pandas DataFrame containing data.
+        :return: int, the number of listings trained on.
+        """
+        return self._train(create_model_data(data, num_cities=self.classes,
+                                             seen=self._seen()))
+
+    def _train(self, df):
+        """
+        Train the model on one chunk of processed listings.
+        :param df: Pandas DataFrame returned by create_model_data.
+        :return: int, the number of listings trained on.
+        """
+        if len(df) == 0:
+            return 0
+        docs = self.processing._preprocess(df["job_description"])
+        features = self.processing.vectorize.partial_fit_transform(docs)
+        self.model.partial_fit(features, df["label"].values,
+                               classes=np.arange(self.classes))
+        self.n_trained += len(df)
+        return len(df)
+
+    def fit(self, data=None, bucket=None, filename=None, store=None, since=None):
+        """
+        Train the model on every chunk of listings. Duplicate descriptions
+        are removed across chunks. Calling fit again updates the model
+        rather than starting again, and only trains on the descriptions it
+        has not seen, so the whole data file can be read again.
+        :param data: Pandas DataFrame containing data.
+        :param bucket: str S3 bucket of data if applicable, or None to read
+                       a local file.
+        :param filename: str, name of the data file, if applicable.
+        :param store: ListingStore to read listings from, if applicable.
+        :param since: datetime.date, only read store partitions from this
+                      date on, eg to train on a new daily scrape.
+        :return: self
+        """
+        if data is not None:
+            self.partial_fit(data)
+            return self
+        for df in iter_model_data(bucket, filename, store, self.classes,
+                                  self.chunksize, since, self._seen()):
+            self._train(df)
+        return self
+
+    def _seen(self):
+        """
+        Get the hashes of the descriptions the model was trained on.
+        :return: set of int
+        """
+        # Models pickled before the hashes were kept have no attribute, and
+        # their history cannot be told apart from new data
+        if getattr(self, "seen", None) is None:
+            self.seen = set()
+        return self.seen
+
+    def predict(self, testing):
+        """
+        Make a prediction about testing data.
+        :param testing: str, list or Pandas DataFrame, the documents to predict
+        :return: ndarray, the predicted labels
+        """
+        return self.model.predict(self._transform(testing))
+
+    def predict_proba(self, testing):
+        """
+        Get the probability of each city for the testing data.
+        :param testing: str, list or Pandas DataFrame, the documents to predict
+        :return: ndarray, the probability of each class for each document
+        """
+        return self.model.predict_proba(self._transform(testing))
+
+    def _transform(self, testing):
+        """
+        Clean, stem/lemmatize and vectorize documents.
+        :param testing: str, list or Pandas DataFrame, the documents.
+        :return: scipy sparse matrix
+        """
+        return self.processing.transform(testing)
+
+
+if __name__ == "__main__":
+    """
+    Code that runs if called from the command line
+    Call: python -m src.streaming_model train <model.pkl> <s3_bucket> <filename> [options]
+    Call: python -m src.streaming_model update <model.pkl> <s3_bucket> <filename> [options]
+    train creates a new model, update folds new data into a saved model.
+    Use "local" as the bucket to read a local csv file.
+    Use --store <s3://bucket/prefix or directory> to read a listing store
+    instead (bucket and filename are then ignored), and --since <YYYY-MM-DD>
+    to only read the partitions scraped from that date on.
+    """
+    parser = argparse.ArgumentParser(description="Streaming model training.")
+    parser.add_argument("command", choices=["train", "update"])
+    parser.add_argument("model")
+    parser.add_argument("bucket", nargs="?", default="local")
+    parser.add_argument("filename", nargs="?", default=None)
+    parser.add_argument("--store", default=None)
+    parser.add_argument("--since", default=None)
+    parser.add_argument("--stemlem", default="")
+    parser.add_argument("--num-cities", type=int, default=2)
+    parser.add_argument("--n-features", type=int, default=2 ** 20)
+    parser.add_argument("--no-idf", action="store_true")
+    parser.add_argument("--chunksize", type=int, default=10000)
+    args = parser.parse_args()
+
+    # Use the class from the package, not __main__, so the model can be
+    # unpickled elsewhere
+    from .streaming_model import StreamingJHPModel
+    if args.command == "train":
+        jhp = StreamingJHPModel(stemlem=args.stemlem, num_cities=args.num_cities,
+                                n_features=args.n_features, use_idf=not args.no_idf,
+                                chunksize=args.chunksize)
+    else:
+        with open(args.model, "rb") as f:
+            jhp = pickle.load(f)
+    n_before = jhp.n_trained
+    jhp.fit(bucket=None if args.bucket == "local" else args.bucket,
+            filename=args.filename,
+            store=None if args.store is None else open_store(args.store),
+            since=None if args.since is None else date.fromisoformat(args.since))
+    pickle_model(jhp, args.model)
+    print("Trained on {} new listings ({} in total)".format(
+        jhp.n_trained - n_before, jhp.n_trained))
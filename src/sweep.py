@@ -0,0 +1,292 @@
+"""
+Scheduler that runs the full city x query scrape in parallel.
+Each (city, query) pair is placed on a shared queue that is drained by a pool
+of worker processes. Every task writes its own local output shard, and the
+shards are merged and deduplicated by URL once all tasks are complete.
+"""
+
+from .web_scraper import IndeedScraper, BASE_URL
+from .utils import import_data, export_data
+from .storage import open_store
+from .seen_index import SeenURLIndex
+from .fetch_engine import FetchEngine
+from .response_cache import ResponseCache
+import multiprocessing as mp
+from queue import Empty
+from time import time
+import argparse
+import glob
+import json
+import os
+import pandas as pd
+
+CITIES = ["Austin", "Chicago", "San+Francisco", "New+York"]
+QUERIES = ["Data+Scientist", "Data+Analyst", "Business+Intelligence"]
+
+
+class SweepScheduler:
+    """
+    Runs an IndeedScraper for every city and query with a pool of workers.
+    """
+    def __init__(self, bucket, filename, cities=None, queries=None,
+                 n_workers=4, shard_dir="sweep_shards", daily=False,
+                 concurrency=1, resume=False, base_url=BASE_URL, store=None,
+                 seen_index=None, cache_dir=None, offline=False):
+        """
+        Instantiate the sweep.
+        :param bucket: str, AWS S3 bucket where the merged data is stored.
+                       If None, the merged data is stored in a local file.
+        :param filename: str, filename of the merged data.
+        :param cities: list of str, the cities to search.
+        :param queries: list of str, the job search terms.
+        :param n_workers: int, the number of worker processes.
+        :param shard_dir: str, local directory for shards and the checkpoint.
+        :param daily: bool, indicates full scrape or daily update.
+        :param concurrency: int, description pages fetched at once per worker.
+        :param resume: bool, skip tasks completed by a previous, crashed sweep.
+        :param base_url: str, the scheme and host of the site to scrape.
+        :param store: ListingStore, if given, workers append to the store
+                      instead of writing shards, and merging compacts it.
+        :param seen_index: str, path of a SeenURLIndex shared by the workers,
+                           if applicable.
+        :param cache_dir: str, directory of a ResponseCache shared by the
+                          workers, if applicable.
+        :param offline: bool, replay responses from the cache without making
+                        any requests.
+        """
+        self.bucket = bucket
+        self.filename = filename
+        self.cities = CITIES if cities is None else cities
+        self.queries = QUERIES if queries is None else queries
+        self.n_workers = n_workers
+        self.shard_dir = shard_dir
+        self.daily = daily
+        self.concurrency = concurrency
+        self.resume = resume
+        self.base_url = base_url
+        self.store = store
+        self.seen_index = seen_index
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.checkpoint = os.path.join(shard_dir, "checkpoint.jsonl")
+
+    def run(self):
+        """
+        Scrape every remaining task, then merge the shards.
+        :return: Pandas DataFrame, the merged data.
+        """
+        os.makedirs(self.shard_dir, exist_ok=True)
+        if not self.resume:
+            self._clear_shards()
+        done = self._read_checkpoint()
+        tasks = [(city, query) for city in self.cities for query in self.queries
+                 if (city, query) not in done]
+        print("Sweep: {} tasks, {} already complete".format(len(tasks), len(done)))
+        if tasks:
+            self._run_tasks(tasks)
+        return self.merge()
+
+    def _run_tasks(self, tasks):
+        """
+        Put the tasks on a queue and drain it with the worker processes.
+        :param tasks: list of (city, query) tuples.
+        """
+        task_queue = mp.Queue()
+        done_queue = mp.Queue()
+        for task in tasks:
+            task_queue.put(task)
+        n_workers = min(self.n_workers, len(tasks))
+        for _ in range(n_workers):
+            task_queue.put(None)
+        workers = [mp.Process(target=_sweep_worker,
+                              args=(task_queue, done_queue, self.shard_dir,
+                                    self.daily, self.concurrency,
+                                    self.base_url, self.store,
+                                    self.seen_index, self.cache_dir,
+                                    self.offline))
+                   for _ in range(n_workers)]
+        for worker in workers:
+            worker.start()
+
+        start = time()
+        finished = 0
+        while finished < len(tasks):
+            try:
+                result = done_queue.get(timeout=5)
+            except Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    print("Sweep: all workers exited with {} tasks unfinished. "
+                          "Rerun with resume to continue."
+                          .format(len(tasks) - finished))
+                    break
+                continue
+            finished += 1
+            if result["error"] is None:
+                self._write_checkpoint(result)
+            self._report_progress(result, finished, len(tasks), time() - start)
+        for worker in workers:
+            worker.join()
+
+    @staticmethod
+    def _report_progress(result, finished, total, elapsed):
+        """
+        Print the progress of the sweep and the estimated time remaining.
+        :param result: dict, the result of the task that just finished.
+        :param finished: int, the number of tasks finished so far.
+        :param total: int, the number of tasks in this run.
+        :param elapsed: float, seconds since the tasks were started.
+        """
+        eta = elapsed / finished * (total - finished)
+        if result["error"] is None:
+            status = "{} listings in {:.0f}s, {} fetches skipped".format(
+                result["rows"], result["seconds"], result["skipped"])
+        else:
+            status = "FAILED ({})".format(result["error"])
+        print("[{}/{}] {} / {}: {} | elapsed {:.0f}s | ETA {:.0f}s"
+              .format(finished, total, result["city"], result["query"],
+                      status, elapsed, eta))
+
+    def _read_checkpoint(self):
+        """
+        Read the tasks that have already been completed.
+        :return: set of (city, query) tuples.
+        """
+        if not os.path.exists(self.checkpoint):
+            return set()
+        with open(self.checkpoint) as f:
+            return {(r["city"], r["query"]) for r in map(json.loads, f)}
+
+    def _write_checkpoint(self, result):
+        """
+        Record a completed task in the checkpoint file.
+        :param result: dict, the result of the completed task.
+        """
+        with open(self.checkpoint, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+    def _clear_shards(self):
+        """
+        Remove the shards and checkpoint of any previous sweep.
+        """
+        for path in glob.glob(os.path.join(self.shard_dir, "*.csv")):
+            os.remove(path)
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def merge(self):
+        """
+        Merge the shards with the existing data, remove duplicate URLs, and
+        save the result. The existing data is only downloaded once.
+        If the sweep uses a store, the store is compacted instead.
+        :return: Pandas DataFrame, the merged data.
+        """
+        if self.store is not None:
+            n_removed = self.store.compact()
+            print("Sweep: compacted {} part files".format(n_removed))
+            return import_data(store=self.store)
+        frames = [self._load_existing()]
+        frames += [pd.read_csv(path) for path in
+                   sorted(glob.glob(os.path.join(self.shard_dir, "*.csv")))]
+        df = pd.concat(frames, ignore_index=True)
+        # The shards are newer than the existing data, so listings fetched
+        # again replace their earlier rows
+        df = df.drop_duplicates(["url"], keep="last")
+        export_data(df, self.bucket, self.filename)
+        print("Sweep: merged {} listings into {}".format(len(df), self.filename))
+        return df
+
+    def _load_existing(self):
+        """
+        Load the existing merged data, if there is any.
+        :return: Pandas DataFrame
+        """
+        try:
+            if self.bucket is None:
+                return pd.read_csv(self.filename)
+            return import_data(self.bucket, self.filename)
+        except Exception:
+            return IndeedScraper._create_df_new()
+
+
+def shard_path(shard_dir, city, query):
+    """
+    Get the local path of the output shard for a task.
+    :param shard_dir: str, the directory that holds the shards.
+    :param city: str, the city of the task.
+    :param query: str, the job search term of the task.
+    :return: str, the shard path.
+    """
+    return os.path.join(shard_dir, "{}__{}.csv".format(city, query))
+
+
+def _sweep_worker(task_queue, done_queue, shard_dir, daily, concurrency,
+                  base_url, store, seen_index, cache_dir, offline):
+    """
+    Worker process that scrapes tasks from the queue until it is empty.
+    :param task_queue: multiprocessing Queue of (city, query) tuples, with
+                       None marking the end of the work.
+    :param done_queue: multiprocessing Queue for task results.
+    :param shard_dir: str, the directory that holds the shards.
+    :param daily: bool, indicates full scrape or daily update.
+    :param concurrency: int, description pages fetched at once.
+    :param base_url: str, the scheme and host of the site to scrape.
+    :param store: ListingStore to append to instead of a shard, or None.
+    :param seen_index: str, path of the shared SeenURLIndex, or None.
+    :param cache_dir: str, directory of the shared ResponseCache, or None.
+    :param offline: bool, replay responses from the cache only.
+    """
+    index = None if seen_index is None else SeenURLIndex(seen_index)
+    cache = None if cache_dir is None else ResponseCache(cache_dir, offline=offline)
+    fetcher = FetchEngine(max_workers=concurrency, cache=cache)
+    for city, query in iter(task_queue.get, None):
+        start = time()
+        hits = 0 if index is None else index.hits
+        result = {"city": city, "query": query, "rows": 0, "error": None}
+        try:
+            scraper = IndeedScraper(None, shard_path(shard_dir, city, query),
+                                    query, city, daily, concurrency,
+                                    fetcher=fetcher, base_url=base_url,
+                                    store=store, seen_index=index)
+            scraper.run_scraper()
+            result["rows"] = scraper.n_saved
+        except Exception as e:
+            result["error"] = repr(e)
+        result["seconds"] = time() - start
+        result["skipped"] = 0 if index is None else index.hits - hits
+        done_queue.put(result)
+    fetcher.close()
+    if index is not None:
+        index.close()
+    if cache is not None:
+        cache.close()
+
+
+if __name__ == "__main__":
+    """
+    Code that runs if called from the command line
+    Call: python -m src.sweep <s3_bucket> <filename> [options]
+    Use "local" as the bucket to merge into a local file instead.
+    Use --store <s3://bucket/prefix or directory> to append to a listing store.
+    Use --seen-index <file> to skip listings that have been scraped before.
+    Use --cache-dir <directory> to cache responses, and --offline to replay them.
+    """
+    parser = argparse.ArgumentParser(description="Parallel Indeed scrape.")
+    parser.add_argument("bucket")
+    parser.add_argument("filename")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--shard-dir", default="sweep_shards")
+    parser.add_argument("--daily", action="store_true")
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--store", default=None)
+    parser.add_argument("--seen-index", default=None)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--offline", action="store_true")
+    args = parser.parse_args()
+    SweepScheduler(None if args.bucket == "local" else args.bucket,
+                   args.filename, n_workers=args.workers,
+                   shard_dir=args.shard_dir, daily=args.daily,
+                   concurrency=args.concurrency, resume=args.resume,
+                   store=None if args.store is None else open_store(args.store),
+                   seen_index=args.seen_index, cache_dir=args.cache_dir,
+                   offline=args.offline).run()
@@ -0,0 +1,198 @@
+"""
+Memoization of token level text normalization (stemming, lemmatizing and
+stop word removal). The vocabulary of a corpus is tiny compared to its
+number of tokens, so each distinct token only needs to be normalized once.
+"""
+
+import os
+import pickle
+from threading import Lock
+import pandas as pd
+
+# Marks a token that is not in a generation
+_MISSING = object()
+
+
+class TokenTable(dict):
+    """
+    Maps tokens to their normalized form for one normalization method,
+    computing the result the first time a token is seen.
+    Hits are plain dictionary lookups. The table is bounded with an
+    approximate LRU policy: tokens live in a young generation, and when it
+    fills up it becomes the old generation, replacing the previous one.
+    Tokens found in the old generation are promoted back to the young one,
+    so only tokens unused for a whole generation are evicted.
+    Tables are shared by every thread of the process, eg the web app's
+    request threads and the micro-batcher, so misses, which insert tokens
+    and roll the generations over, hold a lock.
+    """
+    def __init__(self, func, maxsize, saved=None):
+        """
+        Instantiate the table.
+        :param func: function that normalizes a token. It returns None if
+                     the token should be removed.
+        :param maxsize: int, the maximum number of tokens to keep.
+        :param saved: dict of previously normalized tokens, if applicable.
+        """
+        super().__init__()
+        self.func = func
+        self.capacity = max(1, maxsize // 2)
+        self.old = dict(saved) if saved else {}
+        self.lookups = 0
+        self.computed = 0
+        self.lock = Lock()
+
+    def __missing__(self, token):
+        with self.lock:
+            # Another thread may have added the token since the lookup missed
+            result = self.get(token, _MISSING)
+            if result is not _MISSING:
+                return result
+            result = self.old.get(token, _MISSING)
+            if result is _MISSING:
+                result = self.func(token)
+                self.computed += 1
+            if len(self) >= self.capacity:
+                self.old = dict(self)
+                self.clear()
+            self[token] = result
+            return result
+
+    def map_tokens(self, tokens):
+        """
+        Normalize a sequence of tokens.
+        :param tokens: list of str, the tokens.
+        :return: iterator of str or None, the normalized tokens.
+        """
+        self.lookups += len(tokens)
+        return map(self.__getitem__, tokens)
+
+    def entries(self):
+        """
+        Get every cached token.
+        :return: dict mapping tokens to their normalized form.
+        """
+        with self.lock:
+            entries = dict(self.old)
+            entries.update(self)
+        return entries
+
+
+class TokenCache:
+    """
+    A set of token tables, one per normalization method, that can be shared
+    between NLPProcessing objects and saved to disk.
+    """
+    def __init__(self, maxsize=500000):
+        """
+        Instantiate the cache.
+        :param maxsize: int, the maximum number of tokens kept per method.
+        """
+        self.maxsize = maxsize
+        self.tables = {}
+        self.saved = {}
+        self.lock = Lock()
+
+    def table(self, method, func):
+        """
+        Get the token table for a normalization method, creating it if
+        necessary.
+        :param method: str, a name that uniquely identifies the method.
+        :param func: function that normalizes a token, used on cache misses.
+        :return: TokenTable
+        """
+        table = self.tables.get(method)
+        if table is None:
+            with self.lock:
+                table = self.tables.get(method)
+                if table is None:
+                    table = TokenTable(func, self.maxsize, self.saved.pop(method, None))
+                    self.tables[method] = table
+        return table
+
+    def stats(self):
+        """
+        Get the hit rate of each normalization method.
+        :return: Pandas DataFrame with a row per method.
+        """
+        rows = []
+        for method, table in list(self.tables.items()):
+            hits = table.lookups - table.computed
+            rows.append({"method": method,
+                         "lookups": table.lookups,
+                         "hits": hits,
+                         "hit_rate": hits / table.lookups if table.lookups else 0.0,
+                         "tokens": len(table.entries())})
+        return pd.DataFrame(rows, columns=["method", "lookups", "hits",
+                                           "hit_rate", "tokens"])
+
+    def clear(self):
+        """
+        Remove every cached token.
+        """
+        self.tables = {}
+        self.saved = {}
+
+    def entries(self):
+        """
+        Get the cached tokens of every method.
+        :return: dict mapping each method to a dict of normalized tokens.
+        """
+        entries = dict(self.saved)
+        entries.update({method: table.entries()
+                        for method, table in list(self.tables.items())})
+        return entries
+
+    def __getstate__(self):
+        # The normalization functions are not picklable, so only the
+        # cached tokens are kept
+        return {"maxsize": self.maxsize, "tables": {}, "saved": self.entries()}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def save(self, path):
+        """
+        Save the cached tokens of every method to a pickle file.
+        :param path: str, the name of the pkl file to use.
+        """
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump({"maxsize": self.maxsize, "entries": self.entries()}, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, maxsize=None):
+        """
+        Load a cache saved with save.
+        :param path: str, the name of the pkl file.
+        :param maxsize: int, overrides the saved maximum size if given.
+        :return: TokenCache
+        """
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        cache = cls(state["maxsize"] if maxsize is None else maxsize)
+        cache.saved = state["entries"]
+        return cache
+
+
+_shared_cache = TokenCache()
+
+
+def get_token_cache():
+    """
+    Get the token cache shared by every NLPProcessing object in the
+    process that was not given its own cache.
+    :return: TokenCache
+    """
+    return _shared_cache
+
+
+def set_token_cache(cache):
+    """
+    Replace the shared token cache, eg with one loaded from disk.
+    :param cache: TokenCache
+    """
+    global _shared_cache
+    _shared_cache = cache
@@ -0,0 +1,442 @@
+"""
+Array-backed corpus of token ids.
+A corpus is an int32 array of token ids, an array of document offsets into
+it, and a table of the distinct token strings. Token level transformations
+(stemming, lemmatizing, stop word removal, SK-Learn tokenizing) run once
+per distinct token and are applied to every occurrence with NumPy indexing,
+and n-gram counts are built from the ids without rebuilding any strings.
+The arrays can be saved and memory-mapped.
+"""
+
+from itertools import chain
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# The number of documents split into tokens at a time, which bounds the
+# number of token strings alive at once
+TOKENIZE_BATCH = 500
+# The approximate number of tokens whose n-grams are counted at a time, which
+# bounds the temporary arrays of n-gram counting
+COUNT_CHUNK = 2 ** 18
+
+
+class TokenCorpus:
+    """
+    Documents stored as token ids into a string table.
+    """
+    def __init__(self, ids, offsets, tokens):
+        """
+        Instantiate the corpus.
+        :param ids: ndarray of int32, the token id of every token of every
+                    document, in order.
+        :param offsets: ndarray of int64, the position of the first token of
+                        each document, followed by the total number of tokens.
+        :param tokens: ndarray of str, the string of each token id.
+        """
+        self.ids = ids
+        self.offsets = offsets
+        self.tokens = tokens
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_texts(cls, texts, separator=" "):
+        """
+        Split documents into tokens.
+        :param texts: iterable of str, the documents.
+        :param separator: str, the token separator. Splitting on single spaces
+                          matches the stemming/lemmatizing of NLPProcessing.
+        :return: TokenCorpus
+        """
+        table = {}
+        ids, lengths = [], []
+        texts = iter(texts)
+        while True:
+            batch = [text.split(separator) for text in
+                     (next(texts, None) for _ in range(TOKENIZE_BATCH)) if text is not None]
+            if not batch:
+                break
+            codes, uniques = pd.factorize(list(chain.from_iterable(batch)))
+            # Map the batch's token ids to the ids of the whole corpus
+            batch_ids = np.fromiter((table.setdefault(token, len(table)) for token in uniques),
+                                    np.int32, len(uniques))
+            ids.append(batch_ids[codes] if len(codes) else np.empty(0, np.int32))
+            lengths.extend(len(tokens) for tokens in batch)
+            if len(batch) < TOKENIZE_BATCH:
+                break
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(np.concatenate(ids) if ids else np.empty(0, np.int32), offsets,
+                   np.array(list(table), dtype=object))
+
+    def subset(self, documents):
+        """
+        Select documents.
+        :param documents: ndarray of int or bool, the documents to select.
+        :return: TokenCorpus, sharing the string table.
+        """
+        lengths = np.diff(self.offsets)
+        if np.asarray(documents).dtype == bool:
+            # Documents stay in order, so a mask of their tokens selects them
+            # without an array of token positions
+            offsets = np.zeros(np.count_nonzero(documents) + 1, dtype=np.int64)
+            np.cumsum(lengths[documents], out=offsets[1:])
+            return TokenCorpus(self.ids[np.repeat(documents, lengths)], offsets, self.tokens)
+        documents = np.arange(len(self))[documents]
+        starts, ends = self.offsets[documents], self.offsets[documents + 1]
+        lengths = ends - starts
+        offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return TokenCorpus(self.ids[positions], offsets, self.tokens)
+
+    def document_of_tokens(self):
+        """
+        Get the document of every token.
+        :return: ndarray of int32
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.offsets))
+
+    def map_tokens(self, func):
+        """
+        Transform every token, calling the function once per distinct token.
+        :param func: function that maps a token string to a list of strings,
+                     eg an empty list to remove the token.
+        :return: TokenCorpus
+        """
+        table = {}
+        outputs = [func(token) for token in self.tokens]
+        lengths = np.fromiter(map(len, outputs), np.int64, len(outputs))
+        flat = np.fromiter((table.setdefault(token, len(table))
+                            for token in chain.from_iterable(outputs)),
+                           np.int32, int(lengths.sum()))
+        tokens = np.array(list(table), dtype=object)
+        if (lengths == 1).all():
+            return TokenCorpus(flat[self.ids], self.offsets.copy(), tokens)
+        if lengths.max(initial=0) <= 1:
+            # Tokens are only kept or removed, which needs no expansion
+            single = np.full(len(lengths), -1, dtype=np.int32)
+            single[lengths == 1] = flat
+            ids = single[self.ids]
+            kept = ids >= 0
+            # Documents with tokens sum the kept tokens up to the next
+            # document with tokens, as those in between have none
+            filled = np.flatnonzero(np.diff(self.offsets) > 0)
+            counts = np.zeros(len(self), dtype=np.int64)
+            counts[filled] = np.add.reduceat(kept, self.offsets[filled], dtype=np.int64)
+            offsets = np.zeros(len(self) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            return TokenCorpus(ids[kept], offsets, tokens)
+        # Each occurrence of a token becomes its outputs, in order
+        first_output = np.cumsum(lengths) - lengths
+        occurrences = lengths[self.ids]
+        total = int(occurrences.sum())
+        first = np.cumsum(occurrences) - occurrences
+        ids = flat[np.repeat(first_output[self.ids] - first, occurrences) + np.arange(total)]
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.document_of_tokens(), weights=occurrences,
+                              minlength=len(self)).astype(np.int64), out=offsets[1:])
+        return TokenCorpus(ids, offsets, tokens)
+
+    def ngram_frequencies(self, n_grams=(1, 1)):
+        """
+        Count the documents that contain each n-gram, as an SK-Learn
+        vectorizer counts the document frequencies of the terms of its
+        word analyzer. Each level of n-grams is counted a chunk of documents
+        at a time, and only the ids of the previous level are kept, so the
+        memory does not grow with the number of levels.
+        :param n_grams: tuple, the minimum and maximum n-gram sizes.
+        :return: tuple of (ndarray of int64, ndarray of str), the number of
+                 documents that contain each n-gram, and its string.
+        """
+        min_n, max_n = n_grams
+        frequencies, strings = [], []
+        gram_ids = self.ids
+        gram_strings = self.tokens
+        for n in range(1, max_n + 1):
+            if n > 1:
+                gram_ids, keys = self._next_grams(gram_ids, n)
+                gram_strings = self._gram_strings(keys, gram_strings)
+                del keys
+            if n >= min_n:
+                frequencies.append(self._document_frequencies(gram_ids, len(gram_strings)))
+                strings.append(gram_strings)
+        return np.concatenate(frequencies), np.concatenate(strings)
+
+    def _chunks(self):
+        """
+        Split the documents into chunks of about COUNT_CHUNK tokens.
+        :return: list of (int, int) tuples, the first and last + 1 document
+                 of each chunk.
+        """
+        bounds = np.searchsorted(self.offsets, np.arange(0, self.offsets[-1], COUNT_CHUNK))
+        bounds = np.unique(np.concatenate([bounds, [len(self)]]))
+        return [(start, end) for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+    def _chunk_documents(self, start, end):
+        """
+        Get the document of every token of a chunk, relative to its first
+        document.
+        :param start: int, the first document of the chunk.
+        :param end: int, the last + 1 document of the chunk.
+        :return: ndarray of int32
+        """
+        return np.repeat(np.arange(end - start, dtype=np.int32),
+                         np.diff(self.offsets[start:end + 1]))
+
+    def _gram_keys(self, gram_ids, n, start, end):
+        """
+        Identify the n-grams of a chunk of documents by their first n-1
+        tokens and their last token.
+        :param gram_ids: ndarray of int32, the id of the (n-1)-gram starting
+                         at each position, -1 if there is none.
+        :param n: int, the n-gram size.
+        :param start: int, the first document of the chunk.
+        :param end: int, the last + 1 document of the chunk.
+        :return: tuple of (ndarray of int64, ndarray of int64), the position
+                 of each n-gram and its key, (n-1)-gram id * number of token
+                 ids + token id.
+        """
+        first, last = self.offsets[start], self.offsets[end]
+        doc_of = self._chunk_documents(start, end)
+        valid = np.flatnonzero(gram_ids[first:max(first, last - n + 1)] >= 0)
+        valid = valid[doc_of[valid + n - 1] == doc_of[valid]] + first
+        keys = gram_ids[valid].astype(np.int64) * len(self.tokens) + self.ids[valid + n - 1]
+        return valid, keys
+
+    def _next_grams(self, gram_ids, n):
+        """
+        Number the n-grams from the ids of the (n-1)-grams.
+        :param gram_ids: ndarray of int32, the id of the (n-1)-gram starting
+                         at each position, -1 if there is none.
+        :param n: int, the n-gram size.
+        :return: tuple of (ndarray of int32, ndarray of int64), the id of the
+                 n-gram starting at each position, -1 if there is none, and
+                 the sorted key of each id, as _gram_keys.
+        """
+        chunks = self._chunks()
+        keys = np.unique(np.concatenate(
+            [np.unique(self._gram_keys(gram_ids, n, start, end)[1]) for start, end in chunks]
+            + [np.empty(0, dtype=np.int64)]))
+        next_ids = np.full(len(self.ids), -1, dtype=np.int32)
+        for start, end in chunks:
+            positions, chunk_keys = self._gram_keys(gram_ids, n, start, end)
+            next_ids[positions] = np.searchsorted(keys, chunk_keys)
+        return next_ids, keys
+
+    def _document_frequencies(self, gram_ids, n_ids):
+        """
+        Count the documents that contain each n-gram.
+        :param gram_ids: ndarray of int32, the id of the n-gram starting at
+                         each position, -1 if there is none.
+        :param n_ids: int, the number of n-gram ids.
+        :return: ndarray of int64
+        """
+        frequencies = np.zeros(n_ids, dtype=np.int64)
+        for start, end in self._chunks():
+            ids = gram_ids[self.offsets[start]:self.offsets[end]]
+            present = ids >= 0
+            # Each n-gram is counted once per document
+            pairs = np.unique(self._chunk_documents(start, end)[present].astype(np.int64)
+                              * n_ids + ids[present])
+            frequencies += np.bincount(pairs % n_ids, minlength=n_ids)
+        return frequencies
+
+    def _gram_strings(self, keys, previous_strings):
+        """
+        Build the strings of n-grams from the strings of their first n-1
+        tokens and the string of their last token.
+        :param keys: ndarray of int64, the key of each n-gram,
+                     (n-1)-gram id * number of token ids + token id.
+        :param previous_strings: ndarray of str, the (n-1)-gram strings.
+        :return: ndarray of str
+        """
+        prefixes, last = np.divmod(keys, len(self.tokens))
+        strings = np.empty(len(keys), dtype=object)
+        strings[:] = [prefix + " " + token for prefix, token in
+                      zip(previous_strings[prefixes].tolist(), self.tokens[last].tolist())]
+        return strings
+
+    def save(self, path):
+        """
+        Save the corpus to a directory, as ids.npy, offsets.npy, and the
+        UTF-8 bytes and offsets of the string table.
+        :param path: str, the directory to save to.
+        """
+        os.makedirs(path, exist_ok=True)
+        encoded = [token.encode("utf-8") for token in self.tokens]
+        token_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(token) for token in encoded], out=token_offsets[1:])
+        np.save(os.path.join(path, "ids.npy"), self.ids)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "token_offsets.npy"), token_offsets)
+        with open(os.path.join(path, "tokens.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+        with open(os.path.join(path, "corpus.json"), "w") as f:
+            json.dump({"documents": len(self), "tokens": len(self.ids),
+                       "distinct_tokens": len(self.tokens)}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a corpus saved with save.
+        :param path: str, the directory.
+        :param mmap: bool, memory-map the token ids and offsets rather than
+                     reading them into memory.
+        :return: TokenCorpus
+        """
+        mode = "r" if mmap else None
+        token_offsets = np.load(os.path.join(path, "token_offsets.npy"))
+        with open(os.path.join(path, "tokens.bin"), "rb") as f:
+            data = f.read()
+        tokens = np.array([data[start:end].decode("utf-8") for start, end
+                           in zip(token_offsets[:-1].tolist(), token_offsets[1:].tolist())],
+                          dtype=object)
+        return cls(np.load(os.path.join(path, "ids.npy"), mmap_mode=mode),
+                   np.load(os.path.join(path, "offsets.npy"), mmap_mode=mode), tokens)
+
+
+class NGramVocabulary:
+    """
+    The terms of a fitted vocabulary as n-grams of token ids, so that the
+    vocabulary terms of a token corpus are counted from its ids, without
+    building n-gram strings. Like TokenCorpus.ngram_frequencies, an n-gram is
+    identified by the id of its first n-1 tokens and the id of its last
+    token, and only the n-grams that start a vocabulary term have an id.
+    """
+    def __init__(self, vocabulary):
+        """
+        Instantiate the n-grams.
+        :param vocabulary: dict mapping each term, a space separated n-gram,
+                           to its feature column.
+        """
+        self.n_columns = len(vocabulary)
+        split = [term.split(" ") for term in vocabulary]
+        lengths = np.fromiter(map(len, split), np.int64, len(split))
+        codes, uniques = pd.factorize(list(chain.from_iterable(split)))
+        self.tokens = pd.Index(uniques)
+        starts = np.cumsum(lengths) - lengths
+        columns = np.fromiter(vocabulary.values(), np.int64, len(vocabulary))
+        # The sorted keys of the k-grams that start a term, and the column
+        # of each, -1 if it is not a term itself
+        self.keys, self.columns = [], []
+        prefix = np.zeros(len(split), dtype=np.int64)
+        for n in range(1, lengths.max(initial=0) + 1):
+            terms = np.flatnonzero(lengths >= n)
+            keys = codes[starts[terms] + n - 1].astype(np.int64)
+            if n > 1:
+                keys += prefix[terms] * len(self.tokens)
+            unique_keys = np.unique(keys)
+            prefix[terms] = np.searchsorted(unique_keys, keys)
+            ends = lengths[terms] == n
+            gram_columns = np.full(len(unique_keys), -1, dtype=np.int64)
+            gram_columns[prefix[terms[ends]]] = columns[terms[ends]]
+            self.keys.append(unique_keys)
+            self.columns.append(gram_columns)
+
+    def counts(self, corpus, n_grams=(1, 1), dtype=np.int64, analyze=None):
+        """
+        Count the vocabulary terms of every document of a corpus, as the
+        word analyzer of an SK-Learn vectorizer counts them.
+        The documents are analyzed and counted a chunk of about COUNT_CHUNK
+        tokens at a time, so no analyzed copy of the corpus is made.
+        :param corpus: TokenCorpus of the documents.
+        :param n_grams: tuple, the minimum and maximum n-gram sizes.
+        :param dtype: the dtype of the counts.
+        :param analyze: function that maps a token of the corpus to its list
+                        of terms, before n-grams are joined, called once per
+                        distinct token. If None, the tokens are the terms.
+        :return: scipy sparse CSR matrix, the count of each vocabulary
+                 column in each document.
+        """
+        min_n, max_n = n_grams
+        max_n = min(max_n, len(self.keys))
+        outputs = [[token] if analyze is None else analyze(token)
+                   for token in corpus.tokens.tolist()]
+        lengths = np.fromiter(map(len, outputs), np.int64, len(outputs))
+        first_output = np.cumsum(lengths) - lengths
+        flat = self.tokens.get_indexer(pd.Index(list(chain.from_iterable(outputs)),
+                                                dtype=object))
+        matrices = [sparse.csr_matrix((0, self.n_columns), dtype=dtype)]
+        for start, end in corpus._chunks():
+            # Each occurrence of a token becomes its terms, in order, and
+            # terms that are not in the vocabulary are -1
+            tokens = corpus.ids[corpus.offsets[start]:corpus.offsets[end]]
+            occurrences = lengths[tokens]
+            first = np.cumsum(occurrences) - occurrences
+            ids = flat[np.repeat(first_output[tokens] - first, occurrences)
+                       + np.arange(occurrences.sum())]
+            doc_of = np.repeat(corpus._chunk_documents(start, end), occurrences)
+            rows, columns = [], []
+            gram_ids = self._lookup(0, ids)
+            for n in range(1, max_n + 1):
+                if n > 1:
+                    valid = np.flatnonzero(gram_ids[:max(0, len(ids) - n + 1)] >= 0)
+                    valid = valid[(doc_of[valid + n - 1] == doc_of[valid])
+                                  & (ids[valid + n - 1] >= 0)]
+                    next_ids = np.full(len(ids), -1, dtype=np.int64)
+                    next_ids[valid] = self._lookup(
+                        n - 1, gram_ids[valid] * len(self.tokens) + ids[valid + n - 1])
+                    gram_ids = next_ids
+                if n >= min_n:
+                    present = np.flatnonzero(gram_ids >= 0)
+                    gram_columns = self.columns[n - 1][gram_ids[present]]
+                    found = gram_columns >= 0
+                    rows.append(doc_of[present[found]])
+                    columns.append(gram_columns[found])
+            rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+            columns = np.concatenate(columns) if columns else np.empty(0, dtype=np.int64)
+            # Duplicate terms of a document are summed
+            matrices.append(sparse.csr_matrix((np.ones(len(rows), dtype=dtype), (rows, columns)),
+                                              shape=(end - start, self.n_columns)))
+        x = sparse.vstack(matrices, format="csr")
+        if x.shape[0] < len(corpus):
+            # A corpus without tokens has no chunks
+            x.resize(len(corpus), self.n_columns)
+        x.sort_indices()
+        return x
+
+    def _lookup(self, level, keys):
+        """
+        Find the ids of n-grams by their keys.
+        :param level: int, n - 1.
+        :param keys: ndarray of int64, the keys of the n-grams, negative if
+                     there is none.
+        :return: ndarray of int64, the id of each n-gram, -1 if it does
+                 not start a vocabulary term.
+        """
+        known = self.keys[level]
+        if len(known) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        ids = np.minimum(np.searchsorted(known, keys), len(known) - 1)
+        ids[(known[ids] != keys) | (keys < 0)] = -1
+        return ids
+
+
+if __name__ == "__main__":
+    import argparse
+    from .nlp_processing import NLPProcessing
+    from .utils import import_data
+
+    parser = argparse.ArgumentParser(
+        description="Clean job descriptions and save them as a token id corpus.")
+    parser.add_argument("bucket", help='S3 bucket of the data, or "local"')
+    parser.add_argument("filename", help="name of the data file")
+    parser.add_argument("output", help="directory to save the corpus to")
+    parser.add_argument("--n-jobs", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.bucket == "local":
+        df = pd.read_csv(args.filename)
+    else:
+        df = import_data(args.bucket, args.filename)
+    descriptions = df["job_description"].dropna()
+    corpus = TokenCorpus.from_texts(
+        NLPProcessing(n_jobs=args.n_jobs)._preprocess(descriptions, stem=False))
+    corpus.save(args.output)
+    print("{} documents, {} tokens, {} distinct tokens".format(
+        len(corpus), len(corpus.ids), len(corpus.tokens)))
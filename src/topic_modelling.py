@@ -1,11 +1,323 @@
 """
 Code to perform topic modelling.
+The TopicEngine cleans and stems/lemmatizes the corpus once, vectorizes it
+with one vocabulary shared by every city, and fits a topic model per city,
+in parallel if required. Mini-batch NMF and online LDA models can be
+updated with new postings, eg from a daily scrape, without refitting.
 """
 
 from .nlp_processing import NLPProcessing
+from .corpus_cache import PreprocessedCorpus
+from .dataframe_processing import CITY_LABELS
+from .explain import feature_names
+from .utils import import_data
 from sklearn. decomposition import NMF, LatentDirichletAllocation
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
 import numpy as np
-from .dataframe_processing import create_model_data
+import pandas as pd
+
+try:
+    from sklearn.decomposition import MiniBatchNMF
+except ImportError:
+    # Added in SK-Learn 1.1
+    MiniBatchNMF = None
+
+METHODS = ["nmf", "minibatch_nmf", "lda"]
+
+# The feature matrix used by a topic modelling worker process
+_topic_features = None
+
+
+def _init_topic_worker(features):
+    """
+    Set up a topic modelling worker process.
+    :param features: scipy sparse matrix, the features of every document.
+    """
+    global _topic_features
+    _topic_features = features
+
+
+def _fit_city(model, rows):
+    """
+    Fit a topic model on one city's documents.
+    :param model: an unfitted SK-Learn topic model.
+    :param rows: ndarray of int, the rows of the city's documents.
+    :return: tuple of (model, ndarray), the fitted model and the topic
+             weights of each document.
+    """
+    doc_topics = model.fit_transform(_topic_features[rows])
+    return model, doc_topics
+
+
+def top_words(h, num_words):
+    """
+    Find the columns of the largest weights of each topic, without sorting
+    every weight.
+    :param h: ndarray, the topic-word matrix, eg the H-matrix from
+              non-negative matrix factorization.
+    :param num_words: int, the number of words per topic.
+    :return: ndarray of int of shape (n_topics, num_words), the columns of
+             each topic's words, largest weight first.
+    """
+    num_words = min(num_words, h.shape[1])
+    if num_words < h.shape[1]:
+        top = np.argpartition(-h, num_words - 1, axis=1)[:, :num_words]
+    else:
+        top = np.tile(np.arange(h.shape[1]), (h.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(h, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+class CityTopics:
+    """
+    The topics found in one city's job postings.
+    """
+    def __init__(self, city, model, feature_names, index, doc_topics, n_words=10):
+        """
+        Instantiate the results.
+        :param city: str, the city term.
+        :param model: the fitted SK-Learn topic model.
+        :param feature_names: ndarray of str, the term of each feature.
+        :param index: ndarray, the DataFrame index of each document.
+        :param doc_topics: ndarray, the topic weights of each document.
+        :param n_words: int, the number of words per topic.
+        """
+        self.city = city
+        self.model = model
+        self.feature_names = feature_names
+        self.index = index
+        self.doc_topics = doc_topics
+        self.n_words = n_words
+
+    @property
+    def components(self):
+        """
+        The topic-word matrix.
+        """
+        return self.model.components_
+
+    def topics(self, n_words=None):
+        """
+        Get the top words of each topic.
+        :param n_words: int, the number of words per topic, if not n_words.
+        :return: tuple of (ndarray of str, ndarray of float), the words and
+                 their weights, one row per topic, largest weight first.
+        """
+        top = top_words(self.components, n_words or self.n_words)
+        return (self.feature_names[top],
+                np.take_along_axis(self.components, top, axis=1))
+
+    def to_frame(self, n_words=None):
+        """
+        Get the top words of each topic as a table.
+        :param n_words: int, the number of words per topic, if not n_words.
+        :return: Pandas DataFrame with city, topic, rank, word and weight
+                 columns.
+        """
+        words, weights = self.topics(n_words)
+        n_topics, n_top = words.shape
+        return pd.DataFrame({"city": self.city,
+                             "topic": np.repeat(np.arange(n_topics), n_top),
+                             "rank": np.tile(np.arange(n_top), n_topics),
+                             "word": words.ravel(),
+                             "weight": weights.ravel()})
+
+
+class TopicEngine:
+    """
+    Finds the topics of the job postings of each city.
+    """
+    def __init__(self, n_topics=10, n_words=10, method="nmf", stemlem="",
+                 min_df=0.01, max_df=0.95, n_grams=(1, 2), use_stopwords=True,
+                 batch_size=1024, n_jobs=1, random_state=None, feature_store=None):
+        """
+        Instantiate the engine.
+        :param n_topics: int, the number of topics per city.
+        :param n_words: int, the number of words per topic.
+        :param method: str, "nmf" for full batch NMF, "minibatch_nmf" for
+                       mini-batch NMF or "lda" for online latent Dirichlet
+                       allocation on term counts. The last two can be
+                       updated with new postings.
+        :param stemlem: str, the stemming/lemmatizing methods to use.
+        :param min_df: float or int, minimum document frequency of term.
+        :param max_df: float or int, maximum document frequency of term.
+        :param n_grams: tuple, the minimum and maximum n-gram sizes.
+        :param use_stopwords: bool, remove stop words or not.
+        :param batch_size: int, the mini-batch size of online models.
+        :param n_jobs: int, the number of processes used to preprocess the
+                       corpus and fit the cities' models. -1 uses every CPU.
+        :param random_state: int, seed for the topic models.
+        :param feature_store: FeatureStore, reuse the processed documents of
+                              previous runs, if applicable.
+        """
+        if method not in METHODS:
+            raise ValueError("method must be one of {}".format(METHODS))
+        if method == "minibatch_nmf" and MiniBatchNMF is None:
+            raise ValueError("minibatch_nmf requires SK-Learn 1.1 or later")
+        self.n_topics = n_topics
+        self.n_words = n_words
+        self.method = method
+        self.batch_size = batch_size
+        self.n_jobs = (os.cpu_count() or 1) if n_jobs == -1 else max(1, n_jobs)
+        self.random_state = random_state
+        self.processing = NLPProcessing(stemlem, min_df, max_df, len(CITY_LABELS),
+                                        n_grams, use_stopwords,
+                                        "count" if method == "lda" else "tfidf",
+                                        n_jobs=self.n_jobs, feature_store=feature_store)
+        self.results = {}
+
+    def _new_model(self):
+        """
+        Create an unfitted topic model.
+        :return: SK-Learn topic model
+        """
+        if self.method == "nmf":
+            return NMF(n_components=self.n_topics, random_state=self.random_state)
+        if self.method == "minibatch_nmf":
+            return MiniBatchNMF(n_components=self.n_topics, batch_size=self.batch_size,
+                                random_state=self.random_state)
+        return LatentDirichletAllocation(n_components=self.n_topics,
+                                         learning_method="online",
+                                         batch_size=self.batch_size,
+                                         random_state=self.random_state)
+
+    def fit(self, data, cities=None):
+        """
+        Find the topics of each city.
+        Postings are processed as by create_model_data, separately for each
+        city. The vocabulary is fit on the cleaned postings of every city.
+        :param data: Pandas DataFrame containing data.
+        :param cities: list of str, the city terms to model. Defaults to
+                       every city in the data.
+        :return: dict mapping each city term to its CityTopics.
+        """
+        if cities is None:
+            cities = [city for city in CITY_LABELS
+                      if (data["city_term"] == city).any()]
+        data = data[data["city_term"].isin(cities)]
+        corpus = PreprocessedCorpus(data, self.processing, len(CITY_LABELS))
+        city_terms = data["city_term"].values
+        city_rows = {city: corpus.rows(np.flatnonzero(city_terms == city))
+                     for city in cities}
+        rows = np.unique(np.concatenate(list(city_rows.values())))
+        features = self._fit_features(corpus, rows)
+        names = feature_names(self.processing.vectorize)
+
+        # The position of each city's documents in the feature matrix
+        tasks = [(self._new_model(), np.searchsorted(rows, city_rows[city]))
+                 for city in cities]
+        if self.n_jobs == 1 or len(tasks) == 1:
+            _init_topic_worker(features)
+            fitted = [_fit_city(*task) for task in tasks]
+            _init_topic_worker(None)
+        else:
+            with ProcessPoolExecutor(min(self.n_jobs, len(tasks)),
+                                     initializer=_init_topic_worker,
+                                     initargs=(features,)) as pool:
+                fitted = list(pool.map(_fit_city, *zip(*tasks)))
+        self.results = {city: CityTopics(city, model, names,
+                                         data.index.values[city_rows[city]],
+                                         doc_topics, self.n_words)
+                        for city, (model, doc_topics) in zip(cities, fitted)}
+        return self.results
+
+    def update(self, data):
+        """
+        Update the topic models of each city with new postings, using the
+        existing vocabulary. Only mini-batch NMF and online LDA models can
+        be updated.
+        :param data: Pandas DataFrame containing the new data.
+        :return: dict mapping each updated city term to the CityTopics of
+                 its new postings.
+        """
+        if self.method == "nmf":
+            raise ValueError("Full batch NMF models cannot be updated, use "
+                             "minibatch_nmf or lda")
+        if not self.results:
+            raise AttributeError("Must fit the topic models before updating them")
+        corpus = PreprocessedCorpus(data, self.processing, len(CITY_LABELS))
+        city_terms = data["city_term"].values
+        names = feature_names(self.processing.vectorize)
+        updated = {}
+        for city, result in self.results.items():
+            rows = corpus.rows(np.flatnonzero(city_terms == city))
+            if len(rows) == 0:
+                continue
+            features = self._features(corpus, rows)
+            result.model.partial_fit(features)
+            updated[city] = CityTopics(city, result.model, names,
+                                       data.index.values[rows],
+                                       result.model.transform(features), self.n_words)
+        return updated
+
+    def _fit_features(self, corpus, rows):
+        """
+        Fit the vectorizer on the cleaned postings and vectorize every
+        posting, from the term counts in the feature store if there is one.
+        :param corpus: PreprocessedCorpus
+        :param rows: ndarray of int, the corpus rows of the postings.
+        :return: scipy sparse matrix
+        """
+        fit_rows = rows[corpus.cleaned[rows]]
+        store = self.processing.feature_store
+        if store is None:
+            self.processing._do_vectorize(corpus.stemmed[fit_rows])
+            return self.processing.vectorize.transform(corpus.text[rows])
+        counts, terms = store.counts(self.processing, list(corpus.keys[fit_rows]),
+                                     lambda positions: corpus.stemmed[fit_rows[positions]],
+                                     True)
+        columns = self.processing._fit_counts(counts, terms)
+        counts, _ = store.counts(self.processing, list(corpus.keys[rows]),
+                                 lambda positions: corpus.text[rows[positions]], False)
+        return self.processing._transform_counts(counts, columns)
+
+    def _features(self, corpus, rows):
+        """
+        Vectorize postings with the fitted vectorizer, reusing the stored rows
+        of the vectorizer if there is a feature store.
+        :param corpus: PreprocessedCorpus
+        :param rows: ndarray of int, the corpus rows of the postings.
+        :return: scipy sparse matrix
+        """
+        store = self.processing.feature_store
+        if store is None:
+            return self.processing.vectorize.transform(corpus.text[rows])
+        return store.features(self.processing, list(corpus.keys[rows]),
+                              lambda positions: corpus.text[rows[positions]], False)
+
+    def topics_frame(self, n_words=None):
+        """
+        Get the top words of every city's topics as one table.
+        :param n_words: int, the number of words per topic, if not n_words.
+        :return: Pandas DataFrame, as CityTopics.to_frame.
+        """
+        return pd.concat([result.to_frame(n_words) for result in self.results.values()],
+                         ignore_index=True)
+
+    def save(self, path):
+        """
+        Save the results: topics.csv with the top words of every topic,
+        vocabulary.npy with the term of each feature, and a <city>.npz file
+        per city with the topic-word matrix, and the DataFrame index and
+        topic weights of each document.
+        :param path: str, the directory to save to.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.topics_frame().to_csv(os.path.join(path, "topics.csv"), index=False)
+        np.save(os.path.join(path, "vocabulary.npy"),
+                feature_names(self.processing.vectorize).astype(str))
+        for city, result in self.results.items():
+            index = result.index.astype(str) if result.index.dtype == object else result.index
+            np.savez_compressed(os.path.join(path, city + ".npz"),
+                                components=result.components, index=index,
+                                doc_topics=result.doc_topics)
+        with open(os.path.join(path, "settings.json"), "w") as f:
+            json.dump({"method": self.method, "n_topics": self.n_topics,
+                       "n_words": self.n_words, "cities": list(self.results)}, f)
+
 
 def topic_modelling(df, city, n_words=10, n_topics=10):
     """
@@ -13,16 +325,12 @@ def topic_modelling(df, city, n_words=10, n_topics=10):
     :param df: Pandas DataFrame, the data to analyze.
     :param city: str, the city to analyze.
     :param n_words: int, the number of words per topic
-    :return: n_topics: int, number of topics to use.
+    :param n_topics: int, number of topics to use.
+    :return: CityTopics, the topics of the city.
     """
-    p = NLPProcessing(stemlem="", min_df=0.01, max_df=0.95, num_cities=4, n_grams=(1, 2), use_stopwords=True)
-    model = NMF(n_components = n_topics)
-    df = create_model_data(df[df["city_term"] == city], num_cities=4)
-    features = p.fit_transform(df)
-    column_names = np.array(p.vectorize.get_feature_names())
-    model.fit(features).transform(features)
-    h_sk= model.components_
-    words_and_topics(h_sk, column_names, n_words)
+    result = TopicEngine(n_topics, n_words).fit(df, cities=[city])[city]
+    words_and_topics(result.components, result.feature_names, n_words)
+    return result
 
 
 def words_and_topics(h, words, num_words):
@@ -33,6 +341,32 @@ def words_and_topics(h, words, num_words):
     :param num_words: int, the number of words per topic
     :return:
     """
-    topics = np.flip(h.argsort(axis = 1), axis=1)[:, :num_words]
+    topics = top_words(h, num_words)
     for topic in topics:
-        print(words[topic])
\ No newline at end of file
+        print(words[topic])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find the topics of the job postings of every city.")
+    parser.add_argument("bucket", help='S3 bucket of the data, or "local"')
+    parser.add_argument("filename", help="name of the data file")
+    parser.add_argument("output", help="directory to save the results to")
+    parser.add_argument("--cities", nargs="+", default=None,
+                        help="city terms to model (default: every city)")
+    parser.add_argument("--method", choices=METHODS, default="nmf")
+    parser.add_argument("--n-topics", type=int, default=10)
+    parser.add_argument("--n-words", type=int, default=10)
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--random-state", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.bucket == "local":
+        df = pd.read_csv(args.filename)
+    else:
+        df = import_data(args.bucket, args.filename)
+    engine = TopicEngine(args.n_topics, args.n_words, args.method, n_jobs=args.n_jobs,
+                         random_state=args.random_state)
+    engine.fit(df, args.cities)
+    engine.save(args.output)
+    print(engine.topics_frame().to_string())
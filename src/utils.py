@@ -5,23 +5,113 @@ Assorted utility functions.
 import pandas as pd
 import boto3
 import os
-from io import BytesIO
-from sklearn.feature_extraction import text
+from io import StringIO
 import pickle
 
 
-def import_data(bucket, filename):
+# Columns read as categories when loading compact DataFrames
+CATEGORICAL_COLUMNS = ["city_term", "search_term"]
+# Columns needed to build model data
+MODEL_COLUMNS = ["job_description", "city_term", "search_term"]
+
+
+def import_data(bucket=None, filename=None, store=None, columns=None,
+                compact=False):
     """
     Import a csv file from an s3 bucket into local memory.
+    The object is parsed as it is downloaded, rather than read into memory
+    first.
     Requires AWS keys to be stored in your bash profile.
     :param bucket: str, name of the s3 bucket.
     :param filename: str, the name of the csv file.
+    :param store: ListingStore, if given, the listings are read from the
+                  store instead of the csv file.
+    :param columns: list of str, the columns to read, if applicable.
+    :param compact: bool, read CATEGORICAL_COLUMNS as categories.
     :return: Pandas Dataframe containing the data.
     """
+    if store is not None:
+        df = store.read(columns=columns)
+        return _compact(df) if compact else df
+    s3 = boto3.client("s3", aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
+                      aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"])
+    obj = s3.get_object(Bucket=bucket, Key=filename)
+    return _read_csv(obj["Body"], columns, compact)
+
+
+def _read_csv(source, columns=None, compact=False, chunksize=None):
+    """
+    Parse a csv file, optionally in chunks.
+    :param source: str or file-like object, the csv file.
+    :param columns: list of str, the columns to read, if they exist.
+    :param compact: bool, read CATEGORICAL_COLUMNS as categories.
+    :param chunksize: int, the number of rows in each chunk, if applicable.
+    :return: Pandas DataFrame, or an iterator of DataFrames if chunksize is given.
+    """
+    dtype = None
+    if compact:
+        dtype = {column: "category" for column in CATEGORICAL_COLUMNS
+                 if columns is None or column in columns}
+    usecols = None if columns is None else columns.__contains__
+    return pd.read_csv(source, usecols=usecols, dtype=dtype, chunksize=chunksize)
+
+
+def _compact(df):
+    """
+    Convert the CATEGORICAL_COLUMNS of a DataFrame to categories.
+    :param df: Pandas DataFrame
+    :return: Pandas DataFrame
+    """
+    return df.astype({column: "category" for column in CATEGORICAL_COLUMNS
+                      if column in df.columns})
+
+
+def iter_data(bucket=None, filename=None, store=None, chunksize=10000,
+              since=None, columns=None, compact=False):
+    """
+    Read data in chunks, without loading the whole file into memory.
+    Requires AWS keys to be stored in your bash profile to read from S3.
+    :param bucket: str, name of the s3 bucket, or None to read a local file.
+    :param filename: str, the name of the csv file.
+    :param store: ListingStore, if given, the listings are read from the
+                  store one part file at a time instead.
+    :param chunksize: int, the number of rows in each csv chunk.
+    :param since: datetime.date, only read store partitions from this date on.
+    :param columns: list of str, the columns to read, if applicable.
+    :param compact: bool, read CATEGORICAL_COLUMNS as categories.
+    :return: generator of Pandas DataFrames
+    """
+    if store is not None:
+        for df in store.iter_parts(columns=columns, since=since):
+            yield _compact(df) if compact else df
+        return
+    if bucket is None:
+        yield from _read_csv(filename, columns, compact, chunksize)
+        return
     s3 = boto3.client("s3", aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
                       aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"])
     obj = s3.get_object(Bucket=bucket, Key=filename)
-    return pd.read_csv(BytesIO(obj["Body"].read()))
+    yield from _read_csv(obj["Body"], columns, compact, chunksize)
+
+
+def export_data(df, bucket, filename):
+    """
+    Export a DataFrame as a csv file to an s3 bucket, or to a local file if
+    no bucket is given.
+    Requires AWS keys to be stored in your bash profile.
+    :param df: Pandas DataFrame, the data to export.
+    :param bucket: str, name of the s3 bucket, or None.
+    :param filename: str, the name of the csv file.
+    :return: None, writes the csv file.
+    """
+    if bucket is None:
+        df.to_csv(filename, index=False)
+        return
+    csv_buffer = StringIO()
+    df.to_csv(csv_buffer, index=False)
+    s3 = boto3.resource("s3", aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
+                        aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"])
+    s3.Object(bucket, filename).put(Body=csv_buffer.getvalue())
 
 
 def get_stopwords():
@@ -29,6 +119,7 @@ def get_stopwords():
     Return the list of stopwords that are being used for job classification.
     :return: set, the stopwords to be removed from the corpus
     """
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
     words = {"york", "francisco", "chicago", "ny", "ca", "austin", "chicago",
              "tx", "nyu", "san", "il", "emeryville", "berkeley", "sf", "2017",
              "nyc", "link", "links", "30", "2018", "2019", "palo", "alto",
@@ -42,7 +133,7 @@ def get_stopwords():
              "carequired", "application", "mateo", "copyright", "resume",
              "indeedcom", "keywords", "firefox", "texas", "job", "long island",
              "location south", "illinois"}
-    return text.ENGLISH_STOP_WORDS.union(words)
+    return ENGLISH_STOP_WORDS.union(words)
 
 
 def pickle_model(model_object, output):
@@ -2,8 +2,6 @@
 Web scraper class for the indeed.com website
 """
 
-import requests
-from bs4 import BeautifulSoup
 import pandas as pd
 from sys import argv
 from collections import defaultdict
@@ -11,33 +9,67 @@ from time import sleep
 import os
 import boto3
 from io import StringIO, BytesIO
+from .fetch_engine import FetchEngine
+from .html_parsing import get_parser
+
+BASE_URL = "https://www.indeed.com"
 
 
 class IndeedScraper:
     """
     A class that deploys an indeed web scraper, saving results in an S3 bucket.
     """
-    def __init__(self, bucket, filename, query, location, daily=False):
+    def __init__(self, bucket, filename, query, location, daily=False,
+                 concurrency=1, fetcher=None, base_url=BASE_URL, store=None,
+                 seen_index=None, parser=None):
         """
         Function that is called when the class is instantiated.
         An object is created for each search query and city separately.
         :param query: str, the job search term.
         :param location: str, the city to be searched.
-        :param bucket: str, AWS S3 bucket where data is stored.
+        :param bucket: str, AWS S3 bucket where data is stored. If None,
+                       the data is stored in a local file instead.
         :param filename: str, filename of data.
         :param daily: bool, indicates full scrape or daily update.
-        """
-        self.url = ''.join(["https://www.indeed.com/jobs?q=", query, "&l=",
+        :param concurrency: int, the number of job description pages to fetch
+                            at once. If 1, pages are fetched serially with a
+                            pause between each one.
+        :param fetcher: FetchEngine, a shared fetch engine, if applicable.
+        :param base_url: str, the scheme and host of the site to scrape.
+        :param store: ListingStore, if given, new listings are appended to the
+                      store instead of rewriting the whole data file.
+        :param seen_index: SeenURLIndex, listings whose URLs are in the index
+                           are skipped without fetching their description.
+        :param parser: str, the HTML parser to use (see html_parsing.PARSERS).
+                       Defaults to the fastest one installed.
+        """
+        self.base_url = base_url
+        self.url = ''.join([base_url, "/jobs?q=", query, "&l=",
                             location, "&radius=15&sort=date&limit=50"])
         self.query = query
         self.city = location
         self.filename = filename
         self.s3_bucket = bucket
-        self.df = self._access_s3_to_df()
+        self.store = store
+        self.df = None
+        self.stored_urls = set()
+        if store is None:
+            self.df = self._load_df()
+        else:
+            # Listings without a description are written again when a retry
+            # fetches it
+            self.stored_urls = store.urls(self.city, self.query, described=True)
+        self.n_saved = 0
+        self.seen_index = seen_index
+        self.page_urls = set()
         self.flag = True
         self.listings = defaultdict(list)
-        self.soup = None
+        self.page = None
+        self.parser = get_parser(parser)
         self.daily = daily
+        self.concurrency = concurrency
+        self.fetcher = fetcher if fetcher is not None \
+            else FetchEngine(max_workers=concurrency)
 
     def run_scraper(self):
         """
@@ -45,36 +77,52 @@ class IndeedScraper:
         """
         # Run the scraper until it runs out of pages to scrape
         while self.flag:
-            self.soup = self._create_soup(self.url)
+            # Results pages change daily, so are always revalidated
+            html = self.fetcher.get(self.url, max_age=0)
+            if html is None:
+                break
+            self.page = self.parser.parse_results(html)
             self._check_flag()
-            for div in self.soup.find_all(name="div", attrs={"class": "row"}):
-                self._add_listing_info(div)
+            for row in self.page.rows:
+                self._add_listing_info(row)
                 if not self.flag:   # Stop if daily update is finished.
                     break
-                sleep(2)
-            # Save the file after each results page
-            self.df = self.df.append(pd.DataFrame(self.listings), ignore_index=True)
+                if self.concurrency == 1:
+                    sleep(2)
+            # Fetch the descriptions for the whole results page at once
+            if self.concurrency > 1:
+                self._get_job_descriptions(self.listings["url"])
+            # Save the new listings after each results page
+            self._save_listings()
             self.listings = defaultdict(list)
-            self._write_file_to_s3()
+            self.page_urls = set()
             self._get_next_url()
-            sleep(2)
+            if self.concurrency == 1:
+                sleep(2)
 
-    @staticmethod
-    def _create_soup(url):
+    def _save_listings(self):
         """
-        Get the HTML contents of the URL.
-        If the URL does not exist, or an errors is thrown, then self.soup is
-        assigned None.
-        :param: url: str, the url to get the HTML from
-        :return soup: a BS4 object of the webpage's HTML
+        Save the listings from the current results page.
+        With a store, only listings that are not already stored are written,
+        as a new part file. Otherwise the whole data file is rewritten.
         """
-        try:
-            page = requests.get(url)
-            if page.status_code == 404:
-                return None
-            return BeautifulSoup(page.text, "html.parser")
-        except:
-            return None
+        if not self.listings["url"]:
+            return
+        page = pd.DataFrame(self.listings)
+        if self.store is not None:
+            page = page[~page["url"].isin(self.stored_urls)]
+            self.store.append(page)
+            self.stored_urls.update(page.loc[page["job_description"] != "N/A", "url"])
+        else:
+            self.df = pd.concat([self.df, page], ignore_index=True)
+            self._write_file()
+        self.n_saved += len(page)
+        if self.seen_index is not None:
+            # Listings whose description could not be fetched are retried
+            # on the next run
+            self.seen_index.add_many(url for url, description in
+                                     zip(self.listings["url"], self.listings["job_description"])
+                                     if description != "N/A")
 
     def _check_flag(self):
         """
@@ -82,26 +130,25 @@ class IndeedScraper:
         If there is a next page, set self.flag = True, and if there is
         not, set self.flag = False.
         """
-        all_np_tags = self.soup.find_all(name="span", attrs={"class": "np"})
-        self.flag = any(["Next" in tag.text for tag in all_np_tags])
+        self.flag = self.page.has_next
 
     def _get_next_url(self):
         """
         Update the object with the URL of the next listings page.
         """
-        d = self.soup.find(name="div", attrs={"class": "pagination"})
-        if d is None:  # This occurs if there is only one page of results
+        # There is no pagination if there is only one page of results
+        if self.page.next_href is None:
             return
-        self.url = ''.join(["https://www.indeed.com", d.find_all("a")[-1]["href"]])
+        self.url = ''.join([self.base_url, self.page.next_href])
 
-    def _add_listing_info(self, div):
+    def _add_listing_info(self, row):
         """
         Get the results of scraping a single job listing.
-        :param div: BS4 div object containing the job listing
+        :param row: dict, the fields extracted from the job listing
         """
-        job_url = self._get_url_link(div)
+        job_url = row["url"]
         # If link is a duplicate on the current run, then don't add it
-        if job_url in set(self.listings["url"]):
+        if job_url in self.page_urls:
             return
 
         # Extra code checks for the daily updates:
@@ -110,42 +157,35 @@ class IndeedScraper:
             if "pagead" in job_url:
                 return
             # If job wasn't posted today, then skip it and stop scraping
-            if not self._get_today(div):
+            if not self._get_today(row):
                 self.flag = False
                 return
 
+        # Skip listings that have been scraped before
+        if self.seen_index is not None and job_url in self.seen_index:
+            return
+        self.page_urls.add(job_url)
+
         # Add the job spec details
-        self._get_job_title(div)
-        self._get_location(div)
-        self._get_company_name(div)
-        self._get_job_description(job_url)
+        self.listings["job_title"] += [row["job_title"]]
+        self.listings["location"] += [row["location"]]
+        self.listings["company"] += [row["company"]]
+        if self.concurrency == 1:
+            self._get_job_description(job_url)
         self.listings["jobsite"] += ["Indeed"]
         self.listings["url"] += [job_url]
         self.listings["search_term"] += [self.query]
         self.listings["city_term"] += [self.city]
 
     @staticmethod
-    def _get_url_link(div):
-        """
-        Extract the URL link from the div tag.
-        :param div: tag object, the div tag from a job posting
-        :return job_url: str, the URL of the job posting
-        """
-        a = div.find(name="a", attrs={"data-tn-element": "jobTitle"})
-        return a["href"]
-
-    @staticmethod
-    def _get_today(div):
+    def _get_today(row):
         """
         Get the day that the job was posted, and return True if today
-        :param div: A single job posting
+        :param row: dict, the fields extracted from a single job posting
         :return flag: a Boolean indicating whether the job was posted
                       "Today" or "Just posted"
         """
-        date_tag = div.find(name="span", attrs={"class": "date"})
-        if date_tag.text == "Today" or date_tag.text == "Just posted":
-            return True
-        return False
+        return row["date"] in ("Today", "Just posted")
 
     def get_number_of_jobs(self):
         """
@@ -153,65 +193,56 @@ class IndeedScraper:
         Currently unused when called from run from command line.
         :return num_jobs: int, the number of jobs that the search returns.
         """
-        tag = self.soup.find("div", {"id": "searchCount"})
-        n_jobs = tag.text.split(" ")[-2]
-        return int(n_jobs.replace(",", ""))
+        return self.page.job_count
 
-    def _get_job_title(self, div):
+    def _get_job_description(self, link):
         """
-        Extract the job titles from the div tag.
-        :param div: tag object, the div tag from a job posting
+        Get the raw text of the job description from the linked webpage.
+        Return "N/A" if the webpage doesn't exist.
+        :param link: str, the url of the job description webpage
         """
-        a = div.find(name="a", attrs={"data-tn-element": "jobTitle"})
-        self.listings["job_title"] += [a["title"].replace(",", "")]
+        html = self.fetcher.get(''.join([self.base_url, link]))
+        self.listings["job_description"] += [self._extract_description(html)]
 
-    def _get_company_name(self, div):
+    def _get_job_descriptions(self, links):
         """
-        Extract company names from the div tag.
-        If no company name attached, return "N/A"
-        Note company name can appear in one of a couple of different places.
-        :param div: tag object, the div tag from a job posting
+        Concurrently get the raw text of several job descriptions.
+        Return "N/A" for any webpage that doesn't exist.
+        :param links: list of str, the urls of the job description webpages
         """
-        company = div.find(name="span", attrs={"class": "company"})
-        if company is None:
-            self.listings["company"] += ["N/A"]
-            return
-        a = div.find(name="a", attrs={"data-tn-element": "companyName"})
-        if not a:
-            self.listings["company"] += [' '.join(company.text.split()).replace(",", "")]
-        else:
-            self.listings["company"] += [' '.join(a.text.split()).replace(",", "")]
+        pages = self.fetcher.fetch_all([''.join([self.base_url, link])
+                                        for link in links])
+        for html in pages:
+            self.listings["job_description"] += [self._extract_description(html)]
 
-    def _get_location(self, div):
+    def _extract_description(self, html):
         """
-        Extract the location of the job posting from the div tag.
-        :param div: tag object, the div tag from a job posting
+        Extract the visible text from a job description webpage.
+        :param html: str, the webpage's HTML, or None
+        :return: str, the job description text, or "N/A"
         """
-        location = div.find(name="span", attrs={"class": "location"})
-        self.listings["location"] += [location.text.replace(",", "")]
+        if html is None:
+            return "N/A"
+        return self.parser.parse_description(html)
 
-    def _get_job_description(self, link):
+    def _load_df(self):
         """
-        Get the raw text of the job description from the linked webpage.
-        Return "N/A" if the webpage doesn't exist.
-        :param link: str, the url of the job description webpage
+        Load the existing data from S3, or from a local file if no bucket
+        was given.
+        :return df: a DataFrame containing the existing data
         """
-        soup = self._create_soup(''.join(["https://www.indeed.com", link]))
-        if soup is None:
-            self.listings["job_description"] += ["N/A"]
-            return
+        if self.s3_bucket is None:
+            return self._access_local_to_df()
+        return self._access_s3_to_df()
 
-        # Remove all script and style elements
-        for script in soup(["script", "style"]):
-            script.extract()
-        text = soup.get_text()
-        # break into lines and remove leading and trailing space on each
-        lines = (line.strip() for line in text.splitlines())
-        # break multi-headlines into a line each
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        # drop any blank lines
-        self.listings["job_description"] += \
-            ['\n'.join(chunk for chunk in chunks if chunk)]
+    def _access_local_to_df(self):
+        """
+        Load the local data file into a DataFrame.
+        :return df: a DataFrame containing the local data
+        """
+        if os.path.exists(self.filename):
+            return pd.read_csv(self.filename)
+        return self._create_df_new()
 
     def _access_s3_to_df(self):
         """
@@ -236,12 +267,25 @@ class IndeedScraper:
                                      "url", "jobsite", "job_description",
                                      "search_term" "city_term"])
 
+    def _write_file(self):
+        """
+        Save the updated DataFrame to S3, or to a local file if no bucket
+        was given.
+        """
+        if self.s3_bucket is None:
+            # New listings come last, so a retried description replaces
+            # its "N/A" row
+            self.df.drop_duplicates(["url"], keep="last", inplace=True)
+            self.df.to_csv(self.filename, index=False)
+        else:
+            self._write_file_to_s3()
+
     def _write_file_to_s3(self):
         """
         Save the updated DataFrame to a file on the project's AWS S3 bucket.
         """
         csv_buffer = StringIO()
-        self.df.drop_duplicates(["url"], inplace=True)  # Remove any duplicate postings
+        self.df.drop_duplicates(["url"], keep="last", inplace=True)  # Remove any duplicate postings
         self.df.to_csv(csv_buffer, index=False)
         s3 = boto3.resource("s3", aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
                             aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"])
@@ -252,24 +296,18 @@ if __name__ == "__main__":
     """
     Code that runs if called from the command line
     Option 1: To run search across all job queries and cities:
-    Call: python web_scraper.py <s3_bucket> <filename>
+    Call: python -m src.web_scraper <s3_bucket> <filename>
     Option 2: To run search on a single city and query:
-    Call: python web_scraper.py <s3_bucket> <filename> <query> <city>
+    Call: python -m src.web_scraper <s3_bucket> <filename> <query> <city>
     Option 3: To run a daily scraper update:
-    Call python web_scraper.py <s3_bucket> <filename> daily
+    Call python -m src.web_scraper <s3_bucket> <filename> daily
+    Options 1 and 3 run as a parallel sweep, see src/sweep.py for more options.
     """
     # Run a single city / query combination
     if len(argv) == 5:
         scraper = IndeedScraper(argv[1], argv[2], argv[3], argv[4])
         scraper.run_scraper()
     # Run 4 selected cities and 3 relevant queries
-    cities = ["Austin", "Chicago", "San+Francisco", "New+York"]
-    jobs = ["Data+Scientist", "Data+Analyst", "Business+Intelligence"]
     if len(argv) == 3 or len(argv) == 4:
-        for city in cities:
-            for job in jobs:
-                if len(argv) == 3:
-                    scraper = IndeedScraper(argv[1], argv[2], job, city)
-                else:
-                    scraper = IndeedScraper(argv[1], argv[2], job, city, True)
-                scraper.run_scraper()
+        from .sweep import SweepScheduler
+        SweepScheduler(argv[1], argv[2], daily=len(argv) == 4).run()